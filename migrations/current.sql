@@ -1 +1,71 @@
 -- Enter migration here
+
+DROP TABLE IF EXISTS symbol_weights_stream CASCADE;
+
+CREATE TABLE symbol_weights_stream (
+    connector TEXT NOT NULL,
+    symbol_id INT NOT NULL,
+    timestamp TIMESTAMPTZ NOT NULL,
+    weight DOUBLE PRECISION NOT NULL,
+    update_timestamp TIMESTAMPTZ NOT NULL,
+    CONSTRAINT fk_symbol
+        FOREIGN KEY(symbol_id) 
+        REFERENCES symbols(id)
+);
+
+SELECT create_hypertable('symbol_weights_stream', 'timestamp');
+
+ALTER TABLE symbol_weights_stream SET (
+    timescaledb.compress,
+    timescaledb.compress_orderby = 'timestamp DESC',
+    timescaledb.compress_segmentby = 'symbol_id'
+);
+SELECT add_compression_policy('symbol_weights_stream', INTERVAL '7 day');
+
+DROP TABLE IF EXISTS symbol_bbo_stream CASCADE;
+
+CREATE TABLE symbol_bbo_stream (
+    symbol_id INT NOT NULL,
+    timestamp TIMESTAMPTZ NOT NULL,
+    best_bid NUMERIC(32, 18) NOT NULL,
+    best_bid_connector TEXT NOT NULL,
+    best_ask NUMERIC(32, 18) NOT NULL,
+    best_ask_connector TEXT NOT NULL,
+    is_crossed BOOL NOT NULL,
+    update_timestamp TIMESTAMPTZ NOT NULL,
+    CONSTRAINT fk_symbol
+        FOREIGN KEY(symbol_id) 
+        REFERENCES symbols(id)
+);
+
+SELECT create_hypertable('symbol_bbo_stream', 'timestamp');
+
+ALTER TABLE symbol_bbo_stream SET (
+    timescaledb.compress,
+    timescaledb.compress_orderby = 'timestamp DESC',
+    timescaledb.compress_segmentby = 'symbol_id'
+);
+SELECT add_compression_policy('symbol_bbo_stream', INTERVAL '7 day');
+
+DROP TABLE IF EXISTS symbol_cross_rate_stream CASCADE;
+
+CREATE TABLE symbol_cross_rate_stream (
+    symbol_id INT NOT NULL,
+    timestamp TIMESTAMPTZ NOT NULL,
+    rate NUMERIC(32, 18) NOT NULL,
+    hops INT NOT NULL,
+    paths INT NOT NULL,
+    update_timestamp TIMESTAMPTZ NOT NULL,
+    CONSTRAINT fk_symbol
+        FOREIGN KEY(symbol_id) 
+        REFERENCES symbols(id)
+);
+
+SELECT create_hypertable('symbol_cross_rate_stream', 'timestamp');
+
+ALTER TABLE symbol_cross_rate_stream SET (
+    timescaledb.compress,
+    timescaledb.compress_orderby = 'timestamp DESC',
+    timescaledb.compress_segmentby = 'symbol_id'
+);
+SELECT add_compression_policy('symbol_cross_rate_stream', INTERVAL '7 day');
@@ -1,50 +1,239 @@
-import asyncio
+import datetime
 from typing import Optional
 import typer
 import dotenv
 
-from fireagg import data_streams, settings, metrics
+from fireagg import data_streams, event_loop, launcher, settings, metrics
+from fireagg.backtest import run_backtest
+from fireagg.benchmark import run_benchmark
+from fireagg.input_streams.impl._benchmark import RateProfile
 
 cli = typer.Typer()
 distributed = typer.Typer()
 cli.add_typer(distributed, name="distributed")
+control = typer.Typer()
+distributed.add_typer(control, name="control")
 
 
 @cli.command()
 def seed_markets(connector: Optional[str] = None):
-    asyncio.run(data_streams.seed_connectors([connector] if connector else None))
+    event_loop.run(data_streams.seed_connectors([connector] if connector else None))
 
 
 @cli.command()
 def watch_symbol(symbol: str, connector: str = "kraken"):
-    asyncio.run(data_streams.watch_spreads(connector, symbol=symbol))
+    event_loop.run(data_streams.watch_spreads(connector, symbol=symbol))
 
 
 @cli.command()
 def combine_connectors(symbols: list[str], only_connector: Optional[str] = None):
-    asyncio.run(
+    event_loop.run(
         data_streams.combine_connectors(
             symbols, only_connectors=only_connector and [only_connector] or None
         ),
     )
 
 
+@cli.command()
+def record(
+    symbols: list[str],
+    output: str = "recordings",
+    duration_s: Optional[float] = None,
+    only_connector: Optional[str] = None,
+):
+    event_loop.run(
+        data_streams.record_symbols(
+            symbols,
+            output,
+            duration_s=duration_s,
+            only_connectors=only_connector and [only_connector] or None,
+        )
+    )
+
+
+@cli.command()
+def replay(
+    directory: str = "recordings",
+    speed: float = 1,
+    loop: bool = False,
+    distributed: bool = False,
+):
+    """Play back a recording. A speed of 0 replays as fast as possible."""
+    event_loop.run(
+        data_streams.replay_recording(
+            directory, speed=speed, loop=loop, distributed=distributed
+        )
+    )
+
+
+@cli.command()
+def benchmark(
+    symbols: int = 1,
+    duration_s: float = 60,
+    warmup_s: float = 5,
+    profile: str = "flat",
+    base_rate: float = 100,
+    peak_rate: float = 1000,
+    ramp_s: float = 60,
+    burst_every_s: float = 30,
+    burst_s: float = 5,
+    seed: Optional[int] = 42,
+    bus: str = "asyncio",
+    output: Optional[str] = None,
+):
+    """Measure the pipeline throughput and latencies with synthetic symbols.
+    Rates are in trades per second, per symbol. The profile is flat, ramp or burst."""
+    rate_profile = RateProfile(
+        kind=profile,  # type: ignore[arg-type]
+        base_rate=base_rate,
+        peak_rate=peak_rate,
+        ramp_s=ramp_s,
+        burst_every_s=burst_every_s,
+        burst_s=burst_s,
+    )
+    try:
+        rate_profile.validate()
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    event_loop.run(
+        run_benchmark(
+            rate_profile,
+            n_symbols=symbols,
+            duration_s=duration_s,
+            warmup_s=warmup_s,
+            seed=seed,
+            bus=bus,
+            output=output,
+        )
+    )
+
+
+@cli.command()
+def export(
+    output: str = "archive",
+    table: Optional[list[str]] = None,
+    min_age_s: Optional[float] = None,
+    drop: bool = False,
+):
+    """Archive the closed chunks of the stream tables to Parquet files, partitioned
+    by symbol and date. Chunks already archived are skipped."""
+    event_loop.run(
+        data_streams.export_chunks(
+            output, tables=table, min_age_s=min_age_s, drop_chunks=drop
+        )
+    )
+
+
+@cli.command()
+def backtest(
+    symbol: str,
+    start: datetime.datetime,
+    end: Optional[datetime.datetime] = None,
+    archive_dir: Optional[str] = None,
+    output: Optional[str] = None,
+):
+    """Recompute the true mid prices of a symbol over [start, end), from the
+    database, or from the Parquet files of `export` with --archive-dir. Without an
+    output file, the true prices are printed."""
+    true_prices = event_loop.run(
+        run_backtest(symbol, start, end=end, archive_dir=archive_dir, output=output)
+    )
+    if not output:
+        print(true_prices)
+
+
 @distributed.command()
 def core():
-    asyncio.run(
+    event_loop.run(
         data_streams.distributed_core(),
     )
 
 
 @distributed.command()
-def symbols(symbols: list[str], only_connector: Optional[str] = None):
-    asyncio.run(
+def symbols(
+    symbols: list[str], only_connector: Optional[str] = None, processes: int = 1
+):
+    """With more than one process, connectors are sharded across child processes."""
+    only_connectors = only_connector and [only_connector] or None
+    if processes > 1:
+        launcher.run_sharded(symbols, processes, only_connectors=only_connectors)
+        return
+
+    event_loop.run(
         data_streams.distributed_watch_symbols(
-            symbols, only_connectors=only_connector and [only_connector] or None
+            symbols, only_connectors=only_connectors
         ),
     )
 
 
+@distributed.command()
+def worker():
+    """Join the cluster, and run the share of its pairs assigned to this worker."""
+    event_loop.run(data_streams.distributed_cluster_worker())
+
+
+@distributed.command()
+def assign(symbols: list[str], only_connector: Optional[str] = None):
+    """Add symbols, on all their connectors, to the pairs run by the cluster."""
+    event_loop.run(
+        data_streams.cluster_assign(
+            symbols, only_connectors=only_connector and [only_connector] or None
+        )
+    )
+
+
+@distributed.command()
+def unassign(symbols: list[str], only_connector: Optional[str] = None):
+    event_loop.run(
+        data_streams.cluster_unassign(
+            symbols, only_connectors=only_connector and [only_connector] or None
+        )
+    )
+
+
+@distributed.command()
+def status():
+    workers, pairs = event_loop.run(data_streams.cluster_status())
+    print(f"{len(workers)} workers: {', '.join(workers)}")
+    for pair, owner, rate in pairs:
+        rate_str = f"{rate:.1f} msg/s" if rate is not None else "unknown rate"
+        print(f"{pair.connector} {pair.symbol}: {owner or 'unassigned'}, {rate_str}")
+
+
+@control.command(name="watch")
+def control_watch(
+    symbols: list[str],
+    channel: Optional[str] = None,
+    only_connector: Optional[str] = None,
+):
+    """Start watching symbols on the running `distributed symbols` of a channel."""
+    event_loop.run(
+        data_streams.send_control_commands(
+            "watch",
+            symbols,
+            channel=channel,
+            only_connectors=only_connector and [only_connector] or None,
+        )
+    )
+
+
+@control.command(name="unwatch")
+def control_unwatch(
+    symbols: list[str],
+    channel: Optional[str] = None,
+    only_connector: Optional[str] = None,
+):
+    event_loop.run(
+        data_streams.send_control_commands(
+            "unwatch",
+            symbols,
+            channel=channel,
+            only_connectors=only_connector and [only_connector] or None,
+        )
+    )
+
+
 def run():
     dotenv.load_dotenv()
     settings_obj = settings.get()
@@ -1,18 +1,364 @@
-from fastapi import FastAPI
+import asyncio
+import datetime
+import json
+import logging
+from typing import Awaitable, Callable, Literal, Optional
 
-from .database import db, symbols, symbol_prices
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from . import settings
+from .database import storage
+from .event_loop import start_loop_monitor
+from .history import (
+    HistoryStream,
+    encode_arrow,
+    encode_json,
+    history_schema,
+    iter_history_pages,
+)
+from .processing.messages import SymbolTrueMidPrice, now_ms
+from .processing.redis_adapter import (
+    TRUE_PRICES_STREAM_KEY,
+    RedisKVStore,
+    RedisStreamsQueue,
+    redis_client,
+    true_prices_kv_store,
+)
+from .streaming import ClientSubscription, TruePriceBroadcaster
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# Symbols are never renamed, their ids are cached for the process lifetime.
+SYMBOL_IDS: dict[str, int] = {}
+LAST_TRUE_PRICES: Optional[RedisKVStore[SymbolTrueMidPrice]] = None
+BROADCASTER: Optional[TruePriceBroadcaster] = None
+MAX_LAST_PRICE_AGE_S: Optional[float] = None
+BACKGROUND_TASKS: list[asyncio.Task] = []
+
+# SSE comments sent to idle clients, so that proxies keep the connection open.
+SSE_KEEPALIVE_S = 15
+BACKGROUND_RESTART_S = 1
+
+
+@app.on_event("startup")
+async def startup():
+    global LAST_TRUE_PRICES, BROADCASTER, MAX_LAST_PRICE_AGE_S
+    start_loop_monitor()
+    config = settings.get()
+    MAX_LAST_PRICE_AGE_S = config.api_max_last_price_age_s
+    if not config.redis_url:
+        logger.warning("No Redis URL, last prices are read from the storage")
+        return
+
+    client = redis_client()
+    LAST_TRUE_PRICES = true_prices_kv_store(client)
+
+    # A single stream reader for all the streaming clients.
+    true_prices = RedisStreamsQueue(client, SymbolTrueMidPrice, TRUE_PRICES_STREAM_KEY)
+    BROADCASTER = TruePriceBroadcaster(true_prices)
+    BACKGROUND_TASKS.extend(
+        [
+            asyncio.create_task(run_forever(true_prices.run_reader)),
+            asyncio.create_task(run_forever(BROADCASTER.run)),
+        ]
+    )
+
+
+async def run_forever(run: Callable[[], Awaitable]):
+    """Restarts a background loop that fails, e.g. on a Redis error, instead of
+    quietly leaving every streaming client without updates."""
+    while True:
+        try:
+            await run()
+        except Exception:
+            logger.exception(f"{run.__qualname__} failed, restarting")
+        await asyncio.sleep(BACKGROUND_RESTART_S)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    if LAST_TRUE_PRICES:
+        await LAST_TRUE_PRICES.redis.close()
+
+
+async def get_symbol_id(symbol: str) -> Optional[int]:
+    if symbol not in SYMBOL_IDS:
+        async with storage.connect() as store:
+            symbol_obj = await store.get_symbol(symbol)
+        if not symbol_obj:
+            return None
+        SYMBOL_IDS[symbol] = symbol_obj.id
+    return SYMBOL_IDS[symbol]
+
+
+def is_fresh(value: SymbolTrueMidPrice) -> bool:
+    """Older cached prices are read from the storage instead, in case the core
+    stopped writing them to the cache."""
+    if MAX_LAST_PRICE_AGE_S is None:
+        return True
+    return now_ms() - value.timestamp_ms <= MAX_LAST_PRICE_AGE_S * 1000
+
+
+async def get_last_true_price(symbol_id: int) -> Optional[SymbolTrueMidPrice]:
+    if LAST_TRUE_PRICES is None:
+        return None
+    try:
+        return await LAST_TRUE_PRICES.get(str(symbol_id))
+    except Exception as e:
+        logger.warning(f"Unable to read the last true prices: {str(e)}")
+        return None
+
+
+async def get_symbol_ids(symbol_names: list[str]) -> dict[str, int]:
+    """Ids of the known symbols, with a single query for the uncached ones."""
+    missing = [name for name in symbol_names if name not in SYMBOL_IDS]
+    if missing:
+        async with storage.connect() as store:
+            for symbol_obj in await store.get_symbols(missing):
+                SYMBOL_IDS[symbol_obj.symbol] = symbol_obj.id
+    return {name: SYMBOL_IDS[name] for name in symbol_names if name in SYMBOL_IDS}
+
+
+async def get_last_true_prices(
+    symbol_ids: list[int],
+) -> dict[int, SymbolTrueMidPrice]:
+    if LAST_TRUE_PRICES is None:
+        return {}
+    try:
+        values = await LAST_TRUE_PRICES.get_many([str(i) for i in symbol_ids])
+    except Exception as e:
+        logger.warning(f"Unable to read the last true prices: {str(e)}")
+        return {}
+    return {symbol_id: value for symbol_id, value in zip(symbol_ids, values) if value}
+
 
 @app.get("/true-mid-price/{symbol}")
 async def read_true_mid_price(symbol: str):
-    async with db.connect_async() as commands:
-        symbol_obj = await symbols.get_symbol(commands, symbol.replace("-", "/"))
-        if symbol_obj:
-            last_true_price = await symbol_prices.get_last_symbol_true_mid_price(
-                commands, symbol_obj.id
-            )
-            return last_true_price and last_true_price["true_mid_price"]
-        else:
-            return f"ERR: No symbol {symbol}"
+    symbol_id = await get_symbol_id(symbol.replace("-", "/"))
+    if symbol_id is None:
+        return f"ERR: No symbol {symbol}"
+
+    last_true_price = await get_last_true_price(symbol_id)
+    if last_true_price and is_fresh(last_true_price):
+        return last_true_price.true_mid_price
+
+    # Not cached yet, too old, or the cache is down or not set up.
+    async with storage.connect() as store:
+        rows = await store.get_last_symbol_true_mid_prices([symbol_id])
+        return rows[0]["true_mid_price"] if rows else None
+
+
+@app.get("/true-mid-prices")
+async def read_true_mid_prices(symbols: str):
+    """The last true mid price of many symbols, e.g. `?symbols=BTC-USD,ETH-USD`.
+    Unknown symbols, or symbols without prices, are null."""
+    names = split_symbols(symbols)
+    symbol_ids = await get_symbol_ids([name.replace("-", "/") for name in names])
+
+    last_prices = {
+        symbol_id: {
+            "timestamp_ms": value.timestamp_ms,
+            "true_mid_price": value.true_mid_price,
+        }
+        for symbol_id, value in (
+            await get_last_true_prices(list(symbol_ids.values()))
+        ).items()
+        if is_fresh(value)
+    }
+
+    missing = [i for i in symbol_ids.values() if i not in last_prices]
+    if missing:
+        # Not cached yet, too old, or the cache is down or not set up.
+        async with storage.connect() as store:
+            rows = await store.get_last_symbol_true_mid_prices(missing)
+        for row in rows:
+            last_prices[row["symbol_id"]] = {
+                "timestamp_ms": row["timestamp"].timestamp() * 1000,
+                "true_mid_price": row["true_mid_price"],
+            }
+
+    return {
+        name: last_prices.get(symbol_ids.get(name.replace("-", "/"), -1))
+        for name in names
+    }
+
+
+@app.get("/history/{stream}")
+async def read_history(
+    stream: HistoryStream,
+    symbol: str,
+    start: datetime.datetime,
+    end: Optional[datetime.datetime] = None,
+    interval: Optional[datetime.timedelta] = None,
+    connector: Optional[str] = None,
+    format: Literal["json", "arrow"] = "json",
+):
+    """The history of a symbol over [start, end), e.g.
+    `/history/true_mid_price?symbol=BTC-USD&start=2023-10-01&interval=PT1M`.
+
+    With an interval, rows are downsampled to one per time bucket: OHLC for true
+    prices and trades, the last spread of each connector for spreads. The response
+    is streamed as a JSON array, or as an Arrow IPC stream with `format=arrow`.
+    """
+    symbol_id = await get_symbol_id(symbol.replace("-", "/"))
+    if symbol_id is None:
+        raise HTTPException(status_code=404, detail=f"No symbol {symbol}")
+    if interval is not None and interval <= datetime.timedelta(0):
+        raise HTTPException(status_code=400, detail="The interval must be positive")
+
+    start = _as_utc(start)
+    end = _as_utc(end or datetime.datetime.now(datetime.timezone.utc))
+    pages = iter_history_pages(
+        stream, symbol_id, start, end, interval=interval, connector=connector
+    )
+
+    if format == "arrow":
+        return StreamingResponse(
+            encode_arrow(pages, history_schema(stream, interval)),
+            media_type="application/vnd.apache.arrow.stream",
+        )
+    return StreamingResponse(encode_json(pages), media_type="application/json")
+
+
+def _as_utc(timestamp: datetime.datetime):
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+async def resolve_symbols(symbol_names: list[str]) -> dict[int, str]:
+    """Symbol ids by symbol, raises a KeyError for unknown symbols."""
+    resolved = {}
+    for name in symbol_names:
+        symbol = name.replace("-", "/")
+        symbol_id = await get_symbol_id(symbol)
+        if symbol_id is None:
+            raise KeyError(name)
+        resolved[symbol_id] = symbol
+    return resolved
+
+
+async def subscribe(client: ClientSubscription, symbol_names: list[str]):
+    assert BROADCASTER
+    resolved = await resolve_symbols(symbol_names)
+    last_values = {}
+    for symbol_id in resolved:
+        last_value = await get_last_true_price(symbol_id)
+        if last_value:
+            last_values[symbol_id] = last_value
+    BROADCASTER.subscribe(client, resolved, last_values)
+
+
+def split_symbols(symbols_param: str) -> list[str]:
+    return [s for s in symbols_param.split(",") if s]
+
+
+WS_COMMANDS = ("subscribe", "unsubscribe")
+
+
+def parse_command(text: str) -> dict[str, list[str]]:
+    """A WebSocket command, raises a ValueError with the message for the client."""
+    try:
+        command = json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError("Commands must be JSON")
+    if not isinstance(command, dict) or not set(command) <= set(WS_COMMANDS):
+        raise ValueError(f"Commands must be objects with keys in {WS_COMMANDS}")
+    for symbols in command.values():
+        if not isinstance(symbols, list) or not all(
+            isinstance(symbol, str) for symbol in symbols
+        ):
+            raise ValueError("Commands take a list of symbols")
+    return command
+
+
+@app.websocket("/true-mid-prices/ws")
+async def stream_true_mid_prices_ws(websocket: WebSocket, symbols: str = ""):
+    """Pushes true prices of the symbols, e.g. `?symbols=BTC-USD,ETH-USD`. Clients
+    can send `{"subscribe": [...]}` and `{"unsubscribe": [...]}` messages."""
+    if BROADCASTER is None:
+        # Prices are only streamed from Redis.
+        await websocket.close(code=1011, reason="Streaming needs Redis")
+        return
+    await websocket.accept()
+    client = BROADCASTER.connect()
+
+    async def send_updates():
+        while True:
+            for payload in await client.get():
+                await websocket.send_text(payload)
+
+    async def receive_commands():
+        while True:
+            try:
+                command = parse_command(await websocket.receive_text())
+            except ValueError as e:
+                await websocket.send_text(json.dumps({"error": str(e)}))
+                continue
+            try:
+                if "subscribe" in command:
+                    await subscribe(client, command["subscribe"])
+                if "unsubscribe" in command:
+                    resolved = await resolve_symbols(command["unsubscribe"])
+                    BROADCASTER.unsubscribe(client, resolved)
+            except KeyError as e:
+                await websocket.send_text(json.dumps({"error": f"No symbol {e}"}))
+
+    try:
+        try:
+            await subscribe(client, split_symbols(symbols))
+        except KeyError as e:
+            await websocket.send_text(json.dumps({"error": f"No symbol {e}"}))
+
+        tasks = [
+            asyncio.create_task(send_updates()),
+            asyncio.create_task(receive_commands()),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        BROADCASTER.disconnect(client)
+
+
+@app.get("/true-mid-prices/sse")
+async def stream_true_mid_prices_sse(symbols: str):
+    """Server-sent events of the true prices of the symbols, e.g.
+    `?symbols=BTC-USD,ETH-USD`."""
+    if BROADCASTER is None:
+        raise HTTPException(status_code=503, detail="Streaming needs Redis")
+    client = BROADCASTER.connect()
+    try:
+        await subscribe(client, split_symbols(symbols))
+    except KeyError as e:
+        BROADCASTER.disconnect(client)
+        raise HTTPException(status_code=404, detail=f"No symbol {e}")
+
+    async def events():
+        assert BROADCASTER
+        try:
+            while True:
+                payloads = await client.get(timeout=SSE_KEEPALIVE_S)
+                if not payloads:
+                    yield ": keepalive\n\n"
+                for payload in payloads:
+                    yield f"data: {payload}\n\n"
+        finally:
+            BROADCASTER.disconnect(client)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
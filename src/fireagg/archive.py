@@ -0,0 +1,255 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+from typing import Iterable, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fireagg.database import chunks, db, symbols
+from fireagg.history import DECIMAL, TIMESTAMP
+from fireagg.processing.base import Worker
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMAS = {
+    "symbol_true_mid_price_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("true_mid_price", DECIMAL),
+            ("update_timestamp", TIMESTAMP),
+        ]
+    ),
+    "symbol_spreads_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("best_bid", DECIMAL),
+            ("best_ask", DECIMAL),
+            ("update_timestamp", TIMESTAMP),
+            ("fetch_timestamp", TIMESTAMP),
+        ]
+    ),
+    "symbol_trades_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("price", DECIMAL),
+            ("amount", DECIMAL),
+            ("is_buy", pa.bool_()),
+            ("update_timestamp", TIMESTAMP),
+            ("fetch_timestamp", TIMESTAMP),
+        ]
+    ),
+    "symbol_weights_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("weight", pa.float64()),
+            ("update_timestamp", TIMESTAMP),
+        ]
+    ),
+    "symbol_bbo_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("best_bid", DECIMAL),
+            ("best_bid_connector", pa.string()),
+            ("best_ask", DECIMAL),
+            ("best_ask_connector", pa.string()),
+            ("is_crossed", pa.bool_()),
+            ("update_timestamp", TIMESTAMP),
+        ]
+    ),
+    "symbol_cross_rate_stream": pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("rate", DECIMAL),
+            ("hops", pa.int32()),
+            ("paths", pa.int32()),
+            ("update_timestamp", TIMESTAMP),
+        ]
+    ),
+}
+STREAM_TABLES = list(ARCHIVE_SCHEMAS)
+
+# Readers skip the files and directories starting with "_" or ".".
+ARCHIVED_MARKERS_DIR = "_archived"
+
+
+def partition_dir(output_dir: str, table: str, symbol: str, date: datetime.date):
+    return os.path.join(
+        output_dir,
+        table,
+        f"symbol={symbol.replace('/', '-')}",
+        f"date={date.isoformat()}",
+    )
+
+
+class ParquetArchiver:
+    """Writes closed hypertable chunks to Parquet files, partitioned by symbol and
+    date: `<table>/symbol=BTC-USD/date=2023-10-01/<chunk>.parquet`.
+
+    Chunks are read a symbol and a time window at a time, and written as they
+    come, so memory stays bounded by a page whatever the chunk size. Files only
+    appear once their whole chunk is written, then the chunk is marked as archived
+    and, optionally, dropped from the database.
+    """
+
+    def __init__(self, output_dir: str, page_s: float, drop_chunks: bool = False):
+        self.output_dir = output_dir
+        self.page = datetime.timedelta(seconds=page_s)
+        self.drop_chunks = drop_chunks
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.output_dir=})"
+
+    async def archive_closed_chunks(
+        self, tables: Iterable[str], min_age_s: float
+    ) -> int:
+        """Archives the chunks that ended more than `min_age_s` ago, and returns how
+        many were archived."""
+        before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            seconds=min_age_s
+        )
+        async with db.connect_async() as commands:
+            symbol_names = {s.id: s.symbol for s in await symbols.get_all(commands)}
+
+        archived = 0
+        for table in tables:
+            async with db.connect_async() as commands:
+                closed = await chunks.get_closed_chunks(commands, table, before)
+
+            for chunk in closed:
+                if not self.is_archived(chunk):
+                    await self.archive_chunk(chunk, symbol_names)
+                    archived += 1
+
+                if self.drop_chunks:
+                    async with db.connect_async() as commands:
+                        await chunks.drop_chunk(commands, chunk)
+                    logger.info(f"{self} dropped {chunk.chunk_name}")
+
+        return archived
+
+    def is_archived(self, chunk: chunks.Chunk):
+        return os.path.exists(self._marker_path(chunk))
+
+    async def archive_chunk(self, chunk: chunks.Chunk, symbol_names: dict[int, str]):
+        async with db.connect_async() as commands:
+            symbol_ids = await chunks.get_chunk_symbol_ids(commands, chunk)
+
+        files: list[tuple[str, str]] = []
+        try:
+            for symbol_id in symbol_ids:
+                symbol = symbol_names.get(symbol_id, str(symbol_id))
+                await self._archive_symbol(chunk, symbol_id, symbol, files)
+        except BaseException:
+            for tmp_path, _ in files:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+        for tmp_path, path in files:
+            os.replace(tmp_path, path)
+
+        marker_path = self._marker_path(chunk)
+        os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+        with open(marker_path, "w") as f:
+            f.write(f"{chunk.range_start.isoformat()} {chunk.range_end.isoformat()}\n")
+
+        logger.info(
+            f"{self} archived {chunk.hypertable_name} {chunk.chunk_name} "
+            f"({len(symbol_ids)} symbols, {len(files)} files)"
+        )
+
+    async def _archive_symbol(
+        self,
+        chunk: chunks.Chunk,
+        symbol_id: int,
+        symbol: str,
+        files: list[tuple[str, str]],
+    ):
+        table = chunk.hypertable_name
+        schema = ARCHIVE_SCHEMAS[table]
+        # Chunk names start with "_", that readers would skip.
+        file_name = chunk.chunk_name.lstrip("_")
+        writer: Optional[pq.ParquetWriter] = None
+        writer_date: Optional[datetime.date] = None
+        try:
+            page_start = chunk.range_start
+            while page_start < chunk.range_end:
+                page_end = min(page_start + self.page, chunk.range_end)
+                async with db.connect_async() as commands:
+                    rows = await chunks.get_stream_rows(
+                        commands, table, symbol_id, page_start, page_end
+                    )
+
+                # Rows are ordered by timestamp, so a date is never revisited.
+                for date, date_rows in itertools.groupby(rows, key=_utc_date):
+                    if date != writer_date:
+                        if writer is not None:
+                            writer.close()
+                        directory = partition_dir(self.output_dir, table, symbol, date)
+                        os.makedirs(directory, exist_ok=True)
+                        path = os.path.join(directory, f"{file_name}.parquet")
+                        tmp_path = os.path.join(directory, f".{file_name}.tmp")
+                        files.append((tmp_path, path))
+                        writer = pq.ParquetWriter(tmp_path, schema)
+                        writer_date = date
+
+                    batch = pa.Table.from_pylist(list(date_rows), schema=schema)
+                    # Compression is CPU-bound, keep it off the event loop.
+                    await asyncio.to_thread(writer.write_table, batch)
+
+                page_start = page_end
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _marker_path(self, chunk: chunks.Chunk):
+        return os.path.join(
+            self.output_dir,
+            chunk.hypertable_name,
+            ARCHIVED_MARKERS_DIR,
+            chunk.chunk_name,
+        )
+
+
+def _utc_date(row: dict) -> datetime.date:
+    return row["timestamp"].astimezone(datetime.timezone.utc).date()
+
+
+class ArchiverWorker(Worker):
+    """Periodically archives the chunks closed since the last run."""
+
+    def __init__(
+        self,
+        archiver: ParquetArchiver,
+        interval_s: float,
+        min_age_s: float,
+        tables: Iterable[str] = STREAM_TABLES,
+    ):
+        super().__init__()
+        self.archiver = archiver
+        self.interval_s = interval_s
+        self.min_age_s = min_age_s
+        self.tables = list(tables)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.archiver.output_dir=})"
+
+    def is_live_callback(self):
+        logger.info(f"{self} is live!")
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            archived = await self.archiver.archive_closed_chunks(
+                self.tables, self.min_age_s
+            )
+            if archived:
+                logger.info(f"{self} archived {archived} chunks")
+            self.mark_alive()
+            await asyncio.sleep(self.interval_s)
@@ -0,0 +1,372 @@
+import datetime
+import logging
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from fireagg import settings
+from fireagg.database import db, storage, symbol_prices
+from fireagg.processing.true_mid_price import sum_in_order
+
+logger = logging.getLogger(__name__)
+
+# Weights are applied before the spreads of the same timestamp.
+WEIGHT_EVENT = 0
+SPREAD_EVENT = 1
+
+SPREADS_COLUMNS = ["timestamp_ms", "connector", "mid_price"]
+WEIGHTS_COLUMNS = ["timestamp_ms", "connector", "weight"]
+
+ARCHIVE_PARTITIONING = ds.partitioning(
+    pa.schema([("symbol", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+
+
+def recompute_true_mid_prices(
+    spreads: pd.DataFrame,
+    weights: pd.DataFrame,
+    start_ms: Optional[float] = None,
+    block_size: int = 250_000,
+) -> pd.DataFrame:
+    """Replays mid prices and weights through the `SymbolTrueMidPriceProcessor`
+    model, with array operations instead of one message at a time.
+
+    Events are applied in timestamp order, weights first on ties. As online,
+    spreads are ignored until the symbol gets its first weight, connectors without
+    a weight count for 0, and a true price is only emitted when it changes. Events
+    go through in blocks, carrying the last prices and weights over, so memory is
+    bounded by `block_size` times the number of connectors.
+
+    Returns the true prices emitted from `start_ms`, at the timestamp of the spread
+    that triggered them.
+    """
+    connectors = pd.Index(
+        np.union1d(spreads["connector"].unique(), weights["connector"].unique())
+    )
+    timestamps = np.concatenate(
+        [
+            weights["timestamp_ms"].to_numpy(float),
+            spreads["timestamp_ms"].to_numpy(float),
+        ]
+    )
+    kinds = np.concatenate(
+        [
+            np.full(len(weights), WEIGHT_EVENT, dtype=np.int8),
+            np.full(len(spreads), SPREAD_EVENT, dtype=np.int8),
+        ]
+    )
+    codes = np.concatenate(
+        [
+            connectors.get_indexer(weights["connector"]),
+            connectors.get_indexer(spreads["connector"]),
+        ]
+    )
+    values = np.concatenate(
+        [weights["weight"].to_numpy(float), spreads["mid_price"].to_numpy(float)]
+    )
+
+    order = np.lexsort((kinds, timestamps))
+    timestamps, kinds, codes, values = (
+        timestamps[order],
+        kinds[order],
+        codes[order],
+        values[order],
+    )
+
+    weight_events = np.flatnonzero(kinds == WEIGHT_EVENT)
+    if not len(weight_events):
+        return _true_prices_frame([], [], [], connectors)
+    first_event = weight_events[0]
+
+    last_prices = np.full(len(connectors), np.nan)
+    last_weights = np.zeros(len(connectors))
+    last_true_price = np.nan
+
+    out_timestamps, out_prices, out_codes = [], [], []
+    for block_start in range(first_event, len(timestamps), block_size):
+        block = slice(block_start, block_start + block_size)
+        block_kinds, block_codes, block_values = (
+            kinds[block],
+            codes[block],
+            values[block],
+        )
+
+        spread_rows = np.flatnonzero(block_kinds == SPREAD_EVENT)
+        weight_rows = np.flatnonzero(block_kinds == WEIGHT_EVENT)
+        prices = _forward_fill(
+            last_prices,
+            spread_rows,
+            block_codes[spread_rows],
+            block_values[spread_rows],
+            len(block_kinds),
+        )
+        # Weights change rarely: only fill their successive states, and index them.
+        weight_states = np.vstack(
+            [
+                last_weights,
+                _forward_fill(
+                    last_weights,
+                    np.arange(len(weight_rows)),
+                    block_codes[weight_rows],
+                    block_values[weight_rows],
+                    len(weight_rows),
+                ),
+            ]
+        )
+        weight_state_index = np.cumsum(block_kinds == WEIGHT_EVENT)
+        last_prices, last_weights = prices[-1], weight_states[-1]
+        if not len(spread_rows):
+            continue
+
+        prices = prices[spread_rows]
+        has_price = ~np.isnan(prices)
+        connector_weights = np.where(
+            has_price, weight_states[weight_state_index[spread_rows]], 0.0
+        )
+        # Same operations as online: normalized weights, then the weighted sum, over
+        # the connectors in name order. Without any weighted price, it is NaN.
+        with np.errstate(invalid="ignore", divide="ignore"):
+            normalized_weights = (
+                connector_weights / sum_in_order(connector_weights)[:, np.newaxis]
+            )
+            true_prices = sum_in_order(
+                np.where(has_price, prices, 0.0) * normalized_weights
+            )
+
+        # NaN != NaN, so NaNs are always emitted, as online.
+        previous = np.concatenate([[last_true_price], true_prices[:-1]])
+        changed = true_prices != previous
+        last_true_price = true_prices[-1]
+
+        emitted = spread_rows[changed]
+        out_timestamps.append(timestamps[block][emitted])
+        out_prices.append(true_prices[changed])
+        out_codes.append(block_codes[emitted])
+
+    result = _true_prices_frame(out_timestamps, out_prices, out_codes, connectors)
+    if start_ms is not None:
+        result = result[result["timestamp_ms"] >= start_ms].reset_index(drop=True)
+    return result
+
+
+def _forward_fill(
+    initial: np.ndarray,
+    rows: np.ndarray,
+    codes: np.ndarray,
+    values: np.ndarray,
+    n_rows: int,
+) -> np.ndarray:
+    """The value of each connector after each of `n_rows` events, starting from
+    `initial`, with `values[i]` set on connector `codes[i]` at row `rows[i]`."""
+    # Index of the last update of each connector, 0 when still the initial value.
+    source = np.zeros((n_rows, len(initial)), dtype=np.int32)
+    source[rows, codes] = np.arange(1, len(rows) + 1, dtype=np.int32)
+    np.maximum.accumulate(source, axis=0, out=source)
+
+    updates = np.concatenate([[np.nan], values])
+    return np.where(source > 0, updates[source], initial)
+
+
+def _true_prices_frame(timestamps, prices, codes, connectors: pd.Index):
+    if not timestamps:
+        timestamps, prices, codes = [np.empty(0)], [np.empty(0)], [np.empty(0, int)]
+    return pd.DataFrame(
+        {
+            "timestamp_ms": np.concatenate(timestamps),
+            "true_mid_price": np.concatenate(prices),
+            "triggering_connector": pd.Categorical.from_codes(
+                np.concatenate(codes), categories=connectors
+            ),
+        }
+    )
+
+
+async def load_from_db(
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    lookback_s: float,
+    page_s: float,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """The mid prices and weights of a symbol over [start, end), plus the last ones
+    of each connector before `start`, so that the recompute starts from the same
+    state as online. Spreads are read one time window at a time."""
+    async with db.connect_async() as commands:
+        spreads_pages = [
+            _frame(
+                await symbol_prices.get_last_mid_prices(
+                    commands,
+                    symbol_id,
+                    since=start - datetime.timedelta(seconds=lookback_s),
+                    before=start,
+                ),
+                SPREADS_COLUMNS,
+            )
+        ]
+        weights = pd.concat(
+            [
+                _frame(
+                    await symbol_prices.get_last_weights(commands, symbol_id, start),
+                    WEIGHTS_COLUMNS,
+                ),
+                _frame(
+                    await symbol_prices.get_weights_history(
+                        commands, symbol_id, start, end
+                    ),
+                    WEIGHTS_COLUMNS,
+                ),
+            ],
+            ignore_index=True,
+        )
+
+    page = datetime.timedelta(seconds=page_s)
+    page_start = start
+    while page_start < end:
+        page_end = min(page_start + page, end)
+        async with db.connect_async() as commands:
+            rows = await symbol_prices.get_mid_prices_history(
+                commands, symbol_id, page_start, page_end
+            )
+        spreads_pages.append(_frame(rows, SPREADS_COLUMNS))
+        page_start = page_end
+
+    return pd.concat(spreads_pages, ignore_index=True), weights
+
+
+def load_from_parquet(
+    archive_dir: str,
+    symbol: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    lookback_s: float,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Same as `load_from_db`, from the files written by `fireagg export`. Mid prices
+    are computed by Arrow, in decimal."""
+    since = start - datetime.timedelta(seconds=lookback_s)
+    symbol_filter = ds.field("symbol") == symbol.replace("/", "-")
+
+    spreads_dataset = _archive_dataset(archive_dir, "symbol_spreads_stream")
+    spreads_table = spreads_dataset.to_table(
+        columns=["timestamp", "connector", "best_bid", "best_ask"],
+        filter=symbol_filter
+        & (ds.field("date") >= since.date().isoformat())
+        & (ds.field("date") <= end.date().isoformat())
+        & (ds.field("timestamp") >= pa.scalar(since, pa.timestamp("us", "UTC")))
+        & (ds.field("timestamp") < pa.scalar(end, pa.timestamp("us", "UTC")))
+        & ds.field("best_bid").is_valid()
+        & ds.field("best_ask").is_valid(),
+    )
+    spreads = pd.DataFrame(
+        {
+            "timestamp_ms": _timestamps_ms(spreads_table["timestamp"]),
+            "connector": spreads_table["connector"].to_numpy(),
+            "mid_price": pc.divide(
+                pc.cast(
+                    pc.add(spreads_table["best_bid"], spreads_table["best_ask"]),
+                    pa.float64(),
+                ),
+                2.0,
+            ).to_numpy(),
+        }
+    )
+
+    weights_dataset = _archive_dataset(archive_dir, "symbol_weights_stream")
+    weights_table = weights_dataset.to_table(
+        columns=["timestamp", "connector", "weight"],
+        filter=symbol_filter
+        & (ds.field("date") <= end.date().isoformat())
+        & (ds.field("timestamp") < pa.scalar(end, pa.timestamp("us", "UTC"))),
+    )
+    weights = pd.DataFrame(
+        {
+            "timestamp_ms": _timestamps_ms(weights_table["timestamp"]),
+            "connector": weights_table["connector"].to_numpy(),
+            "weight": weights_table["weight"].to_numpy(),
+        }
+    )
+    return spreads, weights
+
+
+def _archive_dataset(archive_dir: str, table: str):
+    return ds.dataset(
+        os.path.join(archive_dir, table),
+        format="parquet",
+        partitioning=ARCHIVE_PARTITIONING,
+    )
+
+
+def _timestamps_ms(column: pa.ChunkedArray) -> np.ndarray:
+    return pc.cast(column, pa.int64()).to_numpy() / 1000.0
+
+
+def _frame(rows: list[dict], columns: list[str]):
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+async def run_backtest(
+    symbol: str,
+    start: datetime.datetime,
+    end: Optional[datetime.datetime] = None,
+    archive_dir: Optional[str] = None,
+    output: Optional[str] = None,
+):
+    settings_obj = settings.get()
+    start = _as_utc(start)
+    end = _as_utc(end or datetime.datetime.now(datetime.timezone.utc))
+
+    if archive_dir is None and storage.is_local():
+        # Same layout as the archive.
+        archive_dir = settings_obj.local_storage_dir
+
+    load_started = time.perf_counter()
+    if archive_dir:
+        spreads, weights = load_from_parquet(
+            archive_dir, symbol, start, end, settings_obj.backtest_lookback_s
+        )
+    else:
+        async with db.default_pool():
+            async with storage.connect() as store:
+                symbol_obj = await store.get_symbol(symbol)
+            if symbol_obj is None:
+                raise ValueError(f"No symbol {symbol}")
+
+            spreads, weights = await load_from_db(
+                symbol_obj.id,
+                start,
+                end,
+                lookback_s=settings_obj.backtest_lookback_s,
+                page_s=settings_obj.backtest_page_s,
+            )
+    load_s = time.perf_counter() - load_started
+
+    compute_started = time.perf_counter()
+    true_prices = recompute_true_mid_prices(
+        spreads,
+        weights,
+        start_ms=start.timestamp() * 1000,
+        block_size=settings_obj.backtest_block_size,
+    )
+    compute_s = time.perf_counter() - compute_started
+
+    logger.info(
+        f"Recomputed {len(true_prices)} true prices of {symbol} from {len(spreads)} "
+        f"spreads and {len(weights)} weights: loaded in {load_s:.1f}s, computed in "
+        f"{compute_s:.1f}s"
+    )
+    if output:
+        true_prices.to_parquet(output, index=False)
+        logger.info(f"Wrote {output}")
+
+    return true_prices
+
+
+def _as_utc(timestamp: datetime.datetime):
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+from fireagg.database import storage
+from fireagg.input_streams.impl._benchmark import (
+    SEESAW_SYMBOL,
+    RateProfile,
+    _benchmark,
+    benchmark_symbol,
+)
+from fireagg.processing.core import ProcessingCore
+from fireagg.processing.message_bus import AsyncioMessageBus, MessageBus
+from fireagg.processing.redis_adapter import RedisStreamsMessageBus, redis_client
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = {"p50": 50, "p99": 99, "p999": 99.9}
+
+
+class BenchmarkStats:
+    """Collects commit latencies and queue depths while the pipeline runs."""
+
+    def __init__(self, bus: MessageBus, warmup_s: float = 0):
+        self.bus = bus
+        self.started_at = time.time()
+        # Only measure once every worker is launched and live.
+        self.measure_from = self.started_at + warmup_s
+        self.latencies_ms: dict[str, list[float]] = defaultdict(list)
+        self.queue_depths: dict[str, list[int]] = defaultdict(list)
+
+    def on_flushed(self, stream_name: str, records: list):
+        # From the exchange (generation) timestamp to the DB commit.
+        committed_ms = time.time() * 1000
+        if committed_ms < self.measure_from * 1000:
+            return
+        for record in records:
+            origin = record.latency_origin()
+            if origin is not None:
+                self.latencies_ms[stream_name].append(committed_ms - origin[1])
+
+    async def run_queue_sampler(self, interval_s: float = 1):
+        queues = {
+            "trades": self.bus.trades,
+            "spreads": self.bus.spreads,
+            "weights": self.bus.weights,
+            "true_prices": self.bus.true_prices,
+            "bbo": self.bus.bbo,
+        }
+        while True:
+            await asyncio.sleep(interval_s)
+            if time.time() < self.measure_from:
+                continue
+            for name, queue in queues.items():
+                self.queue_depths[name].append(queue.depth())
+
+    def report(self):
+        measured_s = max(time.time() - self.measure_from, 1e-9)
+        streams = {}
+        for stream_name, latencies_ms in self.latencies_ms.items():
+            latencies = np.array(latencies_ms)
+            streams[stream_name] = {
+                "messages": len(latencies),
+                "messages_per_s": len(latencies) / measured_s,
+                "latency_ms": {
+                    name: float(np.percentile(latencies, q))
+                    for name, q in PERCENTILES.items()
+                }
+                | {"max": float(latencies.max())},
+            }
+        return {
+            "measured_s": measured_s,
+            "messages_per_s": sum(s["messages_per_s"] for s in streams.values()),
+            "streams": streams,
+            "queue_depths": {
+                name: {"max": max(depths), "mean": float(np.mean(depths))}
+                for name, depths in self.queue_depths.items()
+                if depths
+            },
+        }
+
+
+async def run_benchmark(
+    profile: RateProfile,
+    n_symbols: int = 1,
+    duration_s: float = 60,
+    warmup_s: float = 5,
+    seed: Optional[int] = None,
+    bus: str = "asyncio",
+    output: Optional[str] = None,
+):
+    """Drives the full processing core with `_benchmark` connectors, and reports
+    the sustained throughput and latencies up to the database commit."""
+    message_bus: MessageBus = (
+        RedisStreamsMessageBus(redis_client())
+        if bus == "redis"
+        else AsyncioMessageBus()
+    )
+
+    async with storage.default_storage():
+        core = ProcessingCore(bus=message_bus)
+        stats = BenchmarkStats(message_bus, warmup_s=warmup_s)
+        await core.consume_streams_to_db(on_flushed=stats.on_flushed)
+
+        symbols = [benchmark_symbol(i) for i in range(n_symbols)] or [SEESAW_SYMBOL]
+        connector = _benchmark(
+            "_benchmark", profile=profile, seed=seed, n_symbols=n_symbols
+        )
+        for symbol in symbols:
+            await core.watch_spreads(connector, symbol)
+            await core.watch_trades(connector, symbol)
+
+        sampler_task = asyncio.create_task(stats.run_queue_sampler())
+        try:
+            await asyncio.wait_for(core.run(), timeout=warmup_s + duration_s)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            sampler_task.cancel()
+            await core.stop()
+
+    result = {
+        "started_at": datetime.datetime.fromtimestamp(stats.started_at).isoformat(),
+        "config": {
+            "profile": profile._asdict(),
+            "symbols": len(symbols),
+            "duration_s": duration_s,
+            "warmup_s": warmup_s,
+            "seed": seed,
+            "bus": bus,
+        },
+        "results": stats.report(),
+    }
+
+    logger.info(json.dumps(result["results"], indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Saved benchmark results to {output}")
+
+    return result
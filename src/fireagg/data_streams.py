@@ -2,10 +2,28 @@ import asyncio
 import logging
 from typing import Iterable, Optional
 
-from fireagg.database import db, symbols
+from fireagg import settings
+from fireagg.archive import STREAM_TABLES, ArchiverWorker, ParquetArchiver
+from fireagg.database import db, storage
 from fireagg.input_streams import create_connector, list_symbol_connectors
-
+from fireagg.input_streams.impl._replay import _replay
+from fireagg.input_streams.recording import (
+    TRADES_STREAM,
+    RecordingConnector,
+    StreamRecorder,
+    read_manifest,
+)
+
+from fireagg.processing.coordinator import (
+    ClusterCoordinator,
+    Pair,
+    add_pairs,
+    get_cluster_status,
+    remove_pairs,
+)
+from fireagg.processing.control import ControlChannel, ControlCommand, send_commands
 from fireagg.processing.core import ProcessingCore
+from fireagg.processing.message_bus import AsyncioMessageBus
 from fireagg.processing.redis_adapter import RedisStreamsMessageBus, redis_client
 
 logger = logging.getLogger(__name__)
@@ -28,13 +46,13 @@ GOLD_CONNECTORS = {
 
 
 async def db_benchmark():
-    async with db.default_pool():
+    async with storage.default_storage():
         core = ProcessingCore()
         await core.consume_streams_to_db()
 
 
 async def seed_connectors(connectors: Optional[list[str]] = None):
-    async with db.default_pool():
+    async with storage.default_storage():
         return await _do_seed_connectors(connectors)
 
 
@@ -56,7 +74,7 @@ async def _do_seed_connectors(connectors: Optional[list[str]] = None):
 async def combine_connectors(
     symbols: Iterable[str], only_connectors: Optional[list[str]] = None
 ):
-    async with db.default_pool():
+    async with storage.default_storage():
         core = ProcessingCore()
         await core.consume_streams_to_db()
         for symbol in symbols:
@@ -76,7 +94,7 @@ async def combine_connectors(
 
 
 async def watch_spreads(connector_name: str, symbol: str):
-    async with db.default_pool():
+    async with storage.default_storage():
         core = ProcessingCore()
         connector = create_connector(connector_name)
         await core.watch_spreads(connector, symbol)
@@ -84,18 +102,117 @@ async def watch_spreads(connector_name: str, symbol: str):
         await core.run()
 
 
+async def record_symbols(
+    symbols: Iterable[str],
+    directory: str,
+    duration_s: Optional[float] = None,
+    only_connectors: Optional[list[str]] = None,
+):
+    recorder = StreamRecorder(directory)
+    async with storage.default_storage():
+        # Nothing consumes the bus, the connectors record what they receive.
+        core = ProcessingCore(bus=AsyncioMessageBus())
+        for symbol in symbols:
+            if only_connectors is None:
+                connectors = await list_symbol_connectors(symbol)
+            else:
+                connectors = only_connectors
+
+            for connector_name in connectors:
+                if connector_name not in GOLD_CONNECTORS:
+                    continue
+                connector = RecordingConnector(
+                    create_connector(connector_name), recorder
+                )
+                await core.watch_spreads(connector, symbol)
+                await core.watch_trades(connector, symbol)
+
+        try:
+            await asyncio.wait_for(core.run(), timeout=duration_s)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await core.stop()
+            recorder.close()
+            logger.info(f"Recorded {len(recorder.streams)} streams to {directory}")
+
+
+async def replay_recording(
+    directory: str, speed: float = 1, loop: bool = False, distributed: bool = False
+):
+    manifest = read_manifest(directory)
+    async with storage.default_storage():
+        core = ProcessingCore(
+            bus=get_distributed_bus() if distributed else AsyncioMessageBus()
+        )
+        if not distributed:
+            await core.consume_streams_to_db()
+
+        for recorded in manifest["streams"]:
+            connector = _replay(
+                f"_replay:{recorded['connector']}",
+                directory=directory,
+                speed=speed,
+                loop=loop,
+            )
+            if recorded["stream"] == TRADES_STREAM:
+                await core.watch_trades(connector, recorded["symbol"])
+            else:
+                await core.watch_spreads(connector, recorded["symbol"])
+
+        await core.run()
+
+
 async def distributed_core():
-    async with db.default_pool():
+    async with storage.default_storage():
         await _distributed_bootstrap()
 
-        core = ProcessingCore(bus=get_distributed_bus())
+        # The core is the only writer of the last true prices read by the API.
+        core = ProcessingCore(bus=get_distributed_bus(write_last_values=True))
         await core.consume_streams_to_db()
+
+        settings_obj = settings.get()
+        if settings_obj.archive_dir:
+            await core.put_worker(
+                ArchiverWorker(
+                    ParquetArchiver(
+                        settings_obj.archive_dir,
+                        page_s=settings_obj.archive_page_s,
+                        drop_chunks=settings_obj.archive_drop_chunks,
+                    ),
+                    interval_s=settings_obj.archive_interval_s,
+                    min_age_s=settings_obj.archive_min_age_s,
+                )
+            )
+
         await core.run()
 
 
+async def export_chunks(
+    output_dir: str,
+    tables: Optional[list[str]] = None,
+    min_age_s: Optional[float] = None,
+    drop_chunks: bool = False,
+):
+    settings_obj = settings.get()
+    for table in tables or []:
+        if table not in STREAM_TABLES:
+            raise ValueError(f"Unknown table {table}, expected one of {STREAM_TABLES}")
+
+    archiver = ParquetArchiver(
+        output_dir, page_s=settings_obj.archive_page_s, drop_chunks=drop_chunks
+    )
+    async with db.default_pool():
+        archived = await archiver.archive_closed_chunks(
+            tables or STREAM_TABLES,
+            settings_obj.archive_min_age_s if min_age_s is None else min_age_s,
+        )
+    logger.info(f"Archived {archived} chunks to {output_dir}")
+
+
 async def _distributed_bootstrap():
-    async with db.connect_async() as commands:
-        db_symbols = await symbols.get_all(commands)
+    async with storage.connect() as store:
+        db_symbols = await store.get_all_symbols()
 
     if not db_symbols:
         await _do_seed_connectors()
@@ -104,28 +221,149 @@ async def _distributed_bootstrap():
 async def distributed_watch_symbols(
     symbols: Iterable[str], only_connectors: Optional[list[str]] = None
 ):
-    async with db.default_pool():
-        core = ProcessingCore(bus=get_distributed_bus())
-        for symbol in symbols:
-            if only_connectors is None:
-                connectors = await list_symbol_connectors(symbol)
-            else:
-                connectors = only_connectors
+    async with storage.default_storage():
+        pairs = await _symbols_pairs(symbols, only_connectors)
+        await _watch_pairs(pairs)
 
-            connectors = [c for c in connectors if c in GOLD_CONNECTORS]
 
-            if not connectors:
-                raise RuntimeError(f"Symbol {symbol} has no connectors.")
+async def distributed_watch_pairs(
+    pairs: list[Pair],
+    control_connectors: Optional[set[str]] = None,
+    control_excluded_connectors: Iterable[str] = (),
+):
+    """Sharded processes only take the control commands of their connectors."""
+    async with storage.default_storage():
+        await _watch_pairs(
+            pairs,
+            control_connectors=control_connectors,
+            control_excluded_connectors=control_excluded_connectors,
+        )
+
+
+async def _watch_pairs(
+    pairs: list[Pair],
+    control_connectors: Optional[set[str]] = None,
+    control_excluded_connectors: Iterable[str] = (),
+):
+    core = ProcessingCore(bus=get_distributed_bus())
+    for pair in pairs:
+        connector = create_connector(pair.connector)
+        await core.watch_spreads(connector, pair.symbol)
+        await core.watch_trades(connector, pair.symbol)
+
+    control_channel = settings.get().control_channel
+    if control_channel:
+        await core.put_worker(
+            ControlChannel(
+                core,
+                redis_client(),
+                control_channel,
+                connectors=control_connectors,
+                excluded_connectors=control_excluded_connectors,
+            )
+        )
+
+    await core.run()
+
+
+async def resolve_symbols_pairs(
+    symbols: Iterable[str], only_connectors: Optional[list[str]] = None
+):
+    async with storage.default_storage():
+        return await _symbols_pairs(symbols, only_connectors)
 
-            for connector_name in connectors:
-                if connector_name not in GOLD_CONNECTORS:
-                    continue
-                connector = create_connector(connector_name)
-                await core.watch_spreads(connector, symbol)
-                await core.watch_trades(connector, symbol)
 
+async def distributed_cluster_worker():
+    async with storage.default_storage():
+        core = ProcessingCore(bus=get_distributed_bus())
+        await core.put_worker(ClusterCoordinator(core, redis_client()))
         await core.run()
 
 
-def get_distributed_bus():
-    return RedisStreamsMessageBus(redis_client())
+async def _symbols_pairs(
+    symbols: Iterable[str], only_connectors: Optional[list[str]] = None
+):
+    pairs = []
+    for symbol in symbols:
+        if only_connectors is None:
+            connectors = await list_symbol_connectors(symbol)
+        else:
+            connectors = only_connectors
+
+        connectors = [c for c in connectors if c in GOLD_CONNECTORS]
+
+        if not connectors:
+            raise RuntimeError(f"Symbol {symbol} has no connectors.")
+
+        pairs.extend(Pair(connector_name, symbol) for connector_name in connectors)
+    return pairs
+
+
+async def cluster_assign(
+    symbols: Iterable[str], only_connectors: Optional[list[str]] = None
+):
+    async with storage.default_storage():
+        pairs = await _symbols_pairs(symbols, only_connectors)
+
+    client = redis_client()
+    try:
+        await add_pairs(client, pairs)
+    finally:
+        await client.close()
+    logger.info(f"Assigned {len(pairs)} pairs to the cluster")
+
+
+async def cluster_unassign(
+    symbols: Iterable[str], only_connectors: Optional[list[str]] = None
+):
+    async with storage.default_storage():
+        pairs = await _symbols_pairs(symbols, only_connectors)
+
+    client = redis_client()
+    try:
+        await remove_pairs(client, pairs)
+    finally:
+        await client.close()
+    logger.info(f"Removed {len(pairs)} pairs from the cluster")
+
+
+async def send_control_commands(
+    action: str,
+    symbols: Iterable[str],
+    channel: Optional[str] = None,
+    only_connectors: Optional[list[str]] = None,
+):
+    channel = channel or settings.get().control_channel
+    if not channel:
+        raise ValueError("No control channel, set CONTROL_CHANNEL or pass --channel")
+
+    async with storage.default_storage():
+        pairs = await _symbols_pairs(symbols, only_connectors)
+
+    client = redis_client()
+    try:
+        await send_commands(
+            client,
+            channel,
+            [
+                ControlCommand(
+                    action=action, connector=pair.connector, symbol=pair.symbol
+                )
+                for pair in pairs
+            ],
+        )
+    finally:
+        await client.close()
+    logger.info(f"Sent {action} for {len(pairs)} pairs to the {channel} channel")
+
+
+async def cluster_status():
+    client = redis_client()
+    try:
+        return await get_cluster_status(client)
+    finally:
+        await client.close()
+
+
+def get_distributed_bus(write_last_values: bool = False):
+    return RedisStreamsMessageBus(redis_client(), write_last_values=write_last_values)
@@ -0,0 +1,124 @@
+import datetime
+
+import pydantic
+from pydapper.commands import CommandsAsync
+
+# Columns archived for each hypertable, besides symbol_id.
+STREAM_TABLES_COLUMNS = {
+    "symbol_true_mid_price_stream": ["timestamp", "true_mid_price", "update_timestamp"],
+    "symbol_spreads_stream": [
+        "timestamp",
+        "connector",
+        "best_bid",
+        "best_ask",
+        "update_timestamp",
+        "fetch_timestamp",
+    ],
+    "symbol_trades_stream": [
+        "timestamp",
+        "connector",
+        "price",
+        "amount",
+        "is_buy",
+        "update_timestamp",
+        "fetch_timestamp",
+    ],
+    "symbol_weights_stream": ["timestamp", "connector", "weight", "update_timestamp"],
+    "symbol_bbo_stream": [
+        "timestamp",
+        "best_bid",
+        "best_bid_connector",
+        "best_ask",
+        "best_ask_connector",
+        "is_crossed",
+        "update_timestamp",
+    ],
+    "symbol_cross_rate_stream": [
+        "timestamp",
+        "rate",
+        "hops",
+        "paths",
+        "update_timestamp",
+    ],
+}
+
+
+class Chunk(pydantic.BaseModel):
+    hypertable_name: str
+    chunk_name: str
+    range_start: datetime.datetime
+    range_end: datetime.datetime
+    is_compressed: bool
+
+
+async def get_closed_chunks(
+    commands: CommandsAsync, table: str, before: datetime.datetime
+):
+    """Chunks of a hypertable that end before `before`, oldest first."""
+    return await commands.query_async(
+        """
+        SELECT hypertable_name, chunk_name, range_start, range_end, is_compressed
+        FROM timescaledb_information.chunks
+        WHERE hypertable_name = ?table? AND range_end <= ?before?
+        ORDER BY range_start
+        """,
+        model=Chunk,
+        param={"table": table, "before": before},
+    )
+
+
+async def get_chunk_symbol_ids(commands: CommandsAsync, chunk: Chunk) -> list[int]:
+    _check_table(chunk.hypertable_name)
+    rows = await commands.query_async(
+        f"""
+        SELECT DISTINCT symbol_id
+        FROM {chunk.hypertable_name}
+        WHERE timestamp >= ?start? AND timestamp < ?end?
+        ORDER BY symbol_id
+        """,
+        param={"start": chunk.range_start, "end": chunk.range_end},
+    )
+    return [row["symbol_id"] for row in rows]
+
+
+async def get_stream_rows(
+    commands: CommandsAsync,
+    table: str,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+):
+    """The archived columns of a symbol within [start, end), ordered by timestamp."""
+    _check_table(table)
+    return await commands.query_async(
+        f"""
+        SELECT {", ".join(STREAM_TABLES_COLUMNS[table])}
+        FROM {table}
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+        ORDER BY timestamp
+        """,
+        param={"symbol_id": symbol_id, "start": start, "end": end},
+    )
+
+
+async def drop_chunk(commands: CommandsAsync, chunk: Chunk):
+    # Only drops the chunks entirely within the range, i.e. this one.
+    await commands.execute_async(
+        """
+        SELECT drop_chunks(
+            ?table?::REGCLASS, older_than => ?end?, newer_than => ?start?
+        )
+        """,
+        param={
+            "table": chunk.hypertable_name,
+            "start": chunk.range_start,
+            "end": chunk.range_end,
+        },
+    )
+
+
+def _check_table(table: str):
+    # Table names are formatted into the queries.
+    if table not in STREAM_TABLES_COLUMNS:
+        raise ValueError(f"Unknown stream table {table}")
@@ -0,0 +1,465 @@
+import asyncio
+import datetime
+import decimal
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydapper.types import ListParamType
+
+from fireagg import settings
+from fireagg.archive import ARCHIVE_SCHEMAS, partition_dir
+from fireagg.history import DECIMAL, TIMESTAMP
+
+from . import db
+from .storage import Storage
+from .symbols import ConnectorSymbolInput, ConnectorSymbolMapping, Symbol, SymbolInput
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = "symbols.json"
+SEGMENT_SUFFIX = ".arrows"
+
+# Same rounding and overflow as the NUMERIC(32, 18) columns.
+DECIMAL_QUANTUM = decimal.Decimal(1).scaleb(-DECIMAL.scale)
+DECIMAL_CONTEXT = decimal.Context(
+    prec=DECIMAL.precision, rounding=decimal.ROUND_HALF_UP
+)
+
+_segment_ids = itertools.count()
+
+
+class LocalSymbolRegistry:
+    """Symbols and their connector mappings, in a JSON file shared by the processes
+    of a node. Changes lock the file, and apply to its latest version."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.symbols: dict[str, Symbol] = {}
+        self.symbols_by_id: dict[int, Symbol] = {}
+        self.mappings: dict[tuple[int, str], dict] = {}
+        self._mtime_ns: Optional[int] = None
+
+    def reload(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+
+        with open(self.path) as f:
+            data = json.load(f)
+        self.symbols = {s["symbol"]: Symbol(**s) for s in data["symbols"]}
+        self.symbols_by_id = {s.id: s for s in self.symbols.values()}
+        self.mappings = {
+            (m["symbol_id"], m["connector"]): m for m in data["symbols_map"]
+        }
+        self._mtime_ns = mtime_ns
+
+    @contextmanager
+    def update(self):
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.reload()
+            yield
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "symbols": [s.model_dump() for s in self.symbols.values()],
+                        "symbols_map": list(self.mappings.values()),
+                    },
+                    f,
+                    indent=1,
+                )
+            os.replace(tmp_path, self.path)
+            self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def mapping_model(self, mapping: dict):
+        symbol = self.symbols_by_id[mapping["symbol_id"]]
+        return ConnectorSymbolMapping(
+            **mapping,
+            symbol=symbol.symbol,
+            base_asset=symbol.base_asset,
+            quote_asset=symbol.quote_asset,
+        )
+
+
+class Segment:
+    """An open Arrow IPC stream of one table, symbol and date. Each flush is a
+    record batch, readable right away, and up to the last complete batch if the
+    process dies."""
+
+    def __init__(self, directory: str, schema: pa.Schema):
+        os.makedirs(directory, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{os.getpid()}-{next(_segment_ids)}"
+        self.stream_path = os.path.join(directory, f".{name}{SEGMENT_SUFFIX}")
+        self.path = os.path.join(directory, f"{name}.parquet")
+        self.opened_at = time.monotonic()
+        self._sink = pa.OSFile(self.stream_path, "wb")
+        self._writer = pa.ipc.new_stream(self._sink, schema)
+
+    def write(self, batch: pa.RecordBatch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        self._sink.close()
+
+
+def read_segment_stream(stream_path: str) -> Optional[pa.Table]:
+    """The complete batches of a segment stream, even while it is written."""
+    batches = []
+    try:
+        with pa.OSFile(stream_path) as source:
+            reader = pa.ipc.open_stream(source)
+            while True:
+                batches.append(reader.read_next_batch())
+    except StopIteration:
+        pass
+    except (pa.ArrowInvalid, OSError):
+        # Truncated, by a crash or a write in progress.
+        pass
+    return pa.Table.from_batches(batches) if batches else None
+
+
+def seal_segment(stream_path: str, path: str):
+    """Rewrites a closed segment stream as a Parquet file."""
+    table = read_segment_stream(stream_path)
+    if table is not None:
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    os.remove(stream_path)
+
+
+class LocalStorage(Storage):
+    """Stores the streams in time-partitioned files, with the layout of the
+    Parquet archive: `<table>/symbol=BTC-USD/date=2023-10-01/<segment>.parquet`.
+
+    Writes append to an open Arrow stream per table, symbol and date, sealed into
+    a Parquet file every `segment_s`. Segments left open by a dead process are
+    sealed on the next start. The symbols registry is a JSON file.
+    """
+
+    def __init__(self, directory: str, segment_s: float):
+        self.directory = directory
+        self.segment_s = segment_s
+        self.registry = LocalSymbolRegistry(os.path.join(directory, REGISTRY_FILE))
+        self.segments: dict[tuple[str, int, datetime.date], Segment] = {}
+        self.last_true_prices: dict[int, dict] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.directory=})"
+
+    async def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.registry.reload()
+        await asyncio.to_thread(self._recover_segments)
+
+    async def close(self):
+        await self._seal_segments(force=True)
+
+    async def get_all_symbols(self):
+        self.registry.reload()
+        return list(self.registry.symbols.values())
+
+    async def get_symbol(self, symbol: str):
+        self.registry.reload()
+        return self.registry.symbols.get(symbol)
+
+    async def get_symbols(self, symbol_names: list[str]):
+        self.registry.reload()
+        return [
+            self.registry.symbols[name]
+            for name in symbol_names
+            if name in self.registry.symbols
+        ]
+
+    async def insert_symbols(self, symbols_input: list[SymbolInput]):
+        if not symbols_input:
+            return
+
+        with self.registry.update():
+            self._insert_symbols(symbols_input)
+
+    async def upsert_symbols(self, symbols_input: list[ConnectorSymbolInput]):
+        if not symbols_input:
+            return
+
+        registry = self.registry
+        with registry.update():
+            self._insert_symbols(symbols_input)
+            for symbol_input in symbols_input:
+                symbol = registry.symbols[symbol_input.symbol]
+                mapping = registry.mappings.setdefault(
+                    (symbol.id, symbol_input.connector),
+                    {
+                        "symbol_id": symbol.id,
+                        "connector": symbol_input.connector,
+                        "is_unavailable": None,
+                    },
+                )
+                mapping["connector_symbol"] = symbol_input.connector_symbol
+
+    def _insert_symbols(self, symbols_input: Sequence[SymbolInput]):
+        # Within a registry update.
+        registry = self.registry
+        next_id = max(registry.symbols_by_id, default=0) + 1
+        for symbol_input in symbols_input:
+            if symbol_input.symbol in registry.symbols:
+                continue
+            symbol = Symbol(
+                id=next_id,
+                **symbol_input.model_dump(
+                    include={"symbol", "base_asset", "quote_asset"}
+                ),
+            )
+            registry.symbols[symbol.symbol] = symbol
+            registry.symbols_by_id[symbol.id] = symbol
+            next_id += 1
+
+    async def get_connector_symbol_mapping(self, connector: str, symbol: str):
+        self.registry.reload()
+        symbol_obj = self.registry.symbols.get(symbol)
+        mapping = symbol_obj and self.registry.mappings.get((symbol_obj.id, connector))
+        if not mapping:
+            raise db.NoResultException()
+        return self.registry.mapping_model(mapping)
+
+    async def mark_connector_symbol_mapping(
+        self, connector: str, symbol_id: int, is_unavailable: Optional[bool] = None
+    ):
+        with self.registry.update():
+            mapping = self.registry.mappings.get((symbol_id, connector))
+            if mapping:
+                mapping["is_unavailable"] = is_unavailable
+
+    async def get_symbol_connectors(self, symbol: str):
+        self.registry.reload()
+        symbol_obj = self.registry.symbols.get(symbol)
+        if symbol_obj is None:
+            return []
+        return [
+            m["connector"]
+            for m in self.registry.mappings.values()
+            if m["symbol_id"] == symbol_obj.id and not m["is_unavailable"]
+        ]
+
+    async def get_connector_symbols(self, connector: str):
+        self.registry.reload()
+        return [
+            self.registry.symbols_by_id[m["symbol_id"]].symbol
+            for m in self.registry.mappings.values()
+            if m["connector"] == connector and not m["is_unavailable"]
+        ]
+
+    async def insert_symbol_trades(self, trades: ListParamType):
+        await self._append("symbol_trades_stream", trades)
+
+    async def insert_symbol_spreads(self, spreads: ListParamType):
+        await self._append("symbol_spreads_stream", spreads)
+
+    async def insert_symbol_true_mid_price(self, mid_prices: ListParamType):
+        for mid_price in mid_prices:
+            last = self.last_true_prices.get(mid_price["symbol_id"])
+            if last is None or last["timestamp_ms"] <= mid_price["timestamp_ms"]:
+                self.last_true_prices[mid_price["symbol_id"]] = mid_price
+        await self._append("symbol_true_mid_price_stream", mid_prices)
+
+    async def insert_symbol_weights(self, weights: ListParamType):
+        await self._append("symbol_weights_stream", weights)
+
+    async def insert_symbol_bbo(self, bbos: ListParamType):
+        await self._append("symbol_bbo_stream", bbos)
+
+    async def insert_symbol_cross_rates(self, cross_rates: ListParamType):
+        await self._append("symbol_cross_rate_stream", cross_rates)
+
+    async def get_last_symbol_true_mid_prices(self, symbol_ids: list[int]):
+        rows = []
+        for symbol_id in symbol_ids:
+            last = self.last_true_prices.get(symbol_id)
+            if last is not None:
+                rows.append(
+                    {
+                        "symbol_id": symbol_id,
+                        "timestamp": _to_datetime(last["timestamp_ms"]),
+                        "true_mid_price": last["true_mid_price"],
+                    }
+                )
+                continue
+
+            # Written by another process.
+            row = await asyncio.to_thread(self._read_last_true_price, symbol_id)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    async def _append(self, table: str, records: ListParamType):
+        self.registry.reload()
+        schema = ARCHIVE_SCHEMAS[table]
+        now_ms = time.time() * 1000
+
+        partitions: dict[tuple[int, datetime.date], list[dict]] = {}
+        for record in records:
+            date = _to_datetime(record["timestamp_ms"]).date()
+            partitions.setdefault((record["symbol_id"], date), []).append(record)
+
+        for (symbol_id, date), partition in partitions.items():
+            segment = self.segments.get((table, symbol_id, date))
+            if segment is None:
+                segment = self.segments[(table, symbol_id, date)] = Segment(
+                    partition_dir(self.directory, table, self._symbol(symbol_id), date),
+                    schema,
+                )
+            segment.write(_to_batch(schema, partition, now_ms))
+
+        await self._seal_segments()
+
+    async def _seal_segments(self, force=False):
+        now = time.monotonic()
+        expired = [
+            key
+            for key, segment in self.segments.items()
+            if force or now - segment.opened_at >= self.segment_s
+        ]
+        for key in expired:
+            segment = self.segments.pop(key, None)
+            if segment is None:
+                # Sealed by a concurrent writer.
+                continue
+            segment.close()
+            await asyncio.to_thread(seal_segment, segment.stream_path, segment.path)
+
+    def _recover_segments(self):
+        pattern = os.path.join(self.directory, "*", "*", "*", f".*{SEGMENT_SUFFIX}")
+        for stream_path in glob.glob(pattern):
+            pid = int(os.path.basename(stream_path).split("-")[1])
+            # Our own pid is a previous run, e.g. as PID 1 of a container.
+            if pid != os.getpid() and _is_running(pid):
+                continue
+            logger.info(f"{self} sealing the segment left by {pid}: {stream_path}")
+            name = os.path.basename(stream_path)[1 : -len(SEGMENT_SUFFIX)]
+            seal_segment(
+                stream_path,
+                os.path.join(os.path.dirname(stream_path), f"{name}.parquet"),
+            )
+
+    def _read_last_true_price(self, symbol_id: int):
+        symbol_dir = os.path.dirname(
+            partition_dir(
+                self.directory,
+                "symbol_true_mid_price_stream",
+                self._symbol(symbol_id),
+                datetime.date.min,
+            )
+        )
+        for date_dir in sorted(glob.glob(os.path.join(symbol_dir, "date=*")))[::-1]:
+            tables = [
+                pq.read_table(path) for path in glob.glob(f"{date_dir}/*.parquet")
+            ]
+            tables += [
+                read_segment_stream(path)
+                for path in glob.glob(f"{date_dir}/.*{SEGMENT_SUFFIX}")
+            ]
+            tables = [t for t in tables if t is not None and t.num_rows]
+            if not tables:
+                continue
+
+            table = pa.concat_tables(tables)
+            last = table.slice(int(np.argmax(table["timestamp"].to_numpy())), 1)
+            return {
+                "symbol_id": symbol_id,
+                "timestamp": last["timestamp"][0].as_py(),
+                "true_mid_price": last["true_mid_price"][0].as_py(),
+            }
+        return None
+
+    def _symbol(self, symbol_id: int) -> str:
+        symbol = self.registry.symbols_by_id.get(symbol_id)
+        return symbol.symbol if symbol else str(symbol_id)
+
+
+def _to_datetime(timestamp_ms: float):
+    return datetime.datetime.fromtimestamp(timestamp_ms / 1000, datetime.timezone.utc)
+
+
+def _to_batch(schema: pa.Schema, records: ListParamType, now_ms: float):
+    columns = []
+    for field in schema:
+        if field.name == "update_timestamp":
+            column = _timestamps([now_ms] * len(records))
+        elif field.type == TIMESTAMP:
+            column = _timestamps([r[f"{field.name}_ms"] for r in records])
+        elif field.type == DECIMAL:
+            column = pa.array(
+                [
+                    (
+                        None
+                        if r[field.name] is None
+                        else r[field.name].quantize(
+                            DECIMAL_QUANTUM, context=DECIMAL_CONTEXT
+                        )
+                    )
+                    for r in records
+                ],
+                DECIMAL,
+            )
+        else:
+            column = pa.array([r[field.name] for r in records], field.type)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _timestamps(timestamps_ms: list[float]):
+    return pa.array(
+        np.round(np.asarray(timestamps_ms, dtype=np.float64) * 1000).astype(np.int64)
+    ).cast(TIMESTAMP)
+
+
+def _is_running(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+LOCAL_STORAGE_LOCK = asyncio.Lock()
+LOCAL_STORAGE: Optional[LocalStorage] = None
+
+
+async def get_local_storage() -> LocalStorage:
+    global LOCAL_STORAGE
+
+    async with LOCAL_STORAGE_LOCK:
+        if LOCAL_STORAGE is None:
+            settings_obj = settings.get()
+            LOCAL_STORAGE = LocalStorage(
+                settings_obj.local_storage_dir, segment_s=settings_obj.local_segment_s
+            )
+            await LOCAL_STORAGE.open()
+    return LOCAL_STORAGE
+
+
+async def close_local_storage():
+    global LOCAL_STORAGE
+
+    async with LOCAL_STORAGE_LOCK:
+        if LOCAL_STORAGE is not None:
+            await LOCAL_STORAGE.close()
+            LOCAL_STORAGE = None
@@ -0,0 +1,185 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiopg
+from pydapper.commands import CommandsAsync
+from pydapper.types import ListParamType
+
+from fireagg import settings
+
+from . import db, symbol_prices, symbols
+
+
+class Storage:
+    """The symbols registry and the stream tables of a deployment.
+
+    Everything outside of the database package goes through this interface, so
+    that deployments without a Postgres server can use the local storage.
+    Analytics queries (history downsampling, chunk archival) stay Postgres only.
+    """
+
+    async def get_all_symbols(self) -> list[symbols.Symbol]:
+        raise NotImplementedError()
+
+    async def get_symbol(self, symbol: str) -> Optional[symbols.Symbol]:
+        raise NotImplementedError()
+
+    async def get_symbols(self, symbol_names: list[str]) -> list[symbols.Symbol]:
+        raise NotImplementedError()
+
+    async def insert_symbols(self, symbols_input: list[symbols.SymbolInput]):
+        """Adds the symbols that don't exist yet, without connectors."""
+        raise NotImplementedError()
+
+    async def upsert_symbols(self, symbols_input: list[symbols.ConnectorSymbolInput]):
+        raise NotImplementedError()
+
+    async def get_connector_symbol_mapping(
+        self, connector: str, symbol: str
+    ) -> symbols.ConnectorSymbolMapping:
+        """Raises a `db.NoResultException` for unknown mappings."""
+        raise NotImplementedError()
+
+    async def mark_connector_symbol_mapping(
+        self, connector: str, symbol_id: int, is_unavailable: Optional[bool] = None
+    ):
+        raise NotImplementedError()
+
+    async def get_symbol_connectors(self, symbol: str) -> list[str]:
+        raise NotImplementedError()
+
+    async def get_connector_symbols(self, connector: str) -> list[str]:
+        raise NotImplementedError()
+
+    async def insert_symbol_trades(self, trades: ListParamType):
+        raise NotImplementedError()
+
+    async def insert_symbol_spreads(self, spreads: ListParamType):
+        raise NotImplementedError()
+
+    async def insert_symbol_true_mid_price(self, mid_prices: ListParamType):
+        raise NotImplementedError()
+
+    async def insert_symbol_weights(self, weights: ListParamType):
+        raise NotImplementedError()
+
+    async def insert_symbol_bbo(self, bbos: ListParamType):
+        raise NotImplementedError()
+
+    async def insert_symbol_cross_rates(self, cross_rates: ListParamType):
+        raise NotImplementedError()
+
+    async def get_last_symbol_true_mid_prices(self, symbol_ids: list[int]):
+        """Rows of symbol_id, timestamp and true_mid_price, for the symbols that
+        have one."""
+        raise NotImplementedError()
+
+
+class PostgresStorage(Storage):
+    def __init__(self, commands: CommandsAsync):
+        self.commands = commands
+
+    async def get_all_symbols(self):
+        return await symbols.get_all(self.commands)
+
+    async def get_symbol(self, symbol: str):
+        return await symbols.get_symbol(self.commands, symbol)
+
+    async def get_symbols(self, symbol_names: list[str]):
+        return await symbols.get_symbols(self.commands, symbol_names)
+
+    async def insert_symbols(self, symbols_input: list[symbols.SymbolInput]):
+        await symbols.insert_many(self.commands, symbols_input)
+
+    async def upsert_symbols(self, symbols_input: list[symbols.ConnectorSymbolInput]):
+        await symbols.upsert_many(self.commands, symbols_input)
+
+    async def get_connector_symbol_mapping(self, connector: str, symbol: str):
+        return await symbols.get_connector_symbol_mapping(
+            self.commands, connector, symbol
+        )
+
+    async def mark_connector_symbol_mapping(
+        self, connector: str, symbol_id: int, is_unavailable: Optional[bool] = None
+    ):
+        await symbols.mark_connector_symbol_mapping(
+            self.commands,
+            connector=connector,
+            symbol_id=symbol_id,
+            is_unavailable=is_unavailable,
+        )
+
+    async def get_symbol_connectors(self, symbol: str):
+        return await symbols.get_symbol_connectors(self.commands, symbol)
+
+    async def get_connector_symbols(self, connector: str):
+        return await symbols.get_connector_symbols(self.commands, connector)
+
+    async def insert_symbol_trades(self, trades: ListParamType):
+        await symbol_prices.insert_symbol_trades(self.commands, trades)
+
+    async def insert_symbol_spreads(self, spreads: ListParamType):
+        await symbol_prices.insert_symbol_spreads(self.commands, spreads)
+
+    async def insert_symbol_true_mid_price(self, mid_prices: ListParamType):
+        await symbol_prices.insert_symbol_true_mid_price(self.commands, mid_prices)
+
+    async def insert_symbol_weights(self, weights: ListParamType):
+        await symbol_prices.insert_symbol_weights(self.commands, weights)
+
+    async def insert_symbol_bbo(self, bbos: ListParamType):
+        await symbol_prices.insert_symbol_bbo(self.commands, bbos)
+
+    async def insert_symbol_cross_rates(self, cross_rates: ListParamType):
+        await symbol_prices.insert_symbol_cross_rates(self.commands, cross_rates)
+
+    async def get_last_symbol_true_mid_prices(self, symbol_ids: list[int]):
+        return await symbol_prices.get_last_symbol_true_mid_prices(
+            self.commands, symbol_ids
+        )
+
+
+def is_local():
+    return settings.get().storage_backend == "local"
+
+
+@asynccontextmanager
+async def connect(pool: Optional[aiopg.Pool] = None) -> AsyncIterator[Storage]:
+    """The configured storage, like `db.connect_async` for Postgres."""
+    if is_local():
+        from .local_storage import get_local_storage
+
+        yield await get_local_storage()
+        return
+
+    async with db.connect_async(pool) as commands:
+        yield PostgresStorage(commands)
+
+
+@asynccontextmanager
+async def default_storage():
+    """Releases the default storage on exit, like `db.default_pool`. The local
+    storage seals its open segments."""
+    if is_local():
+        from .local_storage import close_local_storage
+
+        try:
+            yield
+        finally:
+            await close_local_storage()
+        return
+
+    async with db.default_pool():
+        yield
+
+
+@asynccontextmanager
+async def priority_pool():
+    """A dedicated pool for the stream writers, so that they don't wait on other
+    queries. There is nothing to share with the local storage."""
+    if is_local():
+        yield None
+        return
+
+    async with await db.create_pool(maxsize=1) as pool:
+        yield pool
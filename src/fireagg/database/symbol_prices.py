@@ -1,3 +1,6 @@
+import datetime
+from typing import Optional
+
 from pydapper.commands import CommandsAsync
 from pydapper.types import ListParamType
 from pydapper.exceptions import NoResultException
@@ -79,6 +82,82 @@ async def insert_symbol_true_mid_price(
     )
 
 
+async def insert_symbol_weights(commands: CommandsAsync, weights: ListParamType):
+    await commands.execute_async(
+        """
+        INSERT INTO symbol_weights_stream (
+            connector,
+            symbol_id,
+            timestamp,
+            weight,
+            update_timestamp
+        )
+        VALUES (
+            ?connector?,
+            ?symbol_id?,
+            TO_TIMESTAMP(?timestamp_ms? / 1000.0),
+            ?weight?,
+            NOW()
+        );
+        """,
+        param=weights,
+    )
+
+
+async def insert_symbol_bbo(commands: CommandsAsync, bbos: ListParamType):
+    await commands.execute_async(
+        """
+        INSERT INTO symbol_bbo_stream (
+            symbol_id,
+            timestamp,
+            best_bid,
+            best_bid_connector,
+            best_ask,
+            best_ask_connector,
+            is_crossed,
+            update_timestamp
+        )
+        VALUES (
+            ?symbol_id?,
+            TO_TIMESTAMP(?timestamp_ms? / 1000.0),
+            ?best_bid?,
+            ?best_bid_connector?,
+            ?best_ask?,
+            ?best_ask_connector?,
+            ?is_crossed?,
+            NOW()
+        );
+        """,
+        param=bbos,
+    )
+
+
+async def insert_symbol_cross_rates(
+    commands: CommandsAsync, cross_rates: ListParamType
+):
+    await commands.execute_async(
+        """
+        INSERT INTO symbol_cross_rate_stream (
+            symbol_id,
+            timestamp,
+            rate,
+            hops,
+            paths,
+            update_timestamp
+        )
+        VALUES (
+            ?symbol_id?,
+            TO_TIMESTAMP(?timestamp_ms? / 1000.0),
+            ?rate?,
+            ?hops?,
+            ?paths?,
+            NOW()
+        );
+        """,
+        param=cross_rates,
+    )
+
+
 async def get_last_symbol_true_mid_price(
     commands: CommandsAsync,
     symbol_id: int,
@@ -97,3 +176,236 @@ async def get_last_symbol_true_mid_price(
         return data
     except NoResultException:
         return None
+
+
+async def get_last_symbol_true_mid_prices(
+    commands: CommandsAsync,
+    symbol_ids: list[int],
+):
+    return await commands.query_async(
+        """
+        SELECT ids.symbol_id, last_price.timestamp, last_price.true_mid_price
+        FROM UNNEST(?symbol_ids?::INT[]) AS ids(symbol_id)
+        CROSS JOIN LATERAL (
+            SELECT timestamp, true_mid_price
+            FROM symbol_true_mid_price_stream
+            WHERE symbol_id = ids.symbol_id
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) AS last_price
+        """,
+        param={"symbol_ids": symbol_ids},
+    )
+
+
+# History queries return rows ordered by timestamp, within [start, end). With an
+# interval, rows are downsampled to one per time bucket.
+
+
+async def get_true_mid_price_history(
+    commands: CommandsAsync,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    interval: Optional[datetime.timedelta] = None,
+):
+    param = {"symbol_id": symbol_id, "start": start, "end": end}
+    if interval is None:
+        return await commands.query_async(
+            """
+            SELECT timestamp, true_mid_price
+            FROM symbol_true_mid_price_stream
+            WHERE symbol_id = ?symbol_id?
+                AND timestamp >= ?start? AND timestamp < ?end?
+            ORDER BY timestamp
+            """,
+            param=param,
+        )
+
+    return await commands.query_async(
+        """
+        SELECT
+            time_bucket(?interval?, timestamp) AS timestamp,
+            first(true_mid_price, timestamp) AS open,
+            max(true_mid_price) AS high,
+            min(true_mid_price) AS low,
+            last(true_mid_price, timestamp) AS close
+        FROM symbol_true_mid_price_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        param={**param, "interval": interval},
+    )
+
+
+async def get_spreads_history(
+    commands: CommandsAsync,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    interval: Optional[datetime.timedelta] = None,
+    connector: Optional[str] = None,
+):
+    param = {"symbol_id": symbol_id, "start": start, "end": end, "connector": connector}
+    if interval is None:
+        return await commands.query_async(
+            """
+            SELECT timestamp, connector, best_bid, best_ask
+            FROM symbol_spreads_stream
+            WHERE symbol_id = ?symbol_id?
+                AND timestamp >= ?start? AND timestamp < ?end?
+                AND (?connector?::TEXT IS NULL OR connector = ?connector?)
+            ORDER BY timestamp
+            """,
+            param=param,
+        )
+
+    return await commands.query_async(
+        """
+        SELECT
+            time_bucket(?interval?, timestamp) AS timestamp,
+            connector,
+            last(best_bid, timestamp) AS best_bid,
+            last(best_ask, timestamp) AS best_ask
+        FROM symbol_spreads_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+            AND (?connector?::TEXT IS NULL OR connector = ?connector?)
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """,
+        param={**param, "interval": interval},
+    )
+
+
+async def get_trades_history(
+    commands: CommandsAsync,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    interval: Optional[datetime.timedelta] = None,
+    connector: Optional[str] = None,
+):
+    param = {"symbol_id": symbol_id, "start": start, "end": end, "connector": connector}
+    if interval is None:
+        return await commands.query_async(
+            """
+            SELECT timestamp, connector, price, amount, is_buy
+            FROM symbol_trades_stream
+            WHERE symbol_id = ?symbol_id?
+                AND timestamp >= ?start? AND timestamp < ?end?
+                AND (?connector?::TEXT IS NULL OR connector = ?connector?)
+            ORDER BY timestamp
+            """,
+            param=param,
+        )
+
+    return await commands.query_async(
+        """
+        SELECT
+            time_bucket(?interval?, timestamp) AS timestamp,
+            first(price, timestamp) AS open,
+            max(price) AS high,
+            min(price) AS low,
+            last(price, timestamp) AS close,
+            sum(amount) AS volume,
+            count(*) AS trades
+        FROM symbol_trades_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+            AND (?connector?::TEXT IS NULL OR connector = ?connector?)
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        param={**param, "interval": interval},
+    )
+
+
+# Columnar loads for offline recomputes: timestamps in ms and mid prices as floats,
+# computed by the database.
+
+
+async def get_mid_prices_history(
+    commands: CommandsAsync,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+):
+    return await commands.query_async(
+        """
+        SELECT
+            EXTRACT(EPOCH FROM timestamp)::FLOAT8 * 1000 AS timestamp_ms,
+            connector,
+            ((best_bid + best_ask) / 2)::FLOAT8 AS mid_price
+        FROM symbol_spreads_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+            AND best_bid IS NOT NULL AND best_ask IS NOT NULL
+        ORDER BY timestamp
+        """,
+        param={"symbol_id": symbol_id, "start": start, "end": end},
+    )
+
+
+async def get_last_mid_prices(
+    commands: CommandsAsync,
+    symbol_id: int,
+    since: datetime.datetime,
+    before: datetime.datetime,
+):
+    """The last mid price of each connector within [since, before)."""
+    return await commands.query_async(
+        """
+        SELECT DISTINCT ON (connector)
+            EXTRACT(EPOCH FROM timestamp)::FLOAT8 * 1000 AS timestamp_ms,
+            connector,
+            ((best_bid + best_ask) / 2)::FLOAT8 AS mid_price
+        FROM symbol_spreads_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?since? AND timestamp < ?before?
+            AND best_bid IS NOT NULL AND best_ask IS NOT NULL
+        ORDER BY connector, timestamp DESC
+        """,
+        param={"symbol_id": symbol_id, "since": since, "before": before},
+    )
+
+
+async def get_weights_history(
+    commands: CommandsAsync,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+):
+    return await commands.query_async(
+        """
+        SELECT
+            EXTRACT(EPOCH FROM timestamp)::FLOAT8 * 1000 AS timestamp_ms,
+            connector,
+            weight
+        FROM symbol_weights_stream
+        WHERE symbol_id = ?symbol_id?
+            AND timestamp >= ?start? AND timestamp < ?end?
+        ORDER BY timestamp
+        """,
+        param={"symbol_id": symbol_id, "start": start, "end": end},
+    )
+
+
+async def get_last_weights(
+    commands: CommandsAsync, symbol_id: int, before: datetime.datetime
+):
+    """The last weight of each connector before `before`."""
+    return await commands.query_async(
+        """
+        SELECT DISTINCT ON (connector)
+            EXTRACT(EPOCH FROM timestamp)::FLOAT8 * 1000 AS timestamp_ms,
+            connector,
+            weight
+        FROM symbol_weights_stream
+        WHERE symbol_id = ?symbol_id? AND timestamp < ?before?
+        ORDER BY connector, timestamp DESC
+        """,
+        param={"symbol_id": symbol_id, "before": before},
+    )
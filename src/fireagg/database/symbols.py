@@ -71,7 +71,8 @@ async def get_symbol(commands: CommandsAsync, symbol: str):
         return None
 
 
-async def upsert_many(commands: CommandsAsync, symbols: list[ConnectorSymbolInput]):
+async def insert_many(commands: CommandsAsync, symbols: list[SymbolInput]):
+    """Inserts the symbols that don't exist yet, without connectors."""
     if not symbols:
         return
 
@@ -87,6 +88,13 @@ async def upsert_many(commands: CommandsAsync, symbols: list[ConnectorSymbolInpu
         ],
     )
 
+
+async def upsert_many(commands: CommandsAsync, symbols: list[ConnectorSymbolInput]):
+    if not symbols:
+        return
+
+    await insert_many(commands, symbols)
+
     all_symbols = await get_all(commands)
     symbols_to_id = {symbol.symbol: symbol.id for symbol in all_symbols}
 
@@ -109,6 +117,18 @@ async def upsert_many(commands: CommandsAsync, symbols: list[ConnectorSymbolInpu
     )
 
 
+async def get_symbols(commands: CommandsAsync, symbols: list[str]):
+    return await commands.query_async(
+        """
+        SELECT id, symbol, base_asset, quote_asset
+        FROM symbols
+        WHERE symbol = ANY(?symbols?)
+        """,
+        model=Symbol,
+        param={"symbols": symbols},
+    )
+
+
 async def get_symbol_connectors(commands: CommandsAsync, symbol: str):
     connectors = await commands.query_async(
         """
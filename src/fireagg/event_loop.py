@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from typing import Coroutine, Optional, TypeVar
+
+from fireagg import settings
+from fireagg.metrics import get_event_loop_metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Don't flood the logs when the loop is saturated.
+SLOW_CALLBACK_WARNING_INTERVAL_S = 10
+
+
+def setup_event_loop() -> str:
+    """Installs the event loop policy picked in the settings, and returns its name.
+    With "auto", uvloop is used when it is installed."""
+    choice = settings.get().event_loop
+    if choice == "asyncio":
+        return "asyncio"
+
+    try:
+        import uvloop
+    except ImportError:
+        if choice == "uvloop":
+            raise RuntimeError("EVENT_LOOP=uvloop, but uvloop is not installed.")
+        return "asyncio"
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+def run(main: Coroutine[None, None, T]) -> T:
+    """`asyncio.run`, with the configured event loop."""
+    setup_event_loop()
+    return asyncio.run(main)
+
+
+def loop_name(loop: Optional[asyncio.AbstractEventLoop] = None) -> str:
+    loop = loop or asyncio.get_running_loop()
+    return "uvloop" if type(loop).__module__.startswith("uvloop") else "asyncio"
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop runs a timer.
+
+    A loop that is late while its thread keeps the CPU busy is CPU-bound (parsing,
+    Decimal conversions...). A loop that is late while mostly idle is waiting on
+    I/O or blocked in a syscall. Lags above `slow_callback_s` mean that a callback
+    held the loop for that long, and are counted and logged.
+    """
+
+    def __init__(self, interval_s: float, slow_callback_s: float):
+        self.interval_s = interval_s
+        self.slow_callback_s = slow_callback_s
+        self._last_warning = 0.0
+
+    async def run(self):
+        lag_histogram, slow_callbacks_counter, busy_gauge = get_event_loop_metrics(
+            loop=loop_name()
+        )
+        while True:
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            await asyncio.sleep(self.interval_s)
+            wall_s = time.perf_counter() - wall_start
+            cpu_s = time.thread_time() - cpu_start
+
+            lag_s = max(0.0, wall_s - self.interval_s)
+            lag_histogram.observe(lag_s)
+            busy_gauge.set(min(1.0, cpu_s / wall_s))
+
+            if lag_s >= self.slow_callback_s:
+                slow_callbacks_counter.inc()
+                now = time.monotonic()
+                if now - self._last_warning >= SLOW_CALLBACK_WARNING_INTERVAL_S:
+                    self._last_warning = now
+                    logger.warning(
+                        f"Event loop blocked for {lag_s:.3f}s, "
+                        f"{cpu_s / wall_s:.0%} busy"
+                    )
+
+
+_monitor_tasks: dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+
+def start_loop_monitor():
+    """Starts the lag monitor on the running loop, once."""
+    loop = asyncio.get_running_loop()
+    task = _monitor_tasks.get(loop)
+    if task is not None and not task.done():
+        return task
+
+    settings_obj = settings.get()
+    monitor = LoopLagMonitor(
+        interval_s=settings_obj.loop_lag_sample_interval_s,
+        slow_callback_s=settings_obj.slow_callback_s,
+    )
+    _monitor_tasks[loop] = task = loop.create_task(monitor.run())
+    task.add_done_callback(lambda _: _monitor_tasks.pop(loop, None))
+    return task
@@ -0,0 +1,178 @@
+import datetime
+import decimal
+import io
+import json
+from typing import AsyncIterator, Literal, Optional
+
+import pyarrow as pa
+
+from fireagg import settings
+from fireagg.database import db, symbol_prices
+
+HistoryStream = Literal["true_mid_price", "spreads", "trades"]
+
+# Same origin as time_bucket, so that pages never split a bucket.
+TIME_BUCKET_ORIGIN = datetime.datetime(2000, 1, 3, tzinfo=datetime.timezone.utc)
+
+DECIMAL = pa.decimal128(32, 18)
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+SCHEMAS: dict[tuple[HistoryStream, bool], pa.Schema] = {
+    ("true_mid_price", False): pa.schema(
+        [("timestamp", TIMESTAMP), ("true_mid_price", DECIMAL)]
+    ),
+    ("true_mid_price", True): pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("open", DECIMAL),
+            ("high", DECIMAL),
+            ("low", DECIMAL),
+            ("close", DECIMAL),
+        ]
+    ),
+    ("spreads", False): pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("best_bid", DECIMAL),
+            ("best_ask", DECIMAL),
+        ]
+    ),
+    ("spreads", True): pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("best_bid", DECIMAL),
+            ("best_ask", DECIMAL),
+        ]
+    ),
+    ("trades", False): pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("connector", pa.string()),
+            ("price", DECIMAL),
+            ("amount", DECIMAL),
+            ("is_buy", pa.bool_()),
+        ]
+    ),
+    ("trades", True): pa.schema(
+        [
+            ("timestamp", TIMESTAMP),
+            ("open", DECIMAL),
+            ("high", DECIMAL),
+            ("low", DECIMAL),
+            ("close", DECIMAL),
+            ("volume", DECIMAL),
+            ("trades", pa.int64()),
+        ]
+    ),
+}
+
+
+def history_schema(stream: HistoryStream, interval: Optional[datetime.timedelta]):
+    return SCHEMAS[(stream, interval is not None)]
+
+
+def align_to_bucket(
+    timestamp: datetime.datetime, interval: datetime.timedelta
+) -> datetime.datetime:
+    return timestamp - (timestamp - TIME_BUCKET_ORIGIN) % interval
+
+
+async def iter_history_pages(
+    stream: HistoryStream,
+    symbol_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    interval: Optional[datetime.timedelta] = None,
+    connector: Optional[str] = None,
+) -> AsyncIterator[list[dict]]:
+    """Rows of a stream, one time window at a time.
+
+    Each window is a separate query, so that the connection is released in
+    between and nothing is buffered beyond a page. Windows are consecutive time
+    ranges, so rows are never skipped or repeated, whatever their timestamps.
+    """
+    settings_obj = settings.get()
+    if interval is not None:
+        start = align_to_bucket(start, interval)
+        page = interval * settings_obj.history_page_buckets
+    else:
+        page = datetime.timedelta(seconds=settings_obj.history_raw_page_s)
+
+    page_start = start
+    while page_start < end:
+        page_end = min(page_start + page, end)
+        async with db.connect_async() as commands:
+            if stream == "true_mid_price":
+                rows = await symbol_prices.get_true_mid_price_history(
+                    commands, symbol_id, page_start, page_end, interval=interval
+                )
+            elif stream == "spreads":
+                rows = await symbol_prices.get_spreads_history(
+                    commands,
+                    symbol_id,
+                    page_start,
+                    page_end,
+                    interval=interval,
+                    connector=connector,
+                )
+            else:
+                rows = await symbol_prices.get_trades_history(
+                    commands,
+                    symbol_id,
+                    page_start,
+                    page_end,
+                    interval=interval,
+                    connector=connector,
+                )
+
+        if rows:
+            yield rows
+        page_start = page_end
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f"Unable to encode {value!r}")
+
+
+def _json_row(row: dict):
+    # Same format as the streaming endpoints.
+    encoded = dict(row)
+    encoded["timestamp_ms"] = encoded.pop("timestamp").timestamp() * 1000
+    return encoded
+
+
+async def encode_json(pages: AsyncIterator[list[dict]]) -> AsyncIterator[str]:
+    """A JSON array, written a page at a time."""
+    first = True
+    yield "["
+    async for rows in pages:
+        chunk = ",".join(
+            json.dumps(_json_row(row), default=_json_default) for row in rows
+        )
+        yield chunk if first else "," + chunk
+        first = False
+    yield "]"
+
+
+async def encode_arrow(
+    pages: AsyncIterator[list[dict]], schema: pa.Schema
+) -> AsyncIterator[bytes]:
+    """An Arrow IPC stream, with a record batch per page."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield _take(sink)
+        async for rows in pages:
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+            yield _take(sink)
+    yield _take(sink)
+
+
+def _take(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
@@ -4,7 +4,7 @@ from decimal import Decimal
 from typing import AsyncIterator, NamedTuple
 
 from fireagg.input_streams import __name__ as input_streams_name
-from fireagg.database import db, symbols
+from fireagg.database import db, storage, symbols
 
 
 class Trade(NamedTuple):
@@ -35,10 +35,8 @@ class Connector(ABC):
 
     async def seed_markets(self, on_error="ignore", skip_if_symbols=True):
         if skip_if_symbols:
-            async with db.connect_async() as commands:
-                mappings = await symbols.get_connector_symbols(
-                    commands, connector=self.name
-                )
+            async with storage.connect() as store:
+                mappings = await store.get_connector_symbols(self.name)
 
             if mappings:
                 return
@@ -65,9 +63,8 @@ class Connector(ABC):
     ):
         if is_unavailable:
             self.logger.warning(f"Disabling {self.name} {mapping.symbol}")
-        async with db.connect_async() as commands:
-            await symbols.mark_connector_symbol_mapping(
-                commands,
+        async with storage.connect() as store:
+            await store.mark_connector_symbol_mapping(
                 connector=mapping.connector,
                 symbol_id=mapping.symbol_id,
                 is_unavailable=is_unavailable,
@@ -77,23 +74,22 @@ class Connector(ABC):
         self, symbol_mappings: list[symbols.ConnectorSymbolInput]
     ):
         self.logger.info(f"Loading {len(symbol_mappings)} symbols for {self.name}")
-        async with db.connect_async() as commands:
-            await symbols.upsert_many(commands, symbol_mappings)
+        async with storage.connect() as store:
+            await store.upsert_symbols(symbol_mappings)
 
     @abstractmethod
     async def do_seed_markets(self) -> list[symbols.ConnectorSymbolInput]:
         raise NotImplementedError()
 
     async def seed_and_get_connector_symbol_mapping(self, symbol: str, _retried=False):
-        async with db.connect_async() as commands:
+        async with storage.connect() as store:
             try:
-                return await symbols.get_connector_symbol_mapping(
-                    commands, self.name, symbol
-                )
+                return await store.get_connector_symbol_mapping(self.name, symbol)
             except db.NoResultException:
                 if _retried:
                     raise
-                await self.seed_markets(on_error="raise")
+                # The connector might have been seeded before this symbol existed.
+                await self.seed_markets(on_error="raise", skip_if_symbols=False)
                 return await self.seed_and_get_connector_symbol_mapping(
                     symbol=symbol, _retried=True
                 )
@@ -105,6 +101,14 @@ class Connector(ABC):
     def do_watch_trades(self, connector_symbol: str) -> AsyncIterator[Trade]:
         raise NotImplementedError()
 
+    async def do_watch_trades_batches(
+        self, connector_symbol: str
+    ) -> AsyncIterator[list[Trade]]:
+        """Trades grouped as they were received, e.g. one websocket frame. Connectors
+        that receive trades in bulk should override this."""
+        async for trade in self.do_watch_trades(connector_symbol):
+            yield [trade]
+
     @abstractmethod
     def do_watch_spreads(self, connector_symbol: str) -> AsyncIterator[MidPrice]:
         raise NotImplementedError()
@@ -112,7 +116,15 @@ class Connector(ABC):
     async def do_get_market(self, connector_symbol: str) -> Market:
         raise NotImplementedError()
 
+    async def do_get_markets(self, connector_symbols: list[str]) -> dict[str, Market]:
+        """Markets of many symbols, keyed by connector symbol. Connectors with a bulk
+        API should override this."""
+        return {
+            connector_symbol: await self.do_get_market(connector_symbol)
+            for connector_symbol in connector_symbols
+        }
+
 
 async def list_symbol_connectors(symbol: str):
-    async with db.connect_async() as commands:
-        return await symbols.get_symbol_connectors(commands, symbol)
+    async with storage.connect() as store:
+        return await store.get_symbol_connectors(symbol)
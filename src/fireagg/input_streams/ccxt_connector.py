@@ -7,10 +7,19 @@ from typing import AsyncIterator
 import ccxt.async_support
 import ccxt.pro
 from ccxt.async_support.base.exchange import Exchange
-from ccxt.base.errors import AuthenticationError, NotSupported, RequestTimeout
+from ccxt.base.errors import (
+    AuthenticationError,
+    DDoSProtection,
+    NotSupported,
+    RequestTimeout,
+)
 
 from fireagg.input_streams.base import Connector, Trade, MidPrice, Market
+from fireagg.input_streams.ccxt_sessions import exchange_session
+from fireagg.input_streams.markets_cache import get_markets_cache
+from fireagg.input_streams.order_book import TopOfBookTracker
 from fireagg.database import symbols
+from fireagg import settings
 
 
 def list_ccxt_connector_names():
@@ -32,6 +41,14 @@ LOWEST_ORDER_BOOK_BY_EXCHANGE = {
     "huobi": 150,
 }
 
+# The order book limits used with a min notional instead, for the exchanges whose
+# lowest limit only has the top level, which the filter can't skip.
+MIN_NOTIONAL_ORDER_BOOK_BY_EXCHANGE = {
+    "bybit": 50,
+}
+
+FETCH_TICKERS_BATCH_SIZE = 100
+
 
 class CCXTConnector(Connector):
     symbols_rewrite: dict[str, str] = {"BTC/USD:BTC": "BTC/USD"}
@@ -53,6 +70,9 @@ class CCXTConnector(Connector):
         await self._load_markets()
 
     async def _load_markets(self):
+        return await get_markets_cache().get(self.name, self._fetch_markets)
+
+    async def _fetch_markets(self):
         markets = {}
         exchange: Exchange = getattr(ccxt.async_support, self.name)()
         try:
@@ -62,44 +82,64 @@ class CCXTConnector(Connector):
         return markets
 
     async def do_watch_trades(self, connector_symbol: str) -> AsyncIterator[Trade]:
-        async with self._exchange() as exchange:
+        async for trades in self.do_watch_trades_batches(connector_symbol):
+            for trade in trades:
+                yield trade
+
+    async def do_watch_trades_batches(
+        self, connector_symbol: str
+    ) -> AsyncIterator[list[Trade]]:
+        async with self._exchange() as session:
             # 5 minutes in the past.
             timestamp_deadline = (time.time() - 300) * 1000
-            while self.running:
+            async for trades in session.watch_trades(connector_symbol):
+                if not self.running:
+                    break
                 # TODO(will): maybe only process the last trade?
-                trades: list[dict] = await exchange.watch_trades(connector_symbol)
-                for trade in trades:
-                    timestamp_ms = trade["timestamp"]
-                    if timestamp_ms < timestamp_deadline:
-                        # Some exchanges return very old trades for some reason.
-                        continue
-                    yield Trade(
-                        timestamp_ms=timestamp_ms,
+                batch = [
+                    Trade(
+                        timestamp_ms=trade["timestamp"],
                         price=Decimal(trade["price"]),
                         amount=Decimal(trade["amount"]),
                         is_buy=(trade["side"] == "buy"),
                     )
+                    for trade in trades
+                    # Some exchanges return very old trades for some reason.
+                    if trade["timestamp"] >= timestamp_deadline
+                ]
+                if batch:
+                    yield batch
 
     async def do_watch_spreads(self, connector_symbol: str):
+        # Levels below this notional (in quote currency) are ignored.
+        min_notional = settings.get().spreads_min_notional
         limit = LOWEST_ORDER_BOOK_BY_EXCHANGE.get(self.name, 25)
+        if min_notional:
+            limit = MIN_NOTIONAL_ORDER_BOOK_BY_EXCHANGE.get(self.name, limit)
         retries = 3
-        async with self._exchange() as exchange:
+        top_of_book = TopOfBookTracker(min_notional)
+        async with self._exchange() as session:
             while self.running:
                 try:
                     # Change to throttling mode: we don't care about sub-20ms order book updates
                     # https://docs.ccxt.com/#/ccxt.pro.manual?id=real-time-vs-throttling
-                    book = await exchange.watch_order_book(
+                    async for book in session.watch_order_book(
                         connector_symbol, limit=limit
-                    )
-                    # TODO(will): Filter out orders for less than 5, 10$
-                    best_bid = Decimal(book["bids"][0][0])
-                    best_ask = Decimal(book["asks"][0][0])
-
-                    yield MidPrice(
-                        timestamp_ms=book["timestamp"],
-                        best_bid=best_bid,
-                        best_ask=best_ask,
-                    )
+                    ):
+                        if not self.running:
+                            break
+
+                        top = top_of_book.update(book["bids"], book["asks"])
+                        if top is None:
+                            # Unchanged or empty top of book.
+                            continue
+
+                        best_bid, best_ask = top
+                        yield MidPrice(
+                            timestamp_ms=book["timestamp"],
+                            best_bid=Decimal(best_bid),
+                            best_ask=Decimal(best_ask),
+                        )
                 except (asyncio.TimeoutError, RequestTimeout):
                     if retries > 0:
                         self.logger.info(f"Timeout with {self.name}: Retrying...")
@@ -109,23 +149,57 @@ class CCXTConnector(Connector):
                         raise
 
     async def do_get_market(self, connector_symbol: str) -> Market:
-        async with self._exchange() as exchange:
-            ticker = await exchange.fetch_ticker(connector_symbol)
+        async with self._exchange() as session:
+            ticker = await session.exchange.fetch_ticker(connector_symbol)
             return Market(
                 close=Decimal(ticker["close"]), volume_24h=float(ticker["baseVolume"])
             )
 
+    async def do_get_markets(self, connector_symbols: list[str]) -> dict[str, Market]:
+        async with self._exchange() as session:
+            exchange = session.exchange
+            if not exchange.has.get("fetchTickers"):
+                return await super().do_get_markets(connector_symbols)
+
+            await session.load_markets()
+            markets = {}
+            for i in range(0, len(connector_symbols), FETCH_TICKERS_BATCH_SIZE):
+                batch = connector_symbols[i : i + FETCH_TICKERS_BATCH_SIZE]
+                tickers = await self._fetch_tickers(exchange, batch)
+                for connector_symbol in batch:
+                    ticker = tickers.get(exchange.market(connector_symbol)["symbol"])
+                    if ticker and ticker["close"] is not None:
+                        markets[connector_symbol] = Market(
+                            close=Decimal(ticker["close"]),
+                            volume_24h=float(ticker["baseVolume"] or 0),
+                        )
+            return markets
+
+    async def _fetch_tickers(self, exchange: Exchange, connector_symbols: list[str]):
+        # The shared exchange already throttles its requests to the exchange rate
+        # limit, this only backs off when we get told we're going too fast anyway.
+        retries = 3
+        while True:
+            try:
+                return await exchange.fetch_tickers(connector_symbols)
+            except DDoSProtection:
+                if retries <= 0:
+                    raise
+                sleep_s = max(1, exchange.rateLimit / 1000) * 2 ** (3 - retries)
+                self.logger.info(f"Rate limited by {self.name}: Retrying...")
+                retries = retries - 1
+                await asyncio.sleep(sleep_s)
+
     @asynccontextmanager
     async def _exchange(self):
-        try:
-            exchange: Exchange = getattr(ccxt.pro, self.name)()
-        except AttributeError:
+        if not hasattr(ccxt.pro, self.name):
             raise NotImplementedError(
                 f"Unable to watch connector {self.name} because of it's not supported by CCXT Pro (no pro exchange named like that)."
             )
 
         try:
-            yield exchange
+            async with exchange_session(self.name) as session:
+                yield session
         except AuthenticationError:
             raise NotImplementedError(
                 f"Unable to watch connector {self.name} because of authentication error."
@@ -138,5 +212,3 @@ class CCXTConnector(Connector):
             raise RuntimeError(
                 f"Runtime error while watching {self.name}: {str(e)}"
             ) from e
-        finally:
-            await exchange.close()
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import ccxt.pro
+from ccxt.async_support.base.exchange import Exchange
+
+from fireagg.input_streams.markets_cache import get_markets_cache
+
+logger = logging.getLogger(__name__)
+
+WatchForSymbols = Callable[[list[str]], Awaitable[list[tuple[str, Any]]]]
+
+
+class SymbolsMultiplexer:
+    """Runs a single `watch_*_for_symbols` loop for all the subscribed symbols of an
+    exchange, and dispatches each update to the subscribers of its symbol.
+
+    When `conflate` is set, an update is dropped if the subscriber still has one
+    waiting. Order books are live ccxt objects, so the subscriber always reads the
+    latest state anyway.
+    """
+
+    def __init__(self, watch_for_symbols: WatchForSymbols, conflate: bool = False):
+        self.watch_for_symbols = watch_for_symbols
+        self.conflate = conflate
+
+        self.subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def subscribe(self, symbol: str) -> AsyncIterator[Any]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers[symbol].add(queue)
+        self._changed.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        try:
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.subscribers[symbol].discard(queue)
+            if not self.subscribers[symbol]:
+                del self.subscribers[symbol]
+            if not self.subscribers and self._task:
+                self._task.cancel()
+
+    async def _run(self):
+        watch: Optional[asyncio.Future] = None
+        try:
+            while self.subscribers:
+                if watch is None or self._changed.is_set():
+                    # A single call for the current symbols. A stale call would only
+                    # complete on an update of its own symbols, so it is cancelled:
+                    # ccxt keeps its subscriptions, and replaces cancelled futures.
+                    self._changed.clear()
+                    if watch is not None:
+                        watch.cancel()
+                    watch = asyncio.ensure_future(
+                        self.watch_for_symbols(sorted(self.subscribers))
+                    )
+
+                changed = asyncio.ensure_future(self._changed.wait())
+                await asyncio.wait(
+                    {watch, changed}, return_when=asyncio.FIRST_COMPLETED
+                )
+                changed.cancel()
+                if not watch.done():
+                    continue
+
+                result, watch = watch.result(), None
+                for symbol, item in result:
+                    for queue in self.subscribers.get(symbol, ()):
+                        if self.conflate and not queue.empty():
+                            continue
+                        queue.put_nowait(item)
+        except Exception as e:
+            # Subscribers handle errors the same way as with a dedicated exchange.
+            for queues in self.subscribers.values():
+                for queue in queues:
+                    queue.put_nowait(e)
+        finally:
+            if watch is not None:
+                watch.cancel()
+
+
+class ExchangeSession:
+    """One ccxt.pro exchange shared by every producer of a connector.
+
+    ccxt.pro keeps one websocket client per url on an exchange instance, so sharing
+    the instance is enough to share connections between symbols. Exchanges that
+    support it additionally get a single subscription loop for all the symbols.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.exchange: Exchange = getattr(ccxt.pro, name)()
+        self.ref_count = 0
+
+        self._markets_lock = asyncio.Lock()
+        self._markets_loaded = False
+
+        self._trades = SymbolsMultiplexer(self._watch_trades_for_symbols)
+        self._order_books: dict[int, SymbolsMultiplexer] = {}
+
+    async def load_markets(self):
+        if self._markets_loaded:
+            return
+
+        async with self._markets_lock:
+            if not self._markets_loaded:
+                markets = await get_markets_cache().get(
+                    self.name, self.exchange.load_markets
+                )
+                if not self.exchange.markets:
+                    self.exchange.set_markets(list(markets.values()))
+                self._markets_loaded = True
+
+    async def watch_trades(self, connector_symbol: str) -> AsyncIterator[list[dict]]:
+        await self.load_markets()
+        if self.exchange.has.get("watchTradesForSymbols"):
+            symbol = self.exchange.market(connector_symbol)["symbol"]
+            async for trades in self._trades.subscribe(symbol):
+                yield trades
+        else:
+            while True:
+                yield await self.exchange.watch_trades(connector_symbol)
+
+    async def watch_order_book(
+        self, connector_symbol: str, limit: int
+    ) -> AsyncIterator[dict]:
+        await self.load_markets()
+        if self.exchange.has.get("watchOrderBookForSymbols"):
+            symbol = self.exchange.market(connector_symbol)["symbol"]
+            if limit not in self._order_books:
+                self._order_books[limit] = SymbolsMultiplexer(
+                    self._watch_order_book_for_symbols(limit), conflate=True
+                )
+            async for book in self._order_books[limit].subscribe(symbol):
+                yield book
+        else:
+            while True:
+                yield await self.exchange.watch_order_book(
+                    connector_symbol, limit=limit
+                )
+
+    async def _watch_trades_for_symbols(self, symbols: list[str]):
+        trades: list[dict] = await self.exchange.watch_trades_for_symbols(symbols)
+        trades_by_symbol: dict[str, list[dict]] = defaultdict(list)
+        for trade in trades:
+            trades_by_symbol[trade["symbol"]].append(trade)
+        return list(trades_by_symbol.items())
+
+    def _watch_order_book_for_symbols(self, limit: int) -> WatchForSymbols:
+        async def _watch(symbols: list[str]):
+            book = await self.exchange.watch_order_book_for_symbols(
+                symbols, limit=limit
+            )
+            return [(book["symbol"], book)]
+
+        return _watch
+
+    async def close(self):
+        await self.exchange.close()
+
+
+SESSIONS: dict[str, ExchangeSession] = {}
+
+
+@asynccontextmanager
+async def exchange_session(name: str):
+    """Reference counted access to the process-wide session of an exchange. The
+    exchange is closed when its last user leaves."""
+    session = SESSIONS.get(name)
+    if session is None:
+        session = SESSIONS[name] = ExchangeSession(name)
+
+    session.ref_count += 1
+    try:
+        yield session
+    finally:
+        session.ref_count -= 1
+        if session.ref_count == 0:
+            if SESSIONS.get(name) is session:
+                del SESSIONS[name]
+            await session.close()
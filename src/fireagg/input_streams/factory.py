@@ -13,20 +13,22 @@ def list_connectors():
 
 
 def create_connector(name: str) -> Connector:
+    # Connectors can be parametrized by their name, e.g. `_replay:kraken`.
+    class_name, _, _ = name.partition(":")
     try:
-        possible_module_name = f"{input_streams_name}.impl.{name}"
+        possible_module_name = f"{input_streams_name}.impl.{class_name}"
         connector_module = importlib.import_module(possible_module_name)
     except ImportError:
         # Fallback to CCXT connector.
         return CCXTConnector(name)
 
     try:
-        connector_class = getattr(connector_module, name)
+        connector_class = getattr(connector_module, class_name)
         if not issubclass(connector_class, Connector):
             raise ValueError("Not a Connector.")
     except (AttributeError, ValueError):
         raise ValueError(
-            f"Module {possible_module_name} requires a class named {name} which extends {Connector}"
+            f"Module {possible_module_name} requires a class named {class_name} which extends {Connector}"
         )
 
     return connector_class(name)
@@ -1,10 +1,10 @@
 import asyncio
-import os
+import math
 import random
 import time
-from contextlib import asynccontextmanager
+import zlib
 from decimal import Decimal
-from typing import AsyncIterator, Optional, TypedDict
+from typing import AsyncIterator, Literal, NamedTuple, Optional, get_args
 
 from fireagg.input_streams.base import Connector, Market, MidPrice, Trade
 from fireagg.database import symbols
@@ -13,38 +13,148 @@ from fireagg import settings
 
 TRADES_PER_SECOND_TARGET = settings.get().benchmark_trades_per_second_target or 100
 
+SEESAW_SYMBOL = "seesaw/synthetic"
+
+# Maximum number of trades yielded at once when the generator falls behind.
+MAX_BATCH_SIZE = 1000
+
+RateProfileKind = Literal["flat", "ramp", "burst"]
+
+
+class RateProfile(NamedTuple):
+    """Trades per second over time, per symbol.
+
+    - flat: always `base_rate`.
+    - ramp: from `base_rate` to `peak_rate` linearly over `ramp_s`, then flat.
+    - burst: `peak_rate` for `burst_s` every `burst_every_s`, `base_rate` otherwise.
+    """
+
+    kind: RateProfileKind = "flat"
+    base_rate: float = TRADES_PER_SECOND_TARGET
+    peak_rate: float = TRADES_PER_SECOND_TARGET
+    ramp_s: float = 60
+    burst_every_s: float = 30
+    burst_s: float = 5
+
+    def validate(self):
+        if self.kind not in get_args(RateProfileKind):
+            raise ValueError(f"Unknown rate profile {self.kind}")
+        if self.base_rate < 0 or self.peak_rate < 0:
+            raise ValueError("Rates can't be negative")
+        if self.ramp_s < 0:
+            raise ValueError("The ramp duration can't be negative")
+        if self.burst_every_s <= 0 or not 0 <= self.burst_s <= self.burst_every_s:
+            raise ValueError("Bursts must last between 0 and their period")
+
+    def rate(self, elapsed_s: float) -> float:
+        if self.kind == "ramp":
+            progress = min(1.0, elapsed_s / self.ramp_s) if self.ramp_s else 1.0
+            return self.base_rate + (self.peak_rate - self.base_rate) * progress
+        elif self.kind == "burst":
+            if elapsed_s % self.burst_every_s < self.burst_s:
+                return self.peak_rate
+            return self.base_rate
+        return self.base_rate
+
+    def next_trade_s(self, elapsed_s: float) -> Optional[float]:
+        """When the trade after one at `elapsed_s` is due. While the rate is 0, the
+        next trade waits for it to turn non-zero, None if it never does."""
+        rate = self.rate(elapsed_s)
+        if rate > 0:
+            elapsed_s += 1 / rate
+        return self.resume_s(elapsed_s)
+
+    def resume_s(self, elapsed_s: float) -> Optional[float]:
+        """The first time from `elapsed_s` with a non-zero rate, None if none."""
+        if self.rate(elapsed_s) > 0:
+            return elapsed_s
+        if self.kind == "ramp" and self.peak_rate > 0:
+            # Only at the start of a ramp from 0, the rate grows linearly from there:
+            # wait for a full trade rather than for a next one at an infinitesimal rate.
+            return elapsed_s + math.sqrt(2 * self.ramp_s / self.peak_rate)
+        if self.kind == "burst":
+            period_start_s = elapsed_s - elapsed_s % self.burst_every_s
+            if elapsed_s - period_start_s < self.burst_s:
+                # An idle burst, resumes when it ends.
+                if self.base_rate > 0 and self.burst_s < self.burst_every_s:
+                    return period_start_s + self.burst_s
+            elif self.peak_rate > 0 and self.burst_s > 0:
+                return period_start_s + self.burst_every_s
+        return None
+
+
+def benchmark_symbol(index: int):
+    return f"bench{index}/synthetic"
+
 
 class _benchmark(Connector):
     name = "_benchmark"
 
+    def __init__(
+        self,
+        name: str,
+        profile: Optional[RateProfile] = None,
+        seed: Optional[int] = None,
+        n_symbols: int = 0,
+    ):
+        super().__init__(name)
+        self.profile = profile or RateProfile()
+        self.profile.validate()
+        self.seed = seed
+        self.n_symbols = n_symbols
+
     async def do_seed_markets(self, skip_if_symbols=True):
         return [
             symbols.ConnectorSymbolInput(
-                symbol="seesaw/synthetic",
-                connector_symbol="seesaw/synthetic",
+                symbol=symbol,
+                connector_symbol=symbol,
                 connector=self.name,
-                base_asset="seesaw",
+                base_asset=symbol.split("/")[0],
                 quote_asset="synthetic",
             )
+            for symbol in [SEESAW_SYMBOL]
+            + [benchmark_symbol(i) for i in range(self.n_symbols)]
         ]
 
+    def _is_synthetic(self, connector_symbol: str):
+        return connector_symbol == SEESAW_SYMBOL or connector_symbol.startswith("bench")
+
+    def _rng(self, connector_symbol: str, stream: str):
+        if self.seed is None:
+            return random.Random()
+        # Stable across processes, unlike hash().
+        return random.Random(
+            self.seed + zlib.crc32(f"{connector_symbol}{stream}".encode())
+        )
+
     async def do_watch_trades(self, connector_symbol: str) -> AsyncIterator[Trade]:
-        if connector_symbol == "seesaw/synthetic":
-            async for trade in self.synthetic_seesaw(
-                Decimal(1), top_price=Decimal("1.5")
-            ):
+        async for trades in self.do_watch_trades_batches(connector_symbol):
+            for trade in trades:
                 yield trade
-        else:
+
+    async def do_watch_trades_batches(
+        self, connector_symbol: str
+    ) -> AsyncIterator[list[Trade]]:
+        if not self._is_synthetic(connector_symbol):
             raise NotImplementedError(connector_symbol)
 
+        async for trades in self.synthetic_seesaw(
+            Decimal(1),
+            top_price=Decimal("1.5"),
+            rng=self._rng(connector_symbol, "trades"),
+        ):
+            yield trades
+
     async def synthetic_seesaw(
         self,
         init_price: Decimal,
         top_price: Decimal,
+        rng: random.Random,
         ticks_per_direction: int = 10000,
-    ):
-        trades_per_second_target = TRADES_PER_SECOND_TARGET
-
+    ) -> AsyncIterator[list[Trade]]:
+        """Trades going up and down between two prices, paced by the rate profile.
+        Trades that are due at the same time are yielded together, so that rates
+        above the event loop sleep resolution can be reached."""
         ticks_per_direction = ticks_per_direction // 2
         tick_size = (top_price - init_price) / ticks_per_direction
         bottom_price = init_price - (tick_size * ticks_per_direction)
@@ -52,53 +162,64 @@ class _benchmark(Connector):
         current_price = init_price
         direction = 1
 
-        target_loop_time = 1 / trades_per_second_target
-        sleep_time = target_loop_time
-        previous_trade: Optional[Trade] = None
+        start_s = time.monotonic()
+        next_elapsed_s = self.profile.resume_s(0)
 
         while self.running:
-            trade = _random_trade_at_price(current_price, amount_range=1000)
-            yield trade
-
-            if previous_trade:
-                delta_s = (trade.timestamp_ms - previous_trade.timestamp_ms) / 1000
-                error = target_loop_time - delta_s
-                sleep_time = target_loop_time + error
-
-            previous_trade = trade
-
-            current_price += tick_size * direction
-
-            if direction > 0 and current_price > top_price:
-                direction = -1
-            elif direction < 0 and current_price < bottom_price:
-                direction = 1
-            if sleep_time > 0:
-                await asyncio.sleep(sleep_time)
+            if next_elapsed_s is None:
+                # The rate stays at 0.
+                await asyncio.sleep(1)
+                continue
+
+            now_s = time.monotonic()
+            trades = []
+            while (
+                next_elapsed_s is not None
+                and start_s + next_elapsed_s <= now_s
+                and len(trades) < MAX_BATCH_SIZE
+            ):
+                trades.append(_random_trade_at_price(current_price, 1000, rng))
+                next_elapsed_s = self.profile.next_trade_s(next_elapsed_s)
+
+                current_price += tick_size * direction
+                if direction > 0 and current_price > top_price:
+                    direction = -1
+                elif direction < 0 and current_price < bottom_price:
+                    direction = 1
+
+            if trades:
+                yield trades
+            if next_elapsed_s is not None:
+                await asyncio.sleep(
+                    max(0.0, start_s + next_elapsed_s - time.monotonic())
+                )
 
     async def do_watch_spreads(self, connector_symbol: str):
-        if connector_symbol == "seesaw/synthetic":
-            async for trade in self.synthetic_seesaw(
-                Decimal(1), top_price=Decimal("1.5")
-            ):
+        if not self._is_synthetic(connector_symbol):
+            raise NotImplementedError(connector_symbol)
+
+        async for trades in self.synthetic_seesaw(
+            Decimal(1),
+            top_price=Decimal("1.5"),
+            rng=self._rng(connector_symbol, "spreads"),
+        ):
+            for trade in trades:
                 yield MidPrice(
                     timestamp_ms=trade.timestamp_ms,
                     best_bid=trade.price - Decimal("0.001"),
                     best_ask=trade.price + Decimal("0.001"),
                 )
-        else:
-            raise NotImplementedError(connector_symbol)
 
     async def do_get_market(self, connector_symbol: str) -> Market:
         return Market(close=Decimal(1), volume_24h=10000)
 
 
-def _random_trade_at_price(price: Decimal, amount_range: float):
+def _random_trade_at_price(price: Decimal, amount_range: float, rng: random.Random):
     return Trade(
         timestamp_ms=_now_ms(),
         price=price,
-        amount=Decimal(random.random() * amount_range),
-        is_buy=(random.choice([False, True])),
+        amount=Decimal(rng.random() * amount_range),
+        is_buy=(rng.choice([False, True])),
     )
 
 
@@ -0,0 +1,188 @@
+import asyncio
+import gzip
+import os
+import time
+from decimal import Decimal
+from typing import AsyncIterator, Iterator, Optional
+
+from fireagg import settings
+from fireagg.database import symbols
+from fireagg.input_streams.base import Connector, Market, MidPrice, Trade
+from fireagg.input_streams.recording import (
+    SPREADS_STREAM,
+    TRADES_STREAM,
+    read_manifest,
+)
+
+# Maximum number of records yielded at once when catching up.
+MAX_BATCH_SIZE = 500
+
+
+class ReplayClock:
+    """Maps recorded timestamps to the wall clock, shared by all the replayed
+    streams so that they stay in sync. A speed of 0 replays as fast as possible."""
+
+    def __init__(self, origin_ms: float, speed: float):
+        self.origin_ms = origin_ms
+        self.speed = speed
+        self.start_ms = time.time() * 1000
+
+    def replay_timestamp_ms(self, recorded_ms: float) -> float:
+        if not self.speed:
+            return time.time() * 1000
+        return self.start_ms + max(0.0, recorded_ms - self.origin_ms) / self.speed
+
+    def delay_s(self, recorded_ms: float) -> float:
+        if not self.speed:
+            return 0
+        return (self.replay_timestamp_ms(recorded_ms) - time.time() * 1000) / 1000
+
+
+CLOCKS: dict[str, ReplayClock] = {}
+
+
+class _replay(Connector):
+    """Plays back a recording made with `fireagg record`.
+
+    Connectors are named `_replay:<recorded connector>`, e.g. `_replay:kraken`, and
+    expose the recorded symbols of that connector. Timestamps are shifted to the
+    replay time, so that downstream latencies and storage look like live data.
+    """
+
+    name = "_replay"
+
+    def __init__(
+        self,
+        name: str,
+        directory: Optional[str] = None,
+        speed: Optional[float] = None,
+        loop: Optional[bool] = None,
+    ):
+        super().__init__(name)
+        settings_obj = settings.get()
+        _, _, self.source = name.partition(":")
+        self.directory = directory or settings_obj.replay_dir
+        self.speed = settings_obj.replay_speed if speed is None else speed
+        self.loop = settings_obj.replay_loop if loop is None else loop
+
+        self.manifest = read_manifest(self.directory)
+
+    def _streams(self):
+        return [s for s in self.manifest["streams"] if s["connector"] == self.source]
+
+    def _get_stream(self, connector_symbol: str, stream: str):
+        for recorded in self._streams():
+            if (
+                recorded["connector_symbol"] == connector_symbol
+                and recorded["stream"] == stream
+            ):
+                return recorded
+        raise NotImplementedError(f"No recorded {stream} for {connector_symbol}")
+
+    def _clock(self):
+        if self.directory not in CLOCKS:
+            CLOCKS[self.directory] = ReplayClock(self.manifest["start_ms"], self.speed)
+        return CLOCKS[self.directory]
+
+    async def do_seed_markets(self):
+        seen = set()
+        inputs = []
+        for recorded in self._streams():
+            if recorded["connector_symbol"] in seen:
+                continue
+            seen.add(recorded["connector_symbol"])
+            inputs.append(
+                symbols.ConnectorSymbolInput(
+                    symbol=recorded["symbol"],
+                    connector_symbol=recorded["connector_symbol"],
+                    connector=self.name,
+                    base_asset=recorded["base_asset"],
+                    quote_asset=recorded["quote_asset"],
+                )
+            )
+        return inputs
+
+    async def do_watch_trades(self, connector_symbol: str) -> AsyncIterator[Trade]:
+        async for trades in self.do_watch_trades_batches(connector_symbol):
+            for trade in trades:
+                yield trade
+
+    async def do_watch_trades_batches(
+        self, connector_symbol: str
+    ) -> AsyncIterator[list[Trade]]:
+        recorded = self._get_stream(connector_symbol, TRADES_STREAM)
+        async for batch in self._replay(recorded["path"]):
+            yield [
+                Trade(
+                    timestamp_ms=timestamp_ms,
+                    price=Decimal(fields[0]),
+                    amount=Decimal(fields[1]),
+                    is_buy=fields[2] == "1",
+                )
+                for timestamp_ms, fields in batch
+            ]
+
+    async def do_watch_spreads(self, connector_symbol: str) -> AsyncIterator[MidPrice]:
+        recorded = self._get_stream(connector_symbol, SPREADS_STREAM)
+        async for batch in self._replay(recorded["path"]):
+            for timestamp_ms, fields in batch:
+                yield MidPrice(
+                    timestamp_ms=timestamp_ms,
+                    best_bid=Decimal(fields[0]),
+                    best_ask=Decimal(fields[1]),
+                )
+
+    async def do_get_market(self, connector_symbol: str) -> Market:
+        recorded = self._get_stream(connector_symbol, TRADES_STREAM)
+        duration_s = max(
+            1.0, (self.manifest["end_ms"] - self.manifest["start_ms"]) / 1000
+        )
+        volume_24h = float(recorded["volume"]) * 24 * 3600 / duration_s
+        return Market(close=Decimal(0), volume_24h=volume_24h)
+
+    async def _replay(self, path: str):
+        """Yields batches of (replay timestamp, fields), each batch holding the
+        records that are due."""
+        clock = self._clock()
+        recording_ms = self.manifest["end_ms"] - self.manifest["start_ms"]
+        cycle = 0
+        while self.running:
+            # Looped replays continue right after the end of the recording.
+            shift_ms = cycle * recording_ms
+            batch: list[tuple[float, list[str]]] = []
+            for recorded_ms, fields in self._read(path):
+                if not self.running:
+                    return
+
+                delay_s = clock.delay_s(recorded_ms + shift_ms)
+                if batch and (delay_s > 0 or len(batch) >= MAX_BATCH_SIZE):
+                    yield batch
+                    batch = []
+                    # Let the rest of the pipeline run, even at max speed.
+                    await asyncio.sleep(0)
+                if delay_s > 0:
+                    await asyncio.sleep(delay_s)
+
+                batch.append(
+                    (clock.replay_timestamp_ms(recorded_ms + shift_ms), fields)
+                )
+
+            if batch:
+                yield batch
+
+            if not self.loop:
+                return
+            cycle += 1
+
+    def _read(self, path: str) -> Iterator[tuple[float, list[str]]]:
+        with gzip.open(os.path.join(self.directory, path), "rt") as f:
+            try:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # Cut by a recording that was killed.
+                        break
+                    timestamp_ms, *fields = line.rstrip("\n").split("\t")
+                    yield float(timestamp_ms), fields
+            except EOFError:
+                # The end of the recording was not flushed before it was killed.
+                self.logger.warning(f"{path} is truncated, replayed up to its end")
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, Optional
+
+from fireagg import settings
+
+logger = logging.getLogger(__name__)
+
+MarketsLoader = Callable[[], Awaitable[dict]]
+
+
+class MarketsCache:
+    """Market metadata per exchange, kept in memory and on disk.
+
+    The in-memory copy is shared by every connector of the process, the files are
+    shared by every process pointing to the same cache directory. Stale entries are
+    still served while a refresh runs in the background, so only a cold cache ever
+    waits on the exchange REST API.
+    """
+
+    def __init__(self, cache_dir: str, ttl_s: float):
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_s
+
+        self._markets: dict[str, tuple[float, dict]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._refresh_tasks: dict[str, asyncio.Task] = {}
+
+    async def get(self, exchange: str, loader: MarketsLoader) -> dict:
+        cached = self._get_cached(exchange)
+        if cached is None:
+            async with self._lock(exchange):
+                # Another producer might have loaded them while we were waiting.
+                cached = self._get_cached(exchange)
+                if cached is None:
+                    return await self.refresh(exchange, loader)
+
+        fetched_at, markets = cached
+        if time.time() - fetched_at > self.ttl_s:
+            self._refresh_in_background(exchange, loader)
+
+        return markets
+
+    async def refresh(self, exchange: str, loader: MarketsLoader) -> dict:
+        markets = await loader()
+        fetched_at = time.time()
+        self._markets[exchange] = (fetched_at, markets)
+        try:
+            self._write(exchange, fetched_at, markets)
+        except OSError as e:
+            logger.warning(f"Unable to write {exchange} markets cache: {str(e)}")
+        return markets
+
+    def _get_cached(self, exchange: str) -> Optional[tuple[float, dict]]:
+        cached = self._markets.get(exchange)
+        if cached is None:
+            cached = self._read(exchange)
+            if cached is not None:
+                self._markets[exchange] = cached
+        return cached
+
+    def _refresh_in_background(self, exchange: str, loader: MarketsLoader):
+        task = self._refresh_tasks.get(exchange)
+        if task and not task.done():
+            return
+
+        async def _do_refresh():
+            try:
+                await self.refresh(exchange, loader)
+                logger.info(f"Refreshed {exchange} markets cache")
+            except Exception as e:
+                logger.warning(f"Unable to refresh {exchange} markets: {str(e)}")
+
+        self._refresh_tasks[exchange] = asyncio.create_task(_do_refresh())
+
+    def _lock(self, exchange: str):
+        if exchange not in self._locks:
+            self._locks[exchange] = asyncio.Lock()
+        return self._locks[exchange]
+
+    def _path(self, exchange: str):
+        return os.path.join(self.cache_dir, f"{exchange}.json")
+
+    def _read(self, exchange: str) -> Optional[tuple[float, dict]]:
+        try:
+            with open(self._path(exchange)) as f:
+                data = json.load(f)
+            return data["fetched_at"], data["markets"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring invalid {exchange} markets cache: {str(e)}")
+            return None
+
+    def _write(self, exchange: str, fetched_at: float, markets: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write then rename, other processes never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {"fetched_at": fetched_at, "markets": markets}, f, default=str
+                )
+            os.replace(tmp_path, self._path(exchange))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+DEFAULT_CACHE: Optional[MarketsCache] = None
+
+
+def get_markets_cache() -> MarketsCache:
+    global DEFAULT_CACHE
+    if DEFAULT_CACHE is None:
+        settings_obj = settings.get()
+        DEFAULT_CACHE = MarketsCache(
+            settings_obj.markets_cache_dir, ttl_s=settings_obj.markets_cache_ttl_s
+        )
+    return DEFAULT_CACHE
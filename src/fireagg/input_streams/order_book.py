@@ -0,0 +1,47 @@
+from typing import Optional, Sequence
+
+Levels = Sequence[Sequence[float]]
+
+
+class TopOfBookTracker:
+    """Tracks the best bid and ask of an order book from its raw levels.
+
+    Unchanged tops are detected on the raw floats, before any conversion, so that
+    connectors only yield changed tops. With a `min_notional`, levels whose price *
+    amount is below it are skipped, so dust orders don't move the top. ccxt hands
+    over the whole book on each update, without the changed levels, so each update
+    scans the levels again. They are sorted best first, so the scan stops at the
+    first level large enough, usually the first or second one. When none is, e.g. on
+    thin books, the raw top is used, so the pair still gets spreads.
+    """
+
+    def __init__(self, min_notional: Optional[float] = None):
+        self.min_notional = min_notional
+        self.best_bid: Optional[float] = None
+        self.best_ask: Optional[float] = None
+
+    def update(self, bids: Levels, asks: Levels) -> Optional[tuple[float, float]]:
+        """Returns the new (best bid, best ask) if it changed, None otherwise."""
+        best_bid = self._best_price(bids)
+        best_ask = self._best_price(asks)
+        if best_bid is None or best_ask is None:
+            return None
+
+        if best_bid == self.best_bid and best_ask == self.best_ask:
+            return None
+
+        self.best_bid = best_bid
+        self.best_ask = best_ask
+        return best_bid, best_ask
+
+    def _best_price(self, levels: Levels) -> Optional[float]:
+        if not levels:
+            return None
+        if not self.min_notional:
+            return levels[0][0]
+
+        for level in levels:
+            price, amount = level[0], level[1]
+            if price * amount >= self.min_notional:
+                return price
+        return levels[0][0]
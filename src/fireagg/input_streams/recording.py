@@ -0,0 +1,193 @@
+import gzip
+import json
+import os
+import time
+from decimal import Decimal
+from typing import IO, AsyncIterator, Optional
+
+from fireagg.database import symbols
+from fireagg.input_streams.base import Connector, Market, MidPrice, Trade
+
+MANIFEST_FILE = "manifest.json"
+
+TRADES_STREAM = "trades"
+SPREADS_STREAM = "spreads"
+
+
+class RecordedStream:
+    """One gzipped, tab separated file per connector, symbol and stream.
+
+    Trades lines are `timestamp_ms, price, amount, is_buy` and spreads lines are
+    `timestamp_ms, best_bid, best_ask`. Decimals are written as strings, so a
+    replay yields exactly what was recorded.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        mapping: symbols.ConnectorSymbolMapping,
+        stream: str,
+    ):
+        self.mapping = mapping
+        self.stream = stream
+        self.path = os.path.join(
+            mapping.connector, f"{mapping.symbol.replace('/', '-')}.{stream}.tsv.gz"
+        )
+        self.count = 0
+        self.volume = Decimal(0)
+
+        os.makedirs(os.path.join(directory, mapping.connector), exist_ok=True)
+        self._file: IO[str] = gzip.open(os.path.join(directory, self.path), "at")
+
+    def write_trade(self, trade: Trade):
+        self._file.write(
+            f"{trade.timestamp_ms}\t{trade.price}\t{trade.amount}\t{int(trade.is_buy)}\n"
+        )
+        self.count += 1
+        self.volume += trade.amount
+
+    def write_mid_price(self, mid_price: MidPrice):
+        self._file.write(
+            f"{mid_price.timestamp_ms}\t{mid_price.best_bid}\t{mid_price.best_ask}\n"
+        )
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def to_manifest(self):
+        return {
+            "connector": self.mapping.connector,
+            "symbol": self.mapping.symbol,
+            "connector_symbol": self.mapping.connector_symbol,
+            "base_asset": self.mapping.base_asset,
+            "quote_asset": self.mapping.quote_asset,
+            "stream": self.stream,
+            "path": self.path,
+            "count": self.count,
+            "volume": str(self.volume),
+        }
+
+
+class StreamRecorder:
+    """Records the raw trades and mid prices of live connectors into a directory
+    that the `_replay` connector can play back.
+
+    Every `checkpoint_interval_s`, the streams are flushed and the manifest is
+    rewritten, so that a recording killed before `close` can still be replayed up
+    to its last checkpoint.
+    """
+
+    def __init__(self, directory: str, checkpoint_interval_s: float = 10):
+        self.directory = directory
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.start_ms = time.time() * 1000
+        self.streams: dict[tuple[str, str, str], RecordedStream] = {}
+        self._last_checkpoint_s = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def stream(self, mapping: symbols.ConnectorSymbolMapping, stream: str):
+        key = (mapping.connector, mapping.connector_symbol, stream)
+        if key not in self.streams:
+            self.streams[key] = RecordedStream(self.directory, mapping, stream)
+            self.write_manifest()
+        return self.streams[key]
+
+    def write_manifest(self):
+        manifest = {
+            "start_ms": self.start_ms,
+            "end_ms": time.time() * 1000,
+            "streams": [stream.to_manifest() for stream in self.streams.values()],
+        }
+        tmp_path = os.path.join(self.directory, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST_FILE))
+
+    def checkpoint_if_due(self):
+        if time.monotonic() - self._last_checkpoint_s < self.checkpoint_interval_s:
+            return
+        for stream in self.streams.values():
+            stream.flush()
+        self.write_manifest()
+        self._last_checkpoint_s = time.monotonic()
+
+    def close(self):
+        for stream in self.streams.values():
+            stream.close()
+        self.write_manifest()
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+class RecordingConnector(Connector):
+    """Wraps a connector and records everything it yields."""
+
+    def __init__(self, connector: Connector, recorder: StreamRecorder):
+        self.connector = connector
+        self.recorder = recorder
+        self.mappings: dict[str, symbols.ConnectorSymbolMapping] = {}
+        super().__init__(connector.name)
+        self.logger = connector.logger
+
+    @property  # type: ignore[override]
+    def running(self):
+        return self.connector.running
+
+    @running.setter
+    def running(self, value: bool):
+        self.connector.running = value
+
+    async def do_seed_markets(self) -> list[symbols.ConnectorSymbolInput]:
+        return await self.connector.do_seed_markets()
+
+    async def seed_and_get_connector_symbol_mapping(self, symbol: str, _retried=False):
+        mapping = await self.connector.seed_and_get_connector_symbol_mapping(symbol)
+        self.mappings[mapping.connector_symbol] = mapping
+        return mapping
+
+    async def init(self):
+        await self.connector.init()
+
+    async def do_watch_trades(self, connector_symbol: str) -> AsyncIterator[Trade]:
+        async for trades in self.do_watch_trades_batches(connector_symbol):
+            for trade in trades:
+                yield trade
+
+    async def do_watch_trades_batches(
+        self, connector_symbol: str
+    ) -> AsyncIterator[list[Trade]]:
+        recorded = self._stream(connector_symbol, TRADES_STREAM)
+        async for trades in self.connector.do_watch_trades_batches(connector_symbol):
+            for trade in trades:
+                recorded.write_trade(trade)
+            self.recorder.checkpoint_if_due()
+            yield trades
+
+    async def do_watch_spreads(self, connector_symbol: str) -> AsyncIterator[MidPrice]:
+        recorded = self._stream(connector_symbol, SPREADS_STREAM)
+        async for mid_price in self.connector.do_watch_spreads(connector_symbol):
+            recorded.write_mid_price(mid_price)
+            self.recorder.checkpoint_if_due()
+            yield mid_price
+
+    async def do_get_market(self, connector_symbol: str) -> Market:
+        return await self.connector.do_get_market(connector_symbol)
+
+    async def do_get_markets(self, connector_symbols: list[str]) -> dict[str, Market]:
+        return await self.connector.do_get_markets(connector_symbols)
+
+    def _stream(self, connector_symbol: str, stream: str) -> RecordedStream:
+        mapping: Optional[symbols.ConnectorSymbolMapping] = self.mappings.get(
+            connector_symbol
+        )
+        if mapping is None:
+            raise ValueError(f"No symbol mapping for {connector_symbol}, call init.")
+        return self.recorder.stream(mapping, stream)
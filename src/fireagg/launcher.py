@@ -0,0 +1,174 @@
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from multiprocessing.process import BaseProcess
+from typing import Optional
+
+from fireagg import event_loop, metrics, settings
+from fireagg.processing.coordinator import Pair
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def partition_pairs(pairs: list[Pair], processes: int) -> list[list[Pair]]:
+    """Splits the pairs into at most `processes` shards. All the symbols of a
+    connector go to the same shard, so that they share its exchange session. The
+    biggest connectors are placed first, each on the smallest shard."""
+    by_connector: dict[str, list[Pair]] = defaultdict(list)
+    for pair in pairs:
+        by_connector[pair.connector].append(pair)
+
+    shards: list[list[Pair]] = [[] for _ in range(min(processes, len(by_connector)))]
+    for _, connector_pairs in sorted(
+        by_connector.items(), key=lambda item: (-len(item[1]), item[0])
+    ):
+        min(shards, key=len).extend(connector_pairs)
+    return shards
+
+
+def run_sharded(
+    symbols: list[str], processes: int, only_connectors: Optional[list[str]] = None
+):
+    from fireagg import data_streams
+
+    pairs = event_loop.run(data_streams.resolve_symbols_pairs(symbols, only_connectors))
+    shards = partition_pairs(pairs, processes)
+    logger.info(f"Running {len(pairs)} pairs in {len(shards)} processes")
+
+    settings_obj = settings.get()
+    ShardedLauncher(
+        shards,
+        restart_backoff_s=settings_obj.worker_restart_backoff_s,
+        max_restart_backoff_s=settings_obj.worker_restart_max_backoff_s,
+    ).run()
+
+
+def _run_shard(pairs: list[Pair], other_connectors: Optional[set[str]] = None):
+    """Control commands go to the shard of their connector. The first shard, which
+    gets the connectors of the other shards, also takes the new connectors."""
+    # Spawned processes start from scratch.
+    settings.setup_logging()
+    from fireagg import data_streams
+
+    if other_connectors is None:
+        control_scope: dict = dict(
+            control_connectors={pair.connector for pair in pairs}
+        )
+    else:
+        control_scope = dict(control_excluded_connectors=other_connectors)
+    event_loop.run(data_streams.distributed_watch_pairs(pairs, **control_scope))
+
+
+class ShardedLauncher:
+    """Runs the pairs in child processes, one asyncio loop each, and restarts the
+    children that die with an exponential backoff.
+
+    Children write their metrics to a shared multiprocess directory, that the
+    parent metrics server aggregates.
+    """
+
+    def __init__(
+        self,
+        shards: list[list[Pair]],
+        restart_backoff_s: float = 1,
+        max_restart_backoff_s: float = 60,
+    ):
+        self.shards = shards
+        self.restart_backoff_s = restart_backoff_s
+        self.max_restart_backoff_s = max_restart_backoff_s
+        # Spawn, so that children don't inherit the parent loop or connections.
+        self.context = multiprocessing.get_context("spawn")
+
+        self.processes: list[Optional[BaseProcess]] = [None] * len(shards)
+        self.failures = [0] * len(shards)
+        self.restart_at = [0.0] * len(shards)
+        self.started_at = [0.0] * len(shards)
+
+    def run(self, poll_interval_s: float = 1):
+        multiproc_dir = self._setup_multiproc_dir()
+        try:
+            while True:
+                for index in range(len(self.shards)):
+                    self._check(index)
+                time.sleep(poll_interval_s)
+        finally:
+            self.stop()
+            if multiproc_dir:
+                shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+    def stop(self):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=10)
+
+    def _setup_multiproc_dir(self) -> Optional[str]:
+        """Returns the directory if it was created here, and has to be removed."""
+        created = None
+        multiproc_dir = os.environ.get(MULTIPROC_DIR_ENV)
+        if not multiproc_dir:
+            multiproc_dir = created = tempfile.mkdtemp(prefix="fireagg-metrics-")
+        else:
+            # Leftovers of previous runs would be summed with the new values.
+            shutil.rmtree(multiproc_dir, ignore_errors=True)
+            os.makedirs(multiproc_dir)
+
+        # Inherited by the children, before they import prometheus_client.
+        os.environ[MULTIPROC_DIR_ENV] = multiproc_dir
+        metrics.collect_multiprocess_metrics(multiproc_dir)
+        return created
+
+    def _check(self, index: int):
+        process = self.processes[index]
+        if process is not None:
+            if process.is_alive():
+                return
+
+            metrics.mark_process_dead(process.pid)
+            self.processes[index] = None
+
+            run_s = time.monotonic() - self.started_at[index]
+            if run_s > self.max_restart_backoff_s:
+                self.failures[index] = 0
+            backoff_s = min(
+                self.restart_backoff_s * 2 ** self.failures[index],
+                self.max_restart_backoff_s,
+            )
+            backoff_s = random.uniform(backoff_s / 2, backoff_s)
+            self.failures[index] += 1
+            self.restart_at[index] = time.monotonic() + backoff_s
+            logger.error(
+                f"Shard {index} exited with code {process.exitcode}, "
+                f"restarting in {backoff_s:.1f}s"
+            )
+
+        if time.monotonic() < self.restart_at[index]:
+            return
+
+        process = self.context.Process(
+            target=_run_shard,
+            args=(self.shards[index], self._other_connectors(index)),
+            name=f"fireagg-shard-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info(
+            f"Started shard {index} (pid {process.pid}): "
+            f"{', '.join(sorted({pair.connector for pair in self.shards[index]}))}"
+        )
+
+    def _other_connectors(self, index: int) -> Optional[set[str]]:
+        if index != 0:
+            return None
+        return {pair.connector for shard in self.shards[1:] for pair in shard}
@@ -1,6 +1,11 @@
 import platform
 import logging
-from prometheus_client import start_http_server, Counter
+from typing import TYPE_CHECKING, Iterable, Optional
+from prometheus_client import REGISTRY, start_http_server, Counter, Gauge, Histogram
+from prometheus_client import multiprocess
+
+if TYPE_CHECKING:
+    from fireagg.processing.messages import Message
 
 
 logger = logging.getLogger(__name__)
@@ -20,3 +25,208 @@ db_inserts_counter = Counter(
 
 def get_db_inserts_counter(**labels):
     return db_inserts_counter.labels(instance=platform.node(), **labels)
+
+
+db_skipped_counter = Counter(
+    "db_skipped_records",
+    documentation="Records not persisted because of the stream persistence policies",
+    labelnames=["stream_name", "instance"],
+)
+
+
+def get_db_skipped_counter(**labels):
+    return db_skipped_counter.labels(instance=platform.node(), **labels)
+
+
+workers_gauge = Gauge(
+    "workers",
+    documentation="Number of processing workers per state",
+    labelnames=["worker", "state", "instance"],
+    # Summed over the processes of the multi-process launcher.
+    multiprocess_mode="livesum",
+)
+
+
+def set_worker_state(worker: str, old_state: Optional[str], new_state: Optional[str]):
+    if old_state:
+        workers_gauge.labels(
+            worker=worker, state=old_state, instance=platform.node()
+        ).dec()
+    if new_state:
+        workers_gauge.labels(
+            worker=worker, state=new_state, instance=platform.node()
+        ).inc()
+
+
+worker_restarts_counter = Counter(
+    "worker_restarts",
+    documentation="Restarts of crashed processing workers",
+    labelnames=["worker", "instance"],
+)
+
+
+def get_worker_restarts_counter(**labels):
+    return worker_restarts_counter.labels(instance=platform.node(), **labels)
+
+
+pipeline_latency_histogram = Histogram(
+    "pipeline_latency_seconds",
+    documentation="Latency from the exchange timestamp to each pipeline stage",
+    labelnames=["stage", "connector", "stream", "instance"],
+    buckets=(
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+        60,
+    ),
+)
+
+_pipeline_latency_children: dict[tuple[str, str, str], Histogram] = {}
+
+
+def observe_pipeline_latency(
+    stage: str, stream: str, messages: Iterable["Message"], at_ms: float
+):
+    """Observes, for each message, the time between its exchange timestamp and
+    `at_ms`, when the message reached `stage`."""
+    for message in messages:
+        origin = message.latency_origin()
+        if origin is None:
+            continue
+        connector, origin_timestamp_ms = origin
+
+        key = (stage, connector, stream)
+        histogram = _pipeline_latency_children.get(key)
+        if histogram is None:
+            # labels() takes a lock, cache the children for the hot path.
+            histogram = pipeline_latency_histogram.labels(
+                stage=stage,
+                connector=connector,
+                stream=stream,
+                instance=platform.node(),
+            )
+            _pipeline_latency_children[key] = histogram
+
+        histogram.observe(max(0.0, at_ms - origin_timestamp_ms) / 1000)
+
+
+event_loop_lag_histogram = Histogram(
+    "event_loop_lag_seconds",
+    documentation="Delay of the event loop in running a timer",
+    labelnames=["loop", "instance"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+event_loop_slow_callbacks_counter = Counter(
+    "event_loop_slow_callbacks",
+    documentation="Event loop lags above the slow callback threshold",
+    labelnames=["loop", "instance"],
+)
+
+event_loop_busy_gauge = Gauge(
+    "event_loop_busy_ratio",
+    documentation="Share of the time the event loop thread spent on the CPU",
+    labelnames=["loop", "instance"],
+)
+
+
+def get_event_loop_metrics(loop: str):
+    labels = dict(loop=loop, instance=platform.node())
+    return (
+        event_loop_lag_histogram.labels(**labels),
+        event_loop_slow_callbacks_counter.labels(**labels),
+        event_loop_busy_gauge.labels(**labels),
+    )
+
+
+overload_level_gauge = Gauge(
+    "overload_shedding_level",
+    documentation="Load shedding level of the overload controller, 0 when not shedding",
+    labelnames=["instance"],
+    multiprocess_mode="max",
+)
+
+overload_pressure_gauge = Gauge(
+    "overload_pressure",
+    documentation="Queue depth or loop lag relative to their max, shedding above 1",
+    labelnames=["instance"],
+    multiprocess_mode="max",
+)
+
+overload_shedding_gauge = Gauge(
+    "overload_shedding",
+    documentation="1 while the stream is degraded by the overload controller",
+    labelnames=["stream", "instance"],
+    multiprocess_mode="max",
+)
+
+overload_shed_counter = Counter(
+    "overload_shed_messages",
+    documentation="Messages not persisted, sampled out or conflated, under overload",
+    labelnames=["stream", "instance"],
+)
+
+
+def get_overload_metrics():
+    instance = platform.node()
+    return (
+        overload_level_gauge.labels(instance=instance),
+        overload_pressure_gauge.labels(instance=instance),
+    )
+
+
+def set_overload_shedding(stream: str, shedding: bool):
+    overload_shedding_gauge.labels(stream=stream, instance=platform.node()).set(
+        int(shedding)
+    )
+
+
+def get_overload_shed_counter(stream: str):
+    return overload_shed_counter.labels(stream=stream, instance=platform.node())
+
+
+streaming_clients_gauge = Gauge(
+    "streaming_clients",
+    documentation="Clients connected to the true prices streaming endpoints",
+    multiprocess_mode="livesum",
+)
+
+
+FIREAGG_METRICS = [
+    db_inserts_counter,
+    db_skipped_counter,
+    workers_gauge,
+    worker_restarts_counter,
+    pipeline_latency_histogram,
+    event_loop_lag_histogram,
+    event_loop_slow_callbacks_counter,
+    event_loop_busy_gauge,
+    overload_level_gauge,
+    overload_pressure_gauge,
+    overload_shedding_gauge,
+    overload_shed_counter,
+    streaming_clients_gauge,
+]
+
+
+def collect_multiprocess_metrics(multiproc_dir: str):
+    """Serves the metrics of the child processes instead of our own, which the
+    launcher process doesn't update."""
+    for metric in FIREAGG_METRICS:
+        REGISTRY.unregister(metric)
+    multiprocess.MultiProcessCollector(REGISTRY, path=multiproc_dir)
+
+
+def mark_process_dead(pid: Optional[int]):
+    if pid is not None:
+        multiprocess.mark_process_dead(pid)
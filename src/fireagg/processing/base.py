@@ -1,11 +1,19 @@
+from typing import Literal, Optional
+
 HEALTH_COUNTER_MAX = 3
 
+WorkerState = Literal[
+    "pending", "initializing", "running", "backoff", "stopped", "failed"
+]
+
 
 class Worker:
     def __init__(self):
         self.is_live = False
         self.running = False
         self.health_counter = HEALTH_COUNTER_MAX
+        # Managed by the ProcessingCore supervisor.
+        self.state: WorkerState = "pending"
 
     def __str__(self):
         return f"{self.__class__.__name__}()"
@@ -25,3 +33,8 @@ class Worker:
 
     async def init(self):
         pass
+
+    def init_group(self) -> Optional[str]:
+        """Workers of the same group have a separate, lower, init concurrency limit,
+        e.g. producers of the same exchange."""
+        return None
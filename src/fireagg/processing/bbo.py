@@ -0,0 +1,145 @@
+import heapq
+import logging
+from decimal import Decimal
+from typing import Optional
+
+from .base import Worker
+from .message_bus import MessageBus
+from .messages import SymbolBBO, SymbolSpreads, now_ms
+
+from fireagg.metrics import observe_pipeline_latency
+
+logger = logging.getLogger(__name__)
+
+BID = 0
+ASK = 1
+
+
+class Quote:
+    __slots__ = ("bid", "ask", "fetch_timestamp_ms")
+
+    def __init__(self, bid: Decimal, ask: Decimal, fetch_timestamp_ms: float):
+        self.bid = bid
+        self.ask = ask
+        self.fetch_timestamp_ms = fetch_timestamp_ms
+
+
+class ConsolidatedBook:
+    """The last quote of each connector of a symbol, with a heap per side for the
+    best bid and ask across connectors.
+
+    Heap entries are not removed when a connector updates its quote, they are
+    skipped once they reach the top and no longer match it. An update is then
+    O(log n) amortized, the heaps being rebuilt when stale entries pile up.
+    Quotes fetched more than `max_quote_age_ms` before the latest spread are
+    dropped, so that a silent connector doesn't hold the best price.
+    """
+
+    def __init__(self, max_quote_age_ms: Optional[float] = None):
+        self.max_quote_age_ms = max_quote_age_ms
+        self.quotes: dict[str, Quote] = {}
+        # (-bid, connector) and (ask, connector), so that both are min-heaps.
+        self.bids: list[tuple[Decimal, str]] = []
+        self.asks: list[tuple[Decimal, str]] = []
+
+    def update(self, spread: SymbolSpreads):
+        quote = self.quotes.get(spread.connector)
+        if quote is None or quote.bid != spread.best_bid:
+            heapq.heappush(self.bids, (-spread.best_bid, spread.connector))
+        if quote is None or quote.ask != spread.best_ask:
+            heapq.heappush(self.asks, (spread.best_ask, spread.connector))
+        self.quotes[spread.connector] = Quote(
+            spread.best_bid, spread.best_ask, spread.fetch_timestamp_ms
+        )
+
+        if len(self.bids) + len(self.asks) > 4 * len(self.quotes) + 16:
+            self._rebuild()
+
+    def best(self, now_ms: float) -> tuple[tuple[Decimal, str], tuple[Decimal, str]]:
+        """The best bid and the best ask, with their connectors. The book must have
+        a quote fetched at `now_ms`."""
+        bid, bid_connector = self._top(self.bids, BID, now_ms)
+        ask, ask_connector = self._top(self.asks, ASK, now_ms)
+        return (-bid, bid_connector), (ask, ask_connector)
+
+    def _top(self, heap: list[tuple[Decimal, str]], side: int, now_ms: float):
+        while True:
+            price, connector = heap[0]
+            quote = self.quotes.get(connector)
+            if quote is None:
+                heapq.heappop(heap)
+                continue
+
+            quote_price = quote.bid if side == BID else quote.ask
+            if (-price if side == BID else price) != quote_price:
+                heapq.heappop(heap)
+            elif (
+                self.max_quote_age_ms is not None
+                and now_ms - quote.fetch_timestamp_ms > self.max_quote_age_ms
+            ):
+                del self.quotes[connector]
+                heapq.heappop(heap)
+            else:
+                return price, connector
+
+    def _rebuild(self):
+        self.bids = [(-q.bid, connector) for connector, q in self.quotes.items()]
+        self.asks = [(q.ask, connector) for connector, q in self.quotes.items()]
+        heapq.heapify(self.bids)
+        heapq.heapify(self.asks)
+
+
+class ConsolidatedBBO(Worker):
+    """Publishes the best bid and ask of each symbol across connectors, whenever
+    one of them or its connector changes."""
+
+    def __init__(self, bus: MessageBus, max_quote_age_s: Optional[float] = None):
+        super().__init__()
+        self.bus = bus
+        self.max_quote_age_ms = (
+            max_quote_age_s * 1000 if max_quote_age_s is not None else None
+        )
+        self.books: dict[int, ConsolidatedBook] = {}
+        self.last_bbo: dict[int, tuple] = {}
+
+    async def run(self):
+        self.running = True
+        with self.bus.spreads.queue() as queue:
+            logger.info(f"{self} is live!")
+            while self.running:
+                spread = await queue.get()
+                message = self.process(spread)
+                if message:
+                    observe_pipeline_latency(
+                        "bbo", "bbo", [message], message.timestamp_ms
+                    )
+                    await self.bus.bbo.put(message)
+
+    def process(self, spread: SymbolSpreads) -> Optional[SymbolBBO]:
+        book = self.books.get(spread.symbol_id)
+        if book is None:
+            book = self.books[spread.symbol_id] = ConsolidatedBook(
+                self.max_quote_age_ms
+            )
+        book.update(spread)
+
+        (best_bid, bid_connector), (best_ask, ask_connector) = book.best(
+            spread.fetch_timestamp_ms
+        )
+        bbo = (best_bid, bid_connector, best_ask, ask_connector)
+        if bbo == self.last_bbo.get(spread.symbol_id):
+            return None
+        self.last_bbo[spread.symbol_id] = bbo
+
+        return SymbolBBO(
+            symbol_id=spread.symbol_id,
+            timestamp_ms=now_ms(),
+            best_bid=best_bid,
+            best_bid_connector=bid_connector,
+            best_ask=best_ask,
+            best_ask_connector=ask_connector,
+            is_crossed=best_bid > best_ask,
+            triggering_spread_message_id=spread.id,
+            triggering_connector=spread.connector,
+            triggering_timestamp_ms=spread.timestamp_ms,
+        )
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Optional
+
+import redis.asyncio
+
+from fireagg import settings
+
+from .redis_adapter import redis_client
+
+logger = logging.getLogger(__name__)
+
+TRUE_PRICE_CHECKPOINT_KEY = "true_price_checkpoint"
+
+
+class CheckpointStore:
+    """Keeps the last snapshot of a worker state, as a JSON-serializable dict."""
+
+    async def load(self) -> Optional[dict]:
+        raise NotImplementedError()
+
+    async def save(self, state: dict):
+        raise NotImplementedError()
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.path=})"
+
+    async def load(self):
+        return await asyncio.to_thread(self._load)
+
+    async def save(self, state: dict):
+        await asyncio.to_thread(self._save, json.dumps(state))
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, data: str):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Never leave a partial checkpoint behind.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+class RedisCheckpointStore(CheckpointStore):
+    def __init__(self, client: redis.asyncio.Redis, key: str):
+        self.redis = client
+        self.key = key
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.key=})"
+
+    async def load(self):
+        data = await self.redis.get(self.key)
+        return json.loads(data) if data else None
+
+    async def save(self, state: dict):
+        await self.redis.set(self.key, json.dumps(state))
+
+
+def true_price_checkpoints() -> Optional[CheckpointStore]:
+    settings_obj = settings.get()
+    if settings_obj.true_price_checkpoint == "redis":
+        return RedisCheckpointStore(redis_client(), TRUE_PRICE_CHECKPOINT_KEY)
+    if settings_obj.true_price_checkpoint == "file":
+        return FileCheckpointStore(settings_obj.true_price_checkpoint_path)
+    return None
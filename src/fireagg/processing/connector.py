@@ -6,12 +6,19 @@ import pytz
 
 from fireagg.database import symbols
 
-from fireagg.input_streams.base import Connector, MidPrice
+from fireagg.input_streams.base import Connector
 
 from .base import Worker
 from .message_bus import MessageBus
-from .messages import SymbolSpreads, SymbolTrade, SymbolWeightAdjust, now_ms
+from .messages import (
+    SymbolSpreads,
+    SymbolTrade,
+    SymbolWeightAdjust,
+    now_ms,
+)
 
+from fireagg.metrics import observe_pipeline_latency
+from .weights_refresher import ConnectorWeightsRefresher
 
 QueueT = TypeVar("QueueT")
 
@@ -24,6 +31,7 @@ class ConnectorProducer(Worker, Generic[QueueT]):
         connector: Connector,
         symbol: str,
         bus: MessageBus,
+        weights: ConnectorWeightsRefresher,
         retry_forever: bool = False,
     ):
         super().__init__()
@@ -34,29 +42,18 @@ class ConnectorProducer(Worker, Generic[QueueT]):
         self.is_live = False
         self.running = False
         self.retry_forever = retry_forever
-
-        self.weight_task: Optional[asyncio.Task] = None
+        self.weights = weights
+        # Messages published so far, to measure the rate of this pair.
+        self.messages_count = 0
 
     async def init(self):
         self.symbol_mapping = (
             await self.connector.seed_and_get_connector_symbol_mapping(self.symbol)
         )
         await self.connector.init()
-        await self._adjust_weight()
-
-    async def _adjust_weight(self):
-        assert self.symbol_mapping
-        ticker = await self.connector.do_get_market(
-            self.symbol_mapping.connector_symbol
-        )
 
-        await self.bus.weights.put(
-            SymbolWeightAdjust(
-                connector=self.connector.name,
-                symbol_id=self.symbol_mapping.symbol_id,
-                weight=float(ticker.volume_24h),
-            )
-        )
+    def init_group(self):
+        return self.connector.name
 
     def is_live_callback(self):
         self.connector.logger.info(f"{self} is live!")
@@ -66,15 +63,21 @@ class ConnectorProducer(Worker, Generic[QueueT]):
 
     async def run(self):
         self.running = True
+        if self.symbol_mapping:
+            self.weights.watch(self.symbol_mapping)
+        try:
+            await self.run_until_stopped()
+        finally:
+            if self.symbol_mapping:
+                self.weights.unwatch(self.symbol_mapping)
+
+    async def run_until_stopped(self):
         while self.running:
             async with self.error_handling() as symbol_mapping:
-                weight_task = asyncio.create_task(self.run_adjust_weight())
                 await self.run_symbol_mapping(symbol_mapping)
                 # If we get here, we're meant to stop.
                 self.running = False
 
-                weight_task.cancel()
-
                 await self.bus.weights.put(
                     SymbolWeightAdjust(
                         connector=self.connector.name,
@@ -83,11 +86,6 @@ class ConnectorProducer(Worker, Generic[QueueT]):
                     )
                 )
 
-    async def run_adjust_weight(self):
-        while self.running:
-            await asyncio.sleep(500)
-            await self._adjust_weight()
-
     async def run_symbol_mapping(self, symbol_mapping: symbols.ConnectorSymbolMapping):
         raise NotImplementedError()
 
@@ -129,55 +127,63 @@ class SymbolTradesProducer(ConnectorProducer[SymbolTrade]):
     producer_name = "trades"
 
     async def run_symbol_mapping(self, symbol_mapping: symbols.ConnectorSymbolMapping):
-        async for trade in self.connector.do_watch_trades(
+        async for trades in self.connector.do_watch_trades_batches(
             symbol_mapping.connector_symbol
         ):
-            if not trade.timestamp_ms:
-                continue
-
-            self.mark_alive()
-
-            await self.bus.trades.put(
+            fetch_timestamp_ms = now_ms()
+            messages = [
                 SymbolTrade(
                     connector=self.connector.name,
-                    symbol_id=self.symbol_mapping.symbol_id,
+                    symbol_id=symbol_mapping.symbol_id,
                     timestamp_ms=trade.timestamp_ms,
-                    fetch_timestamp_ms=now_ms(),
+                    fetch_timestamp_ms=fetch_timestamp_ms,
                     price=trade.price,
                     amount=trade.amount,
                     is_buy=trade.is_buy,
                 )
+                for trade in trades
+                if trade.timestamp_ms
+            ]
+            if not messages:
+                continue
+
+            self.mark_alive()
+
+            publish_timestamp_ms = now_ms()
+            observe_pipeline_latency("fetch", "trades", messages, fetch_timestamp_ms)
+            observe_pipeline_latency(
+                "publish", "trades", messages, publish_timestamp_ms
             )
+            await self.bus.trades.put_many(messages)
+            self.messages_count += len(messages)
 
 
 class SymbolSpreadsProducer(ConnectorProducer[SymbolSpreads]):
     producer_name = "spreads"
 
     async def run_symbol_mapping(self, symbol_mapping: symbols.ConnectorSymbolMapping):
-        last: Optional[MidPrice] = None
+        # Connectors skip unchanged tops themselves, before building Decimals.
         async for mid_price in self.connector.do_watch_spreads(
             symbol_mapping.connector_symbol
         ):
-            if (
-                last
-                and last.best_bid == mid_price.best_bid
-                and last.best_ask == mid_price.best_ask
-            ):
-                # Skip no-op updates
-                continue
-
             if not mid_price.timestamp_ms:
                 continue
             self.mark_alive()
 
-            await self.bus.spreads.put(
-                SymbolSpreads(
-                    connector=self.connector.name,
-                    symbol_id=self.symbol_mapping.symbol_id,
-                    timestamp_ms=mid_price.timestamp_ms,
-                    fetch_timestamp_ms=now_ms(),
-                    best_bid=mid_price.best_bid,
-                    best_ask=mid_price.best_ask,
-                )
+            message = SymbolSpreads(
+                connector=self.connector.name,
+                symbol_id=self.symbol_mapping.symbol_id,
+                timestamp_ms=mid_price.timestamp_ms,
+                fetch_timestamp_ms=now_ms(),
+                best_bid=mid_price.best_bid,
+                best_ask=mid_price.best_ask,
+            )
+            publish_timestamp_ms = now_ms()
+            observe_pipeline_latency(
+                "fetch", "spreads", [message], message.fetch_timestamp_ms
+            )
+            observe_pipeline_latency(
+                "publish", "spreads", [message], publish_timestamp_ms
             )
-            last = mid_price
+            await self.bus.spreads.put(message)
+            self.messages_count += 1
@@ -0,0 +1,123 @@
+import logging
+from typing import TYPE_CHECKING, Iterable, Literal, Optional
+
+import pydantic
+import redis.asyncio
+
+from fireagg.input_streams import create_connector
+
+from .base import Worker
+from .coordinator import Pair
+
+if TYPE_CHECKING:
+    from .core import ProcessingCore
+
+logger = logging.getLogger(__name__)
+
+CONTROL_STREAM_KEY_PREFIX = "control__"
+# Commands are only read live, older ones are of no use.
+CONTROL_STREAM_MAXLEN = 1000
+
+DATA_KEY = b"json"
+
+
+class ControlCommand(pydantic.BaseModel):
+    action: Literal["watch", "unwatch"]
+    connector: str
+    symbol: str
+
+
+def control_stream_key(channel: str):
+    return f"{CONTROL_STREAM_KEY_PREFIX}{channel}"
+
+
+class ControlChannel(Worker):
+    """Adds or removes the producers of (connector, symbol) pairs on a running
+    core, from the commands of its Redis control stream.
+
+    Only the producers of the pair are started or stopped. They share the exchange
+    session of their connector with the other pairs, so the other feeds are not
+    reconnected. Commands for a connector outside of `connectors`, or in
+    `excluded_connectors`, are left to the other processes reading the channel.
+    """
+
+    def __init__(
+        self,
+        core: "ProcessingCore",
+        client: redis.asyncio.Redis,
+        channel: str,
+        connectors: Optional[set[str]] = None,
+        excluded_connectors: Iterable[str] = (),
+    ):
+        super().__init__()
+        self.core = core
+        self.redis = client
+        self.channel = channel
+        self.stream_key = control_stream_key(channel)
+        self.connectors = connectors
+        self.excluded_connectors = set(excluded_connectors)
+        self.last_id = "0-0"
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.channel=})"
+
+    def is_live_callback(self):
+        logger.info(f"{self} is live!")
+
+    def accepts(self, connector: str):
+        if connector in self.excluded_connectors:
+            return False
+        return self.connectors is None or connector in self.connectors
+
+    async def init(self):
+        # Only the commands sent from now on, not the history of the channel.
+        last = await self.redis.xrevrange(self.stream_key, count=1)
+        if last:
+            self.last_id = last[0][0]
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            streams = await self.redis.xread(
+                streams={self.stream_key: self.last_id}, block=1000
+            )
+            self.mark_alive()
+            for _, entries in streams:
+                for entry_id, data in entries:
+                    self.last_id = entry_id
+                    try:
+                        command = ControlCommand.model_validate_json(data[DATA_KEY])
+                    except (KeyError, pydantic.ValidationError) as e:
+                        logger.warning(f"{self} ignored an invalid command: {e}")
+                        continue
+                    await self.apply(command)
+
+    async def apply(self, command: ControlCommand):
+        if not self.accepts(command.connector):
+            return
+
+        pair = Pair(command.connector, command.symbol)
+        if command.action == "watch":
+            if self.core.is_watching(command.connector, command.symbol):
+                return
+            connector = create_connector(command.connector)
+            await self.core.watch_spreads(connector, command.symbol)
+            await self.core.watch_trades(connector, command.symbol)
+            logger.info(f"{self} watching {pair}")
+        else:
+            await self.core.unwatch(command.connector, command.symbol)
+            logger.info(f"{self} unwatched {pair}")
+
+
+async def send_commands(
+    client: redis.asyncio.Redis, channel: str, commands: list[ControlCommand]
+):
+    async with client.pipeline(transaction=False) as pipe:
+        for command in commands:
+            pipe.xadd(
+                control_stream_key(channel),
+                {DATA_KEY: command.model_dump_json()},
+                maxlen=CONTROL_STREAM_MAXLEN,
+                approximate=True,
+            )
+        await pipe.execute()
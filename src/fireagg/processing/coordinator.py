@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import platform
+import time
+import uuid
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+import redis.asyncio
+
+from fireagg import settings
+from fireagg.input_streams import create_connector
+
+from .base import Worker
+from .connector import ConnectorProducer
+
+if TYPE_CHECKING:
+    from .core import ProcessingCore
+
+logger = logging.getLogger(__name__)
+
+WORKERS_KEY = "cluster_workers"
+PAIRS_KEY = "cluster_pairs"
+RATES_KEY = "cluster_rates"
+LEASE_KEY_PREFIX = "cluster_lease__"
+
+# Only the lease holder may renew or release it.
+RENEW_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Weight of the latest sample in the message rates moving average.
+RATE_SMOOTHING = 0.3
+# So that idle pairs are still spread by count.
+MIN_PAIR_RATE = 0.1
+
+
+class Pair(NamedTuple):
+    connector: str
+    symbol: str
+
+    def encode(self):
+        return f"{self.connector}|{self.symbol}"
+
+    @classmethod
+    def decode(cls, value: str):
+        connector, _, symbol = value.partition("|")
+        return cls(connector, symbol)
+
+
+def assign_pairs(
+    workers: list[str],
+    rates: dict[Pair, float],
+    owners: dict[Pair, str],
+    tolerance: float,
+) -> dict[Pair, str]:
+    """Spreads the pairs over the workers, balancing their total message rate.
+
+    Pairs stay with their current owner while it is below the fair share (plus
+    `tolerance`), the others go to the least loaded worker, hottest first. Every
+    worker computes this independently, so it must be deterministic.
+    """
+    if not workers:
+        return {}
+
+    fair_share = sum(rates.values()) / len(workers) * (1 + tolerance)
+    loads = {worker: 0.0 for worker in workers}
+    assignments: dict[Pair, str] = {}
+
+    by_rate = sorted(rates.items(), key=lambda item: (-item[1], item[0]))
+    for pair, rate in by_rate:
+        owner = owners.get(pair)
+        # A single pair above the fair share still stays where it is.
+        if owner in loads and (not loads[owner] or loads[owner] + rate <= fair_share):
+            assignments[pair] = owner
+            loads[owner] += rate
+
+    for pair, rate in by_rate:
+        if pair in assignments:
+            continue
+        worker = min(workers, key=lambda w: (loads[w], w))
+        assignments[pair] = worker
+        loads[worker] += rate
+
+    return assignments
+
+
+class ClusterCoordinator(Worker):
+    """Runs a share of the cluster (connector, symbol) pairs on this core.
+
+    Workers register in Redis with a heartbeat. Each one computes the same
+    rate-weighted assignment from the live workers, then takes a lease on its
+    pairs and releases the ones it lost, so pairs move when workers join or die.
+    Leases expire with their holder, which can never be two workers at once.
+    """
+
+    def __init__(
+        self,
+        core: "ProcessingCore",
+        client: redis.asyncio.Redis,
+        worker_id: Optional[str] = None,
+    ):
+        super().__init__()
+        settings_obj = settings.get()
+        self.core = core
+        self.redis = client
+        self.worker_id = (
+            worker_id or f"{platform.node()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        )
+        self.heartbeat_s = settings_obj.cluster_heartbeat_s
+        self.lease_ms = int(settings_obj.cluster_lease_ttl_s * 1000)
+        self.tolerance = settings_obj.cluster_rebalance_tolerance
+
+        self.held: set[Pair] = set()
+        self._message_counts: dict[Pair, int] = {}
+
+        self._renew_lease = self.redis.register_script(RENEW_LEASE_SCRIPT)
+        self._release_lease = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.worker_id=})"
+
+    async def run(self):
+        self.running = True
+        try:
+            while self.running:
+                await self.heartbeat()
+                await self.rebalance()
+                self.mark_alive()
+                await asyncio.sleep(self.heartbeat_s)
+        finally:
+            await self.redis.zrem(WORKERS_KEY, self.worker_id)
+
+    def is_live_callback(self):
+        logger.info(f"{self} is live!")
+
+    async def heartbeat(self):
+        now_ms = time.time() * 1000
+        held = list(self.held)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.worker_id: now_ms})
+            pipe.zremrangebyscore(WORKERS_KEY, 0, now_ms - self.lease_ms)
+            for pair in held:
+                await self._renew_lease(
+                    keys=[lease_key(pair)],
+                    args=[self.worker_id, self.lease_ms],
+                    client=pipe,
+                )
+            results = await pipe.execute()
+
+        for pair, renewed in zip(held, results[2:]):
+            if not renewed:
+                # Expired while we were away, it might already run elsewhere.
+                logger.warning(f"{self} lost the lease of {pair}")
+                await self.core.unwatch(pair.connector, pair.symbol)
+                self.held.discard(pair)
+                self._message_counts.pop(pair, None)
+
+        await self._report_rates()
+
+    async def rebalance(self):
+        workers = sorted(
+            w.decode() for w in await self.redis.zrange(WORKERS_KEY, 0, -1)
+        )
+        pairs = [Pair.decode(p.decode()) for p in await self.redis.smembers(PAIRS_KEY)]
+        if not pairs:
+            await self._apply(set())
+            return
+
+        raw_rates = await self.redis.hmget(RATES_KEY, [p.encode() for p in pairs])
+        raw_owners = await self.redis.mget([lease_key(p) for p in pairs])
+
+        known_rates = [float(r) for r in raw_rates if r is not None]
+        # New pairs count as an average one until they are measured.
+        default_rate = sum(known_rates) / len(known_rates) if known_rates else 1.0
+        rates = {
+            pair: max(float(rate) if rate is not None else default_rate, MIN_PAIR_RATE)
+            for pair, rate in zip(pairs, raw_rates)
+        }
+        owners = {
+            pair: owner.decode()
+            for pair, owner in zip(pairs, raw_owners)
+            if owner is not None
+        }
+
+        assignments = assign_pairs(workers, rates, owners, self.tolerance)
+        await self._apply(
+            {pair for pair, worker in assignments.items() if worker == self.worker_id}
+        )
+
+    async def _apply(self, targets: set[Pair]):
+        for pair in self.held - targets:
+            await self.core.unwatch(pair.connector, pair.symbol)
+            await self._release_lease(keys=[lease_key(pair)], args=[self.worker_id])
+            self.held.discard(pair)
+            self._message_counts.pop(pair, None)
+            logger.info(f"{self} released {pair}")
+
+        for pair in targets - self.held:
+            # The previous owner releases it on its next rebalance, or the lease
+            # expires if it died.
+            acquired = await self.redis.set(
+                lease_key(pair), self.worker_id, nx=True, px=self.lease_ms
+            )
+            if not acquired:
+                continue
+
+            self.held.add(pair)
+            connector = create_connector(pair.connector)
+            await self.core.watch_spreads(connector, pair.symbol)
+            await self.core.watch_trades(connector, pair.symbol)
+            logger.info(f"{self} acquired {pair}")
+
+    async def _report_rates(self):
+        counts: dict[Pair, int] = {}
+        for worker in self.core.active_workers.values():
+            if isinstance(worker, ConnectorProducer):
+                pair = Pair(worker.connector.name, worker.symbol)
+                counts[pair] = counts.get(pair, 0) + worker.messages_count
+
+        rates = {}
+        for pair in self.held:
+            count = counts.get(pair, 0)
+            previous = self._message_counts.get(pair)
+            self._message_counts[pair] = count
+            if previous is not None and count >= previous:
+                rates[pair] = (count - previous) / self.heartbeat_s
+        if not rates:
+            return
+
+        raw_previous = await self.redis.hmget(RATES_KEY, [p.encode() for p in rates])
+        smoothed = {}
+        for (pair, rate), previous_rate in zip(rates.items(), raw_previous):
+            if previous_rate is not None:
+                rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * float(
+                    previous_rate
+                )
+            smoothed[pair.encode()] = rate
+        await self.redis.hset(RATES_KEY, mapping=smoothed)
+
+
+def lease_key(pair: Pair):
+    return f"{LEASE_KEY_PREFIX}{pair.encode()}"
+
+
+async def add_pairs(client: redis.asyncio.Redis, pairs: list[Pair]):
+    if pairs:
+        await client.sadd(PAIRS_KEY, *[pair.encode() for pair in pairs])
+
+
+async def remove_pairs(client: redis.asyncio.Redis, pairs: list[Pair]):
+    if pairs:
+        await client.srem(PAIRS_KEY, *[pair.encode() for pair in pairs])
+
+
+async def get_cluster_status(client: redis.asyncio.Redis):
+    """Live workers, and the owner and message rate of every pair."""
+    workers = [w.decode() for w in await client.zrange(WORKERS_KEY, 0, -1)]
+    pairs = sorted(Pair.decode(p.decode()) for p in await client.smembers(PAIRS_KEY))
+    if not pairs:
+        return workers, []
+
+    raw_rates = await client.hmget(RATES_KEY, [p.encode() for p in pairs])
+    raw_owners = await client.mget([lease_key(p) for p in pairs])
+    return workers, [
+        (
+            pair,
+            owner.decode() if owner is not None else None,
+            float(rate) if rate is not None else None,
+        )
+        for pair, owner, rate in zip(pairs, raw_owners, raw_rates)
+    ]
@@ -1,81 +1,298 @@
 import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
 import logging
-from typing import Optional
+import random
+import time
+from typing import Callable, Optional
 from asyncio_multisubscriber_queue import MultisubscriberQueue
 
+from fireagg import settings
+from fireagg.event_loop import start_loop_monitor
+from fireagg.database import db
 from fireagg.input_streams.base import Connector
+from fireagg.metrics import get_worker_restarts_counter, set_worker_state
 
-from .base import Worker
-from .connector import SymbolTradesProducer, SymbolSpreadsProducer
+from .base import Worker, WorkerState
+from .connector import ConnectorProducer, SymbolTradesProducer, SymbolSpreadsProducer
+from .bbo import ConsolidatedBBO
+from .checkpoints import true_price_checkpoints
+from .cross_rates import CrossRates
 from .db_insertion import (
     DatabaseStreamTrades,
     DatabaseStreamSpreads,
     DatabaseStreamTrueMidPrice,
+    DatabaseStreamWeights,
+    DatabaseStreamBBO,
+    DatabaseStreamCrossRates,
 )
+from .overload import OverloadController
 from .message_bus import MessageBus, AsyncioMessageBus
+from .messages import SymbolWeightAdjust
 from .redis_adapter import RedisStreamsMessageBus, redis_client
 from .true_mid_price import TrueMidPrice
+from .volume_weights import RollingVolumeWeights
+from .weights_refresher import ConnectorWeightsRefresher
 
 logger = logging.getLogger(__name__)
 
 
 class ProcessingCore:
-    def __init__(self, launch_workers=5, bus: Optional[MessageBus] = None):
+    def __init__(
+        self, launch_workers: Optional[int] = None, bus: Optional[MessageBus] = None
+    ):
         self.worker_queue = asyncio.Queue[Worker]()
 
+        # Supervisor task -> worker, see `Worker.state`.
         self.active_workers: dict[asyncio.Task, Worker] = {}
 
         self.bus: MessageBus = bus or AsyncioMessageBus()
         # self.bus = AsyncioMessageBus()
         # self.bus = RedisStreamsMessageBus(redis_client())
 
-        self.launch_workers = launch_workers
+        self.settings = settings.get()
         self.is_running = True
 
+        # Maximum number of concurrent worker inits, overall and per init group.
+        self.launch_workers = launch_workers or self.settings.worker_init_concurrency
+        self._init_semaphore = asyncio.Semaphore(self.launch_workers)
+        self._init_group_semaphores: dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.settings.worker_init_per_connector)
+        )
+
+        self.weights_refreshers: dict[str, ConnectorWeightsRefresher] = {}
+        # Producers on the worker queue, not started yet. Unwatching a pair removes
+        # its own, which are then skipped.
+        self.pending_producers: set[ConnectorProducer] = set()
+
+        self.overload = OverloadController(
+            self.bus,
+            shedding_order=self.settings.overload_shedding_order,
+            max_queue_depth=self.settings.overload_max_queue_depth,
+            max_loop_lag_s=self.settings.overload_max_loop_lag_s,
+            recover_s=self.settings.overload_recover_s,
+        )
+
     async def watch_trades(self, connector: Connector, symbol: str):
         await self.put_worker(
-            SymbolTradesProducer(connector, symbol, bus=self.bus, retry_forever=True)
+            SymbolTradesProducer(
+                connector,
+                symbol,
+                bus=self.bus,
+                weights=self._weights_refresher(connector),
+                retry_forever=True,
+            )
         )
 
     async def watch_spreads(self, connector: Connector, symbol: str):
         await self.put_worker(
-            SymbolSpreadsProducer(connector, symbol, bus=self.bus, retry_forever=True)
+            SymbolSpreadsProducer(
+                connector,
+                symbol,
+                bus=self.bus,
+                weights=self._weights_refresher(connector),
+                retry_forever=True,
+            )
         )
 
-    async def consume_streams_to_db(self):
+    def _producers(self, connector_name: str, symbol: str):
+        return [
+            (task, worker)
+            for task, worker in self.active_workers.items()
+            if isinstance(worker, ConnectorProducer)
+            and worker.connector.name == connector_name
+            and worker.symbol == symbol
+        ]
+
+    def _pending_producers(self, connector_name: str, symbol: str):
+        return [
+            producer
+            for producer in self.pending_producers
+            if producer.connector.name == connector_name and producer.symbol == symbol
+        ]
+
+    def is_watching(self, connector_name: str, symbol: str):
+        """Whether the pair has producers running or about to start."""
+        return bool(
+            self._producers(connector_name, symbol)
+            or self._pending_producers(connector_name, symbol)
+        )
+
+    async def unwatch(self, connector_name: str, symbol: str):
+        """Stops the producers of a symbol on a connector, and zeroes its weight so
+        that its last prices stop counting."""
+        symbol_id: Optional[int] = None
+        for producer in self._pending_producers(connector_name, symbol):
+            self.pending_producers.discard(producer)
+        for task, worker in self._producers(connector_name, symbol):
+            worker.running = False
+            task.cancel()
+            # Gone right away, so that the pair can be watched again.
+            self.active_workers.pop(task, None)
+            if worker.symbol_mapping:
+                symbol_id = worker.symbol_mapping.symbol_id
+
+        if symbol_id is not None:
+            await self.bus.weights.put(
+                SymbolWeightAdjust(
+                    connector=connector_name, symbol_id=symbol_id, weight=0.0
+                )
+            )
+
+    def _weights_refresher(self, connector: Connector):
+        if connector.name not in self.weights_refreshers:
+            # Without a refresh interval, tickers are only used to bootstrap.
+            refresh_interval = None
+            if self.settings.weights_source == "tickers":
+                refresh_interval = self.settings.weights_refresh_interval_s
+
+            self.weights_refreshers[connector.name] = ConnectorWeightsRefresher(
+                connector, bus=self.bus, refresh_interval=refresh_interval
+            )
+        return self.weights_refreshers[connector.name]
+
+    async def consume_streams_to_db(
+        self, on_flushed: Optional[Callable[[str, list], None]] = None
+    ):
+        options = dict(
+            on_flushed=on_flushed,
+            persistence_policies=self.settings.persistence_policies,
+        )
+        shedding = dict(
+            overload=self.overload, shed_sample_s=self.settings.overload_sample_s
+        )
         await self.put_worker(
-            DatabaseStreamTrades(self.bus.trades),
-            DatabaseStreamSpreads(self.bus.spreads),
-            DatabaseStreamTrueMidPrice(self.bus.true_prices),
-            TrueMidPrice(self.bus),
+            DatabaseStreamTrades(self.bus.trades, **options, **shedding),
+            DatabaseStreamSpreads(self.bus.spreads, **options, **shedding),
+            DatabaseStreamTrueMidPrice(self.bus.true_prices, **options),
+            DatabaseStreamWeights(self.bus.weights, **options),
+            DatabaseStreamBBO(self.bus.bbo, **options, **shedding),
+            self.overload,
+            TrueMidPrice(
+                self.bus,
+                checkpoints=true_price_checkpoints(),
+                checkpoint_interval_s=self.settings.true_price_checkpoint_interval_s,
+                max_weight_age_s=self.settings.true_price_checkpoint_max_weight_age_s,
+                max_mid_price_age_s=(
+                    self.settings.true_price_checkpoint_max_mid_price_age_s
+                ),
+            ),
+            ConsolidatedBBO(
+                self.bus, max_quote_age_s=self.settings.bbo_max_quote_age_s
+            ),
         )
+        if self.settings.weights_source == "trades":
+            await self.put_worker(
+                RollingVolumeWeights(
+                    self.bus,
+                    window_s=self.settings.rolling_weights_window_s,
+                    publish_interval_s=self.settings.rolling_weights_publish_interval_s,
+                )
+            )
+        if self.settings.cross_rate_targets:
+            await self.put_worker(
+                DatabaseStreamCrossRates(self.bus.cross_rates, on_flushed=on_flushed),
+                CrossRates(
+                    self.bus,
+                    self.settings.cross_rate_targets,
+                    max_hops=self.settings.cross_rate_max_hops,
+                ),
+            )
 
     async def put_worker(self, *workers: Worker):
         for worker in workers:
+            if isinstance(worker, ConnectorProducer):
+                self.pending_producers.add(worker)
             await self.worker_queue.put(worker)
 
     async def run(self):
-        launcher_tasks = [
-            self._run_worker_launcher_task() for _ in range(self.launch_workers)
-        ]
-
+        start_loop_monitor()
         async with self.bus:
-            await asyncio.gather(*launcher_tasks)
+            while self.is_running:
+                worker = await self.worker_queue.get()
+                if isinstance(worker, ConnectorProducer):
+                    if worker not in self.pending_producers:
+                        # Unwatched before it started.
+                        continue
+                    self.pending_producers.discard(worker)
+                task = asyncio.create_task(self._supervise(worker))
+                self.active_workers[task] = worker
+                task.add_done_callback(self._on_supervisor_done)
+
+    async def stop(self):
+        """Stops the workers and waits for their tasks, e.g. before closing the
+        storage they write to."""
+        self.is_running = False
+        tasks = list(self.active_workers.items())
+        for task, worker in tasks:
+            worker.running = False
+            task.cancel()
+        await asyncio.gather(*[task for task, _ in tasks], return_exceptions=True)
 
-    async def _run_worker(self, worker: Worker):
+    def _on_supervisor_done(self, task: asyncio.Task):
+        self.active_workers.pop(task, None)
+
+    def _set_state(self, worker: Worker, state: WorkerState):
+        set_worker_state(worker.__class__.__name__, worker.state, state)
+        worker.state = state
+
+    @asynccontextmanager
+    async def _init_slot(self, worker: Worker):
+        group = worker.init_group()
+        async with self._init_semaphore:
+            if group is None:
+                yield
+            else:
+                async with self._init_group_semaphores[group]:
+                    yield
+
+    async def _supervise(self, worker: Worker):
+        """Inits and runs a worker, and restarts it with an exponential backoff
+        when init or run fail. Workers that return from `run` are not restarted."""
+        set_worker_state(worker.__class__.__name__, None, worker.state)
+        restarts_counter = get_worker_restarts_counter(worker=worker.__class__.__name__)
+        attempt = 0
         try:
-            return await worker.run()
-        except Exception as e:
-            logger.error(e)
-
-    async def _run_worker_launcher_task(self):
-        while self.is_running:
-            worker_to_launch = await self.worker_queue.get()
-            logger.info(f"Launching {worker_to_launch}...")
-            try:
-                await worker_to_launch.init()
-            except Exception as e:
-                logger.warning(f"Error during init of {worker_to_launch}: {str(e)}")
-                continue
-            task = asyncio.create_task(self._run_worker(worker_to_launch))
-            self.active_workers[task] = worker_to_launch
+            while self.is_running:
+                started_at = time.monotonic()
+                try:
+                    async with self._init_slot(worker):
+                        self._set_state(worker, "initializing")
+                        logger.info(f"Launching {worker}...")
+                        await worker.init()
+
+                    self._set_state(worker, "running")
+                    await worker.run()
+                    self._set_state(worker, "stopped")
+                    return
+                except (db.NoResultException, NotImplementedError) as e:
+                    # Unknown symbol or unsupported connector, retrying won't help.
+                    logger.warning(f"Giving up on {worker}: {str(e)}")
+                    self._set_state(worker, "failed")
+                    return
+                except Exception as e:
+                    if not self.is_running:
+                        # Stopped, see `stop`.
+                        self._set_state(worker, "stopped")
+                        return
+                    logger.error(f"{worker} crashed: {str(e)}")
+
+                run_s = time.monotonic() - started_at
+                if run_s > self.settings.worker_restart_max_backoff_s:
+                    # It ran for a while, this is a new failure.
+                    attempt = 0
+                backoff_s = min(
+                    self.settings.worker_restart_backoff_s * 2**attempt,
+                    self.settings.worker_restart_max_backoff_s,
+                )
+                # Equal jitter, so that workers crashing together don't restart
+                # together, while still backing off at least half the delay.
+                backoff_s = random.uniform(backoff_s / 2, backoff_s)
+                attempt += 1
+
+                self._set_state(worker, "backoff")
+                logger.info(f"Restarting {worker} in {backoff_s:.1f}s")
+                restarts_counter.inc()
+                await asyncio.sleep(backoff_s)
+        finally:
+            set_worker_state(worker.__class__.__name__, worker.state, None)
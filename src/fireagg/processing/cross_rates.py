@@ -0,0 +1,245 @@
+import logging
+import math
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from fireagg.database import storage
+from fireagg.database.symbols import Symbol, SymbolInput
+from fireagg.metrics import observe_pipeline_latency
+
+from .base import Worker
+from .message_bus import MessageBus
+from .messages import SymbolCrossRate, SymbolTrueMidPrice, now_ms
+
+logger = logging.getLogger(__name__)
+
+
+class PricingPath:
+    """A chain of symbols from the base to the quote asset of a target. Each edge
+    is a symbol id, inverted when traversed from its quote to its base asset."""
+
+    def __init__(self, target: int, edges: tuple[tuple[int, bool], ...]):
+        self.target = target
+        self.edges = edges
+        self.rate: Optional[float] = None
+
+    @property
+    def hops(self):
+        return len(self.edges)
+
+
+class PricingTarget:
+    def __init__(self, symbol: Symbol, max_hops: int):
+        self.symbol = symbol
+        # Sum and count of the priced paths, by number of hops.
+        self.rates_sum = [0.0] * (max_hops + 1)
+        self.rates_count = [0] * (max_hops + 1)
+        self.last_rate: Optional[tuple[float, int, int]] = None
+
+    def rate(self) -> Optional[tuple[float, int, int]]:
+        """The mean rate of the shortest priced paths, its hops and paths count."""
+        for hops, count in enumerate(self.rates_count):
+            if count:
+                return self.rates_sum[hops] / count, hops, count
+        return None
+
+
+class PricingGraph:
+    """Derives the rates of target pairs from the true prices of the symbols, by
+    chaining them through their base and quote assets, e.g. BTC/EUR from
+    BTC/USDT and USDT/EUR.
+
+    Paths up to `max_hops` symbols are enumerated once. A target is priced by its
+    shortest paths with a price on every symbol, averaged. A price update only
+    recomputes the paths going through its symbol, and the sums of their targets.
+    """
+
+    def __init__(self, symbols: Iterable[Symbol], targets: list[Symbol], max_hops: int):
+        self.max_hops = max_hops
+        self.known_symbol_ids: set[int] = set()
+        self.prices: dict[int, float] = {}
+        self.targets = [PricingTarget(target, max_hops) for target in targets]
+        self.paths_by_symbol: dict[int, list[PricingPath]] = defaultdict(list)
+
+        # Asset -> (neighbour asset, symbol id, inverted)
+        self.edges: dict[str, list[tuple[str, int, bool]]] = defaultdict(list)
+        for symbol in symbols:
+            self.known_symbol_ids.add(symbol.id)
+            if symbol.base_asset == symbol.quote_asset:
+                continue
+            self.edges[symbol.base_asset].append((symbol.quote_asset, symbol.id, False))
+            self.edges[symbol.quote_asset].append((symbol.base_asset, symbol.id, True))
+
+        for index, target in enumerate(targets):
+            for edges in self._find_paths(target.base_asset, target.quote_asset):
+                path = PricingPath(index, edges)
+                for symbol_id, _ in edges:
+                    self.paths_by_symbol[symbol_id].append(path)
+
+    @property
+    def symbol_ids(self):
+        return list(self.paths_by_symbol)
+
+    def paths_count(self):
+        return len({id(p) for paths in self.paths_by_symbol.values() for p in paths})
+
+    def _find_paths(self, base: str, quote: str):
+        # Depth first, without visiting an asset twice.
+        stack: list[tuple[str, tuple[tuple[int, bool], ...], frozenset[str]]] = [
+            (base, (), frozenset([base]))
+        ]
+        while stack:
+            asset, edges, visited = stack.pop()
+            for neighbour, symbol_id, inverted in self.edges[asset]:
+                if neighbour == quote:
+                    yield edges + ((symbol_id, inverted),)
+                elif neighbour not in visited and len(edges) + 1 < self.max_hops:
+                    stack.append(
+                        (
+                            neighbour,
+                            edges + ((symbol_id, inverted),),
+                            visited | {neighbour},
+                        )
+                    )
+
+    def update(self, symbol_id: int, price: float) -> list[PricingTarget]:
+        """Sets the price of a symbol, and returns the targets whose rate changed."""
+        if math.isnan(price) or price <= 0:
+            self.prices.pop(symbol_id, None)
+        else:
+            self.prices[symbol_id] = price
+
+        updated: set[int] = set()
+        for path in self.paths_by_symbol.get(symbol_id, []):
+            rate = self._path_rate(path)
+            target = self.targets[path.target]
+            if path.rate is not None:
+                target.rates_sum[path.hops] -= path.rate
+                target.rates_count[path.hops] -= 1
+            if rate is not None:
+                target.rates_sum[path.hops] += rate
+                target.rates_count[path.hops] += 1
+            if not target.rates_count[path.hops]:
+                # No rounding leftovers once empty.
+                target.rates_sum[path.hops] = 0.0
+            path.rate = rate
+            updated.add(path.target)
+
+        changed = []
+        for index in updated:
+            target = self.targets[index]
+            rate = target.rate()
+            if rate is not None and rate != target.last_rate:
+                target.last_rate = rate
+                changed.append(target)
+        return changed
+
+    def _path_rate(self, path: PricingPath) -> Optional[float]:
+        rate = 1.0
+        for symbol_id, inverted in path.edges:
+            price = self.prices.get(symbol_id)
+            if price is None:
+                return None
+            rate = rate / price if inverted else rate * price
+        return rate
+
+
+def parse_targets(targets: Iterable[str]) -> list[SymbolInput]:
+    symbols = []
+    for target in targets:
+        base_asset, _, quote_asset = target.partition("/")
+        if not base_asset or not quote_asset:
+            raise ValueError(f"Cross rate targets must be BASE/QUOTE, got {target}")
+        symbols.append(
+            SymbolInput(symbol=target, base_asset=base_asset, quote_asset=quote_asset)
+        )
+    return symbols
+
+
+class CrossRates(Worker):
+    """Publishes the rates of the target pairs derived by a `PricingGraph` from the
+    true prices. Targets are added to the symbols, so that rates have a symbol id.
+    The graph is rebuilt when a true price comes for a symbol it doesn't know."""
+
+    def __init__(self, bus: MessageBus, targets: Iterable[str], max_hops: int = 3):
+        super().__init__()
+        self.bus = bus
+        self.targets = parse_targets(targets)
+        self.max_hops = max_hops
+        self.graph: Optional[PricingGraph] = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({[t.symbol for t in self.targets]})"
+
+    async def init(self):
+        async with storage.connect() as store:
+            await store.insert_symbols(self.targets)
+        await self.build_graph()
+
+    async def build_graph(self):
+        async with storage.connect() as store:
+            all_symbols = await store.get_all_symbols()
+            by_name = {symbol.symbol: symbol for symbol in all_symbols}
+            graph = PricingGraph(
+                all_symbols,
+                [by_name[target.symbol] for target in self.targets],
+                max_hops=self.max_hops,
+            )
+            # Start from the last prices rather than waiting for every symbol.
+            last_prices = await store.get_last_symbol_true_mid_prices(graph.symbol_ids)
+
+        for row in last_prices:
+            graph.update(row["symbol_id"], float(row["true_mid_price"]))
+        if self.graph is not None:
+            # More recent than the stored ones.
+            for symbol_id, price in self.graph.prices.items():
+                graph.update(symbol_id, price)
+            for old_target, target in zip(self.graph.targets, graph.targets):
+                target.last_rate = old_target.last_rate
+
+        self.graph = graph
+        logger.info(
+            f"{self} priced through {self.graph.paths_count()} paths of "
+            f"{len(self.graph.symbol_ids)} symbols"
+        )
+
+    async def run(self):
+        assert self.graph is not None
+        self.running = True
+        with self.bus.true_prices.queue() as queue:
+            logger.info(f"{self} is live!")
+            while self.running:
+                true_price = await queue.get()
+                if true_price.symbol_id not in self.graph.known_symbol_ids:
+                    await self.build_graph()
+                    # Even if it isn't stored, don't reload for each of its prices.
+                    self.graph.known_symbol_ids.add(true_price.symbol_id)
+                for message in self.process(true_price):
+                    observe_pipeline_latency(
+                        "cross_rate", "cross_rates", [message], message.timestamp_ms
+                    )
+                    await self.bus.cross_rates.put(message)
+
+    def process(self, true_price: SymbolTrueMidPrice) -> list[SymbolCrossRate]:
+        assert self.graph is not None
+        changed = self.graph.update(
+            true_price.symbol_id, float(true_price.true_mid_price)
+        )
+        messages = []
+        for target in changed:
+            assert target.last_rate is not None
+            rate, hops, paths = target.last_rate
+            messages.append(
+                SymbolCrossRate(
+                    symbol_id=target.symbol.id,
+                    timestamp_ms=now_ms(),
+                    rate=Decimal(rate),
+                    hops=hops,
+                    paths=paths,
+                    triggering_symbol_id=true_price.symbol_id,
+                    triggering_connector=true_price.triggering_connector,
+                    triggering_timestamp_ms=true_price.triggering_timestamp_ms,
+                )
+            )
+        return messages
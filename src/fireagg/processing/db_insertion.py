@@ -3,16 +3,32 @@ import platform
 from contextlib import contextmanager
 import logging
 import time
-from typing import Generic, TypeVar
-from pydapper.commands import CommandsAsync
+from typing import Callable, Generic, Hashable, Optional, TypeVar
 
-from fireagg.database import db, symbol_prices
+from fireagg import settings
+from fireagg.database import storage
+from fireagg.database.storage import Storage
 
 from .core import Worker
+from .overload import OverloadController, Sampler, conflate_trades
+from .persistence import StreamPersistence
 from .queue_adapter import QueueAdapter
-from .messages import Message, SymbolSpreads, SymbolTrade, SymbolTrueMidPrice
+from .messages import (
+    Message,
+    SymbolBBO,
+    SymbolCrossRate,
+    SymbolSpreads,
+    SymbolTrade,
+    SymbolTrueMidPrice,
+    SymbolWeightAdjust,
+    now_ms,
+)
 
-from fireagg.metrics import get_db_inserts_counter
+from fireagg.metrics import (
+    get_db_inserts_counter,
+    get_db_skipped_counter,
+    observe_pipeline_latency,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -27,48 +43,119 @@ class DatabaseStreamQueue(Worker, Generic[QueueT]):
         self,
         multi_queue: QueueAdapter[QueueT],
         sleep_delay: float = 0.02,
+        on_flushed: Optional[Callable[[str, list[QueueT]], None]] = None,
+        overload: Optional[OverloadController] = None,
+        shed_sample_s: float = 1,
+        persistence_policies: Optional[list[settings.PersistencePolicySettings]] = None,
     ):
         super().__init__()
         self.multi_queue = multi_queue
         self.sleep_delay = sleep_delay
+        # Called with the stream name and the records once they are committed.
+        self.on_flushed = on_flushed
+        self.overload = overload
+        self.shed_sample_s = shed_sample_s
         self.local_throughput_counter = 0
         self.local_throughput_log_interval = 5
 
         self.throughput_counter = get_db_inserts_counter(
             worker=str(self), stream_name=self.name
         )
+        self.skipped_counter = get_db_skipped_counter(stream_name=self.name)
 
-    async def flush(self, commands: CommandsAsync, records: list[QueueT]):
+        self.persistence = StreamPersistence.from_settings(
+            self.name,
+            persistence_policies or [],
+            key_fn=self.persistence_key,
+            values_fn=self.persistence_values,
+        )
+
+    async def flush(self, store: Storage, records: list[QueueT]):
         raise NotImplementedError()
 
+    # Streams supporting more than the full persistence policy define the key of
+    # their records, and the values compared in basis points.
+    persistence_key: Optional[Callable[[QueueT], Hashable]] = None
+    persistence_values: Optional[Callable[[QueueT], tuple[float, ...]]] = None
+
+    def shed(self, records: list[QueueT]) -> list[QueueT]:
+        """The records to persist while the overload controller sheds this stream."""
+        return records
+
     async def run(self):
         self.running = True
         throughput_task = asyncio.create_task(self.run_throughput_monitor())
         try:
-            async with await db.create_pool(maxsize=1) as priority_pool:
+            async with storage.priority_pool() as priority_pool:
                 # We create our own connection pool to not share the connection with
                 # other less important parts of the code.
                 with self.multi_queue.queue() as queue:
                     logger.info(f"{self} is live!")
-                    while self.running:
-                        records = await self.get_as_much_as_possible(queue)
-
-                        if records:
-                            with warn_if_too_long("flush"):
-                                async with db.connect_async(priority_pool) as commands:
-                                    await self.flush(commands, records)
-
-                            self.local_throughput_counter += len(records)
-                            self.throughput_counter.inc(len(records))
-
-                            for _ in range(len(records)):
-                                queue.task_done()
-                        else:
-                            await asyncio.sleep(self.sleep_delay)
+                    try:
+                        await self.run_queue(priority_pool, queue)
+                    finally:
+                        await self.flush_held(priority_pool)
         finally:
             throughput_task.cancel()
             raise RuntimeError("Consumer exited")
 
+    async def run_queue(self, priority_pool, queue: asyncio.Queue[QueueT]):
+        while self.running:
+            records = await self.get_as_much_as_possible(queue)
+            received = len(records)
+            if records:
+                observe_pipeline_latency("consume", self.name, records, now_ms())
+            received_records = records
+            if self.persistence:
+                records = self.persistence.apply(records)
+                records += self.persistence.due(now_ms())
+                self.skipped_counter.inc(self.persistence.pop_skipped())
+            if records and self.overload and self.overload.is_shedding(self.name):
+                persisted = len(records)
+                records = self.shed(records)
+                self.overload.count_shed(self.name, persisted - len(records))
+
+            if records:
+                with warn_if_too_long("flush"):
+                    async with storage.connect(priority_pool) as store:
+                        await self.flush(store, records)
+
+                committed = records
+                if self.persistence:
+                    # Held records would count their hold time.
+                    received_ids = {id(r) for r in received_records}
+                    committed = [r for r in records if id(r) in received_ids]
+                observe_pipeline_latency("db_commit", self.name, committed, now_ms())
+                self._count_flushed(records)
+
+            if received:
+                for _ in range(received):
+                    queue.task_done()
+            else:
+                await asyncio.sleep(self.sleep_delay)
+
+    async def flush_held(self, priority_pool):
+        """Persists the records still held by the persistence policy."""
+        if not self.persistence:
+            return
+        records = self.persistence.drain()
+        if not records:
+            return
+        try:
+            async with storage.connect(priority_pool) as store:
+                await self.flush(store, records)
+        except Exception as e:
+            logger.warning(f"{self} lost {len(records)} held records: {str(e)}")
+            return
+        self._count_flushed(records)
+
+    def _count_flushed(self, records: list[QueueT]):
+        if self.on_flushed:
+            self.on_flushed(self.name, records)
+
+        self.local_throughput_counter += len(records)
+        self.throughput_counter.inc(len(records))
+
     async def run_throughput_monitor(self):
         while self.running:
             await asyncio.sleep(self.local_throughput_log_interval)
@@ -102,25 +189,85 @@ def warn_if_too_long(for_what: str, too_long: float = 1):
 class DatabaseStreamTrades(DatabaseStreamQueue[SymbolTrade]):
     name = "trades"
 
-    async def flush(self, commands: CommandsAsync, records: list[SymbolTrade]):
-        await symbol_prices.insert_symbol_trades(
-            commands, trades=[trade.model_dump() for trade in records]
-        )
+    async def flush(self, store: Storage, records: list[SymbolTrade]):
+        await store.insert_symbol_trades([trade.model_dump() for trade in records])
+
+    def shed(self, records: list[SymbolTrade]):
+        return conflate_trades(records)
 
 
 class DatabaseStreamSpreads(DatabaseStreamQueue[SymbolSpreads]):
     name = "spreads"
 
-    async def flush(self, commands: CommandsAsync, records: list[SymbolSpreads]):
-        await symbol_prices.insert_symbol_spreads(
-            commands, spreads=[spread.model_dump() for spread in records]
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sampler = Sampler(
+            lambda spread: (spread.connector, spread.symbol_id), self.shed_sample_s
         )
 
+    async def flush(self, store: Storage, records: list[SymbolSpreads]):
+        await store.insert_symbol_spreads([spread.model_dump() for spread in records])
+
+    @staticmethod
+    def persistence_key(spread: SymbolSpreads):
+        return spread.connector, spread.symbol_id
+
+    @staticmethod
+    def persistence_values(spread: SymbolSpreads):
+        return float(spread.best_bid), float(spread.best_ask)
+
+    def shed(self, records: list[SymbolSpreads]):
+        return self.sampler.sample(records)
+
 
 class DatabaseStreamTrueMidPrice(DatabaseStreamQueue[SymbolTrueMidPrice]):
     name = "mid_prices"
 
-    async def flush(self, commands: CommandsAsync, records: list[SymbolTrueMidPrice]):
-        await symbol_prices.insert_symbol_true_mid_price(
-            commands, mid_prices=[spread.model_dump() for spread in records]
+    async def flush(self, store: Storage, records: list[SymbolTrueMidPrice]):
+        await store.insert_symbol_true_mid_price(
+            [spread.model_dump() for spread in records]
         )
+
+    @staticmethod
+    def persistence_key(true_price: SymbolTrueMidPrice):
+        return true_price.symbol_id
+
+    @staticmethod
+    def persistence_values(true_price: SymbolTrueMidPrice):
+        return (float(true_price.true_mid_price),)
+
+
+class DatabaseStreamWeights(DatabaseStreamQueue[SymbolWeightAdjust]):
+    name = "weights"
+
+    async def flush(self, store: Storage, records: list[SymbolWeightAdjust]):
+        await store.insert_symbol_weights([weight.model_dump() for weight in records])
+
+
+class DatabaseStreamBBO(DatabaseStreamQueue[SymbolBBO]):
+    name = "bbo"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sampler = Sampler(lambda bbo: bbo.symbol_id, self.shed_sample_s)
+
+    async def flush(self, store: Storage, records: list[SymbolBBO]):
+        await store.insert_symbol_bbo([bbo.model_dump() for bbo in records])
+
+    @staticmethod
+    def persistence_key(bbo: SymbolBBO):
+        return bbo.symbol_id
+
+    @staticmethod
+    def persistence_values(bbo: SymbolBBO):
+        return float(bbo.best_bid), float(bbo.best_ask)
+
+    def shed(self, records: list[SymbolBBO]):
+        return self.sampler.sample(records)
+
+
+class DatabaseStreamCrossRates(DatabaseStreamQueue[SymbolCrossRate]):
+    name = "cross_rates"
+
+    async def flush(self, store: Storage, records: list[SymbolCrossRate]):
+        await store.insert_symbol_cross_rates([rate.model_dump() for rate in records])
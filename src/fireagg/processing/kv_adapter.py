@@ -13,49 +13,88 @@ logger = logging.getLogger(__name__)
 
 
 class LastValueKVStore(Generic[T]):
+    """The last value of each key of a queue, e.g. the last true price of each
+    symbol. Values that arrive faster than they are written are coalesced, only
+    the last value of each key is written."""
+
     def __init__(
         self,
         name: str,
         queue_type: Type[T],
-        queue: QueueAdapter[T],
+        queue: Optional[QueueAdapter[T]],
         key_fn: Callable[[T], str],
     ):
         self.name = name
 
         self.queue_type = queue_type
+        # Without a queue, the store is only read from.
         self.queue = queue
         self.key_fn = key_fn
 
-        self.sleep_delay = 0.02
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.name=})"
 
     async def run(self):
+        if self.queue is None:
+            raise ValueError(f"{self} has no queue to read from")
+
         self.running = True
-        try:
-            with self.queue.queue() as queue:
-                logger.info(f"{self} is live!")
-                while self.running:
-                    last: Optional[T] = await self.get_last(queue)
-
-                    if last:
-                        key = self.key_fn(last)
-                        await self.set(key, last)
-                    else:
-                        await asyncio.sleep(self.sleep_delay)
-        finally:
-            raise RuntimeError("LastValueKVStore exited")
-
-    async def get_last(self, queue: asyncio.Queue):
-        data = []
+        with self.queue.queue() as queue:
+            logger.info(f"{self} is live!")
+            while self.running:
+                values = await self.get_last_values(queue)
+                await self.set_many(values)
+        raise RuntimeError("LastValueKVStore exited")
+
+    async def get_last_values(self, queue: asyncio.Queue) -> dict[str, T]:
+        """Waits for a value, then takes everything queued, keeping the last value
+        of each key."""
+        first = await queue.get()
+        values = {self.key_fn(first): first}
         while True:
             try:
-                data.append(queue.get_nowait())
+                value = queue.get_nowait()
             except asyncio.QueueEmpty:
                 break
+            values[self.key_fn(value)] = value
 
-        return data[-1] if data else None
+        return values
 
     async def get(self, key: str) -> Optional[T]:
         raise NotImplementedError()
 
     async def set(self, key: str, value: T):
         raise NotImplementedError()
+
+    async def get_many(self, keys: list[str]) -> list[Optional[T]]:
+        return [await self.get(key) for key in keys]
+
+    async def set_many(self, values: dict[str, T]):
+        for key, value in values.items():
+            await self.set(key, value)
+
+
+class MemoryKVStore(LastValueKVStore[T]):
+    """For single process setups."""
+
+    def __init__(
+        self,
+        name: str,
+        queue_type: Type[T],
+        queue: Optional[QueueAdapter[T]],
+        key_fn: Callable[[T], str],
+    ):
+        super().__init__(name=name, queue_type=queue_type, queue=queue, key_fn=key_fn)
+        self.values: dict[str, T] = {}
+
+    async def get(self, key: str) -> Optional[T]:
+        return self.values.get(key)
+
+    async def get_many(self, keys: list[str]) -> list[Optional[T]]:
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key: str, value: T):
+        self.values[key] = value
+
+    async def set_many(self, values: dict[str, T]):
+        self.values.update(values)
@@ -1,6 +1,7 @@
+import asyncio
 from typing import Optional, Protocol
 
-from .kv_adapter import LastValueKVStore
+from .kv_adapter import LastValueKVStore, MemoryKVStore
 
 from .queue_adapter import QueueAdapter, AsyncioQueueAdapter
 from .messages import (
@@ -8,6 +9,8 @@ from .messages import (
     SymbolSpreads,
     SymbolWeightAdjust,
     SymbolTrueMidPrice,
+    SymbolBBO,
+    SymbolCrossRate,
 )
 
 
@@ -16,6 +19,8 @@ class MessageBus(Protocol):
     spreads: QueueAdapter[SymbolSpreads]
     weights: QueueAdapter[SymbolWeightAdjust]
     true_prices: QueueAdapter[SymbolTrueMidPrice]
+    bbo: QueueAdapter[SymbolBBO]
+    cross_rates: QueueAdapter[SymbolCrossRate]
 
     last_true_prices: Optional[LastValueKVStore[SymbolTrueMidPrice]] = None
 
@@ -29,15 +34,34 @@ class MessageBus(Protocol):
         return
 
 
+TRUE_PRICES_KV_NAME = "true_mid_prices"
+
+
+def true_prices_key(true_price: SymbolTrueMidPrice):
+    return str(true_price.symbol_id)
+
+
 class AsyncioMessageBus(MessageBus):
     def __init__(self):
         self.trades = AsyncioQueueAdapter[SymbolTrade]()
         self.spreads = AsyncioQueueAdapter[SymbolSpreads]()
         self.weights = AsyncioQueueAdapter[SymbolWeightAdjust]()
         self.true_prices = AsyncioQueueAdapter[SymbolTrueMidPrice]()
+        self.bbo = AsyncioQueueAdapter[SymbolBBO]()
+        self.cross_rates = AsyncioQueueAdapter[SymbolCrossRate]()
+
+        self.last_true_prices = MemoryKVStore(
+            name=TRUE_PRICES_KV_NAME,
+            queue_type=SymbolTrueMidPrice,
+            queue=self.true_prices,
+            key_fn=true_prices_key,
+        )
+        self._tasks: list[asyncio.Task] = []
 
     async def __aenter__(self):
+        self._tasks = [asyncio.create_task(self.last_true_prices.run())]
         return self
 
     async def __aexit__(self, *args):
-        return
+        for t in self._tasks:
+            t.cancel()
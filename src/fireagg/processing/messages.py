@@ -1,6 +1,7 @@
 import time
 import uuid
 from decimal import Decimal
+from typing import Optional
 
 import pydantic
 
@@ -11,6 +12,11 @@ import pydantic
 class Message(pydantic.BaseModel):
     id: str = pydantic.Field(default_factory=lambda: uuid.uuid1().hex)
 
+    def latency_origin(self) -> Optional[tuple[str, float]]:
+        """The connector and exchange timestamp that pipeline latencies of this
+        message are measured from, if any."""
+        return None
+
 
 def now_ms():
     return time.time() * 1000.0
@@ -25,6 +31,9 @@ class SymbolSpreads(Message):
     best_bid: Decimal
     best_ask: Decimal
 
+    def latency_origin(self):
+        return self.connector, self.timestamp_ms
+
 
 class SymbolTrade(Message):
     connector: str
@@ -37,10 +46,14 @@ class SymbolTrade(Message):
 
     is_buy: bool
 
+    def latency_origin(self):
+        return self.connector, self.timestamp_ms
+
 
 class SymbolWeightAdjust(Message):
     connector: str
     symbol_id: int
+    timestamp_ms: float = pydantic.Field(default_factory=now_ms)
 
     weight: float
 
@@ -51,3 +64,55 @@ class SymbolTrueMidPrice(Message):
 
     true_mid_price: Decimal
     triggering_spread_message_id: str
+    # The exchange side of the triggering spread.
+    triggering_connector: Optional[str] = None
+    triggering_timestamp_ms: Optional[float] = None
+
+    def latency_origin(self):
+        if self.triggering_connector is None or self.triggering_timestamp_ms is None:
+            return None
+        return self.triggering_connector, self.triggering_timestamp_ms
+
+
+class SymbolBBO(Message):
+    """The consolidated best bid and offer of a symbol across connectors."""
+
+    symbol_id: int
+    timestamp_ms: float
+
+    best_bid: Decimal
+    best_bid_connector: str
+    best_ask: Decimal
+    best_ask_connector: str
+    # The best bid is above the best ask: an arbitrage or a stale quote across
+    # connectors, or a bad quote when both sides are from the same one.
+    is_crossed: bool
+
+    triggering_spread_message_id: str
+    triggering_connector: str
+    triggering_timestamp_ms: float
+
+    def latency_origin(self):
+        return self.triggering_connector, self.triggering_timestamp_ms
+
+
+class SymbolCrossRate(Message):
+    """The rate of a pair derived from the true prices of other symbols."""
+
+    symbol_id: int
+    timestamp_ms: float
+
+    rate: Decimal
+    # The rate is the mean of the `paths` shortest chains of symbols, of `hops`
+    # symbols each.
+    hops: int
+    paths: int
+
+    triggering_symbol_id: int
+    triggering_connector: Optional[str] = None
+    triggering_timestamp_ms: Optional[float] = None
+
+    def latency_origin(self):
+        if self.triggering_connector is None or self.triggering_timestamp_ms is None:
+            return None
+        return self.triggering_connector, self.triggering_timestamp_ms
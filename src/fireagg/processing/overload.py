@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Callable, Hashable, Iterable, Literal, Optional, TypeVar
+
+from fireagg.metrics import (
+    get_overload_metrics,
+    get_overload_shed_counter,
+    set_overload_shedding,
+)
+
+from .base import Worker
+from .message_bus import MessageBus
+from .messages import Message, SymbolTrade
+
+logger = logging.getLogger(__name__)
+
+# True prices are never shed.
+SheddableStream = Literal["spreads", "trades", "bbo"]
+
+M = TypeVar("M", bound=Message)
+
+
+class OverloadController(Worker):
+    """Degrades the persistence of the less important streams while the pipeline
+    falls behind, so that the true prices keep up.
+
+    The pressure is the deepest bus queue relative to `max_queue_depth`, or the
+    event loop lag relative to `max_loop_lag_s`, whichever is higher. Each check
+    above 1 sheds one more stream of `shedding_order`; a level is recovered once
+    the pressure stayed below half for `recover_s`. The database writers ask
+    `is_shedding` for their stream.
+    """
+
+    def __init__(
+        self,
+        bus: MessageBus,
+        shedding_order: Iterable[SheddableStream],
+        max_queue_depth: int,
+        max_loop_lag_s: float,
+        recover_s: float,
+        check_interval_s: float = 0.5,
+    ):
+        super().__init__()
+        self.bus = bus
+        self.shedding_order = list(shedding_order)
+        self.max_queue_depth = max_queue_depth
+        self.max_loop_lag_s = max_loop_lag_s
+        self.recover_s = recover_s
+        self.check_interval_s = check_interval_s
+
+        self.level = 0
+        self.pressure = 0.0
+        self._calm_since: Optional[float] = None
+        self._shed_counters = {
+            stream: get_overload_shed_counter(stream) for stream in self.shedding_order
+        }
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.shedding_order})"
+
+    def is_live_callback(self):
+        logger.info(f"{self} is live!")
+
+    def is_shedding(self, stream: str) -> bool:
+        return stream in self.shedding_order[: self.level]
+
+    def count_shed(self, stream: str, n_messages: int):
+        if n_messages:
+            self._shed_counters[stream].inc(n_messages)
+
+    def queue_depth(self) -> int:
+        queues = [
+            self.bus.trades,
+            self.bus.spreads,
+            self.bus.weights,
+            self.bus.true_prices,
+            self.bus.bbo,
+        ]
+        return max(queue.depth() for queue in queues)
+
+    async def run(self):
+        level_gauge, pressure_gauge = get_overload_metrics()
+        for stream in self.shedding_order:
+            set_overload_shedding(stream, False)
+
+        self.running = True
+        while self.running:
+            started = time.perf_counter()
+            await asyncio.sleep(self.check_interval_s)
+            lag_s = max(0.0, time.perf_counter() - started - self.check_interval_s)
+
+            self.pressure = max(
+                self.queue_depth() / self.max_queue_depth, lag_s / self.max_loop_lag_s
+            )
+            pressure_gauge.set(self.pressure)
+            self.update_level(time.monotonic())
+            level_gauge.set(self.level)
+            self.mark_alive()
+
+    def update_level(self, now: float):
+        if self.pressure >= 1:
+            self._calm_since = None
+            if self.level < len(self.shedding_order):
+                self._set_level(self.level + 1)
+        elif self.pressure < 0.5 and self.level > 0:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recover_s:
+                self._calm_since = now
+                self._set_level(self.level - 1)
+        else:
+            self._calm_since = None
+
+    def _set_level(self, level: int):
+        if level > self.level:
+            stream = self.shedding_order[level - 1]
+            logger.warning(
+                f"{self} is overloaded ({self.pressure:.1f}x), degrading {stream}"
+            )
+            set_overload_shedding(stream, True)
+        else:
+            stream = self.shedding_order[level]
+            logger.info(f"{self} recovered, restoring {stream}")
+            set_overload_shedding(stream, False)
+        self.level = level
+
+
+class Sampler:
+    """Keeps at most one message per key every `interval_s`, the latest."""
+
+    def __init__(self, key_fn: Callable[[M], Hashable], interval_s: float):
+        self.key_fn = key_fn
+        self.interval_s = interval_s
+        self.last_kept: dict[Hashable, float] = {}
+
+    def sample(self, messages: list[M]) -> list[M]:
+        now = time.monotonic()
+        kept = []
+        for message in reversed(messages):
+            key = self.key_fn(message)
+            if now - self.last_kept.get(key, float("-inf")) >= self.interval_s:
+                self.last_kept[key] = now
+                kept.append(message)
+        kept.reverse()
+        return kept
+
+
+def conflate_trades(trades: list[SymbolTrade]) -> list[SymbolTrade]:
+    """One trade per connector, symbol and side, at the volume weighted average
+    price of the batch and with its total amount. Timestamps are the last trade's."""
+    groups: dict[tuple[str, int, bool], list[SymbolTrade]] = {}
+    for trade in trades:
+        groups.setdefault((trade.connector, trade.symbol_id, trade.is_buy), []).append(
+            trade
+        )
+
+    conflated = []
+    for group in groups.values():
+        last = group[-1]
+        if len(group) == 1:
+            conflated.append(last)
+            continue
+
+        amount = sum((trade.amount for trade in group), Decimal(0))
+        price = (
+            sum((trade.price * trade.amount for trade in group), Decimal(0)) / amount
+            if amount
+            else last.price
+        )
+        conflated.append(last.model_copy(update={"price": price, "amount": amount}))
+    return conflated
@@ -0,0 +1,181 @@
+from typing import Callable, Generic, Hashable, Iterable, Optional, TypeVar
+
+from fireagg.settings import PersistencePolicySettings
+
+from .messages import Message
+
+M = TypeVar("M", bound=Message)
+
+KeyFn = Callable[[M], Hashable]
+ValuesFn = Callable[[M], tuple[float, ...]]
+
+
+class PersistencePolicy(Generic[M]):
+    """Which records of a stream are persisted. This one keeps them all."""
+
+    # Records dropped so far.
+    skipped = 0
+
+    def apply(self, records: list[M]) -> list[M]:
+        return records
+
+    def due(self, now_ms: float) -> list[M]:
+        """Records held back by `apply` that are now ready to be persisted."""
+        return []
+
+    def drain(self) -> list[M]:
+        """All the records held back by `apply`, e.g. when the writer stops."""
+        return []
+
+
+class LatestPerInterval(PersistencePolicy[M]):
+    """The last record of each key per interval of their timestamps. A record is
+    held until a later interval starts for its key, or until its interval ended
+    for another interval of wall clock time, so a quiet key still gets its last
+    record persisted."""
+
+    def __init__(self, key_fn: KeyFn, interval_s: float):
+        self.key_fn = key_fn
+        self.interval_ms = interval_s * 1000
+        # Key -> (interval, last record)
+        self.pending: dict[Hashable, tuple[int, M]] = {}
+
+    def apply(self, records: list[M]) -> list[M]:
+        kept = []
+        for record in records:
+            key = self.key_fn(record)
+            interval = int(record.timestamp_ms // self.interval_ms)  # type: ignore
+            pending = self.pending.get(key)
+            if pending is None or interval > pending[0]:
+                if pending is not None:
+                    kept.append(pending[1])
+                self.pending[key] = (interval, record)
+            else:
+                # Replaces the pending record, or its interval was already persisted.
+                if interval == pending[0]:
+                    self.pending[key] = (interval, record)
+                self.skipped += 1
+        return kept
+
+    def due(self, now_ms: float) -> list[M]:
+        # One more interval of grace, for the records still on their way.
+        last_due = int(now_ms // self.interval_ms) - 2
+        due_keys = [key for key, (i, _) in self.pending.items() if i <= last_due]
+        return [self.pending.pop(key)[1] for key in due_keys]
+
+    def drain(self) -> list[M]:
+        records = [record for _, record in self.pending.values()]
+        self.pending.clear()
+        return records
+
+
+class BpsChange(PersistencePolicy[M]):
+    """The records of a key whose values moved by at least `bps` basis points
+    from the last persisted ones."""
+
+    def __init__(self, key_fn: KeyFn, values_fn: ValuesFn, bps: float):
+        self.key_fn = key_fn
+        self.values_fn = values_fn
+        self.ratio = bps / 10_000
+        self.last_values: dict[Hashable, tuple[float, ...]] = {}
+
+    def apply(self, records: list[M]) -> list[M]:
+        kept = []
+        for record in records:
+            key = self.key_fn(record)
+            values = self.values_fn(record)
+            last = self.last_values.get(key)
+            if last is None or any(
+                abs(value - last_value) >= abs(last_value) * self.ratio
+                for value, last_value in zip(values, last)
+            ):
+                self.last_values[key] = values
+                kept.append(record)
+            else:
+                self.skipped += 1
+        return kept
+
+
+class StreamPersistence(Generic[M]):
+    """The persistence policies of a stream, by connector."""
+
+    def __init__(
+        self,
+        default: PersistencePolicy[M],
+        by_connector: dict[str, PersistencePolicy[M]],
+    ):
+        self.default = default
+        self.by_connector = by_connector
+        self.policies = [default, *by_connector.values()]
+
+    @classmethod
+    def from_settings(
+        cls,
+        stream: str,
+        policies: Iterable[PersistencePolicySettings],
+        key_fn: Optional[KeyFn] = None,
+        values_fn: Optional[ValuesFn] = None,
+    ) -> Optional["StreamPersistence"]:
+        """None when every record of the stream is persisted."""
+        default: PersistencePolicy = PersistencePolicy()
+        by_connector: dict[str, PersistencePolicy] = {}
+        for settings_obj in policies:
+            if settings_obj.stream != stream:
+                continue
+
+            policy: PersistencePolicy
+            if settings_obj.policy == "full":
+                policy = PersistencePolicy()
+            elif key_fn is None or values_fn is None:
+                raise ValueError(f"The {stream} stream only supports the full policy")
+            elif settings_obj.policy == "latest_per_interval":
+                policy = LatestPerInterval(key_fn, settings_obj.interval_s)
+            else:
+                policy = BpsChange(key_fn, values_fn, settings_obj.bps)
+
+            if settings_obj.connector is None:
+                default = policy
+            else:
+                by_connector[settings_obj.connector] = policy
+
+        if type(default) is PersistencePolicy and all(
+            type(policy) is PersistencePolicy for policy in by_connector.values()
+        ):
+            return None
+        return cls(default, by_connector)
+
+    def apply(self, records: list[M]) -> list[M]:
+        if not self.by_connector:
+            return self.default.apply(records)
+
+        by_policy: dict[int, list[M]] = {}
+        for record in records:
+            policy = self.by_connector.get(
+                getattr(record, "connector", None), self.default  # type: ignore
+            )
+            by_policy.setdefault(id(policy), []).append(record)
+
+        kept = []
+        for policy in self.policies:
+            if id(policy) in by_policy:
+                kept += policy.apply(by_policy.pop(id(policy)))
+        return kept
+
+    def due(self, now_ms: float) -> list[M]:
+        due = []
+        for policy in self.policies:
+            due += policy.due(now_ms)
+        return due
+
+    def drain(self) -> list[M]:
+        records = []
+        for policy in self.policies:
+            records += policy.drain()
+        return records
+
+    def pop_skipped(self) -> int:
+        skipped = 0
+        for policy in self.policies:
+            skipped += policy.skipped
+            policy.skipped = 0
+        return skipped
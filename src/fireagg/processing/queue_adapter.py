@@ -12,10 +12,25 @@ class QueueAdapter(Protocol, Generic[T]):
     async def put(self, obj: T):
         raise NotImplementedError()
 
+    async def put_many(self, objs: list[T]):
+        for obj in objs:
+            await self.put(obj)
+
     @contextmanager
     def queue(self) -> Iterator[asyncio.Queue[T]]:
         raise NotImplementedError()
 
+    def depth(self) -> int:
+        """Number of messages waiting for the slowest local subscriber."""
+        raise NotImplementedError()
+
 
 class AsyncioQueueAdapter(MultisubscriberQueue[T], QueueAdapter[T]):
-    pass
+    async def put_many(self, objs: list[T]):
+        # Subscriber queues are unbounded, there is nothing to wait for.
+        for queue in self.subscribers:
+            for obj in objs:
+                queue.put_nowait(obj)
+
+    def depth(self) -> int:
+        return max((queue.qsize() for queue in self.subscribers), default=0)
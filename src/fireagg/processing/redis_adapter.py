@@ -1,6 +1,6 @@
 import asyncio
 from contextlib import contextmanager
-from typing import Any, Callable, Iterator, Type, Union, cast
+from typing import Any, Callable, Iterator, Optional, Type, Union, cast
 import pydantic
 
 import redis.asyncio
@@ -9,7 +9,7 @@ from asyncio_multisubscriber_queue import MultisubscriberQueue
 
 from fireagg import settings
 
-from .message_bus import MessageBus
+from .message_bus import MessageBus, TRUE_PRICES_KV_NAME, true_prices_key
 from .queue_adapter import QueueAdapter, T
 from .kv_adapter import LastValueKVStore
 
@@ -18,16 +18,22 @@ from .messages import (
     SymbolSpreads,
     SymbolWeightAdjust,
     SymbolTrueMidPrice,
+    SymbolBBO,
+    SymbolCrossRate,
 )
 
+TRUE_PRICES_STREAM_KEY = "symbol_true_prices"
+
 
 def redis_client(**kwargs):
     url = settings.get().redis_url
+    assert url
     return redis.asyncio.Redis.from_url(str(url), **kwargs)
 
 
 class RedisStreamsQueue(QueueAdapter[T]):
     DATA_KEY = b"json"
+    BATCH_DATA_KEY = b"json_batch"
 
     def __init__(
         self, client: redis.asyncio.Redis, queue_type: Type[T], stream_key: str
@@ -35,6 +41,7 @@ class RedisStreamsQueue(QueueAdapter[T]):
         self.redis = client
         self.queue_type = queue_type
         self.stream_key = stream_key
+        self.batch_adapter = pydantic.TypeAdapter(list[queue_type])  # type: ignore
 
         self._output_queue = MultisubscriberQueue[T]()
         self.running = True
@@ -44,11 +51,25 @@ class RedisStreamsQueue(QueueAdapter[T]):
             self.stream_key, {self.DATA_KEY: redis_encode_pydantic(obj)}
         )
 
+    async def put_many(self, objs: list[T]):
+        if not objs:
+            return
+        # A single stream entry and serialization pass for the whole batch.
+        await self.redis.xadd(
+            self.stream_key,
+            {self.BATCH_DATA_KEY: cast(EncodableT, self.batch_adapter.dump_json(objs))},
+        )
+
     @contextmanager
     def queue(self) -> Iterator[asyncio.Queue[T]]:
         with self._output_queue.queue() as queue:
             yield queue
 
+    def depth(self) -> int:
+        return max(
+            (queue.qsize() for queue in self._output_queue.subscribers), default=0
+        )
+
     async def run_reader(self):
         while self.running:
             streams = await self.redis.xread(streams={self.stream_key: "$"}, block=200)
@@ -56,9 +77,16 @@ class RedisStreamsQueue(QueueAdapter[T]):
                 stream_key, data = stream
                 for obj in data:
                     msg_id, data = obj
-                    raw_data = data[self.DATA_KEY]
-                    model = redis_decode_pydantic(self.queue_type, raw_data)
-                    await self._output_queue.put(model)
+                    if self.BATCH_DATA_KEY in data:
+                        models = self.batch_adapter.validate_json(
+                            data[self.BATCH_DATA_KEY]
+                        )
+                        for model in models:
+                            await self._output_queue.put(model)
+                    else:
+                        raw_data = data[self.DATA_KEY]
+                        model = redis_decode_pydantic(self.queue_type, raw_data)
+                        await self._output_queue.put(model)
 
 
 def redis_encode_pydantic(obj: pydantic.BaseModel):
@@ -70,7 +98,10 @@ def redis_decode_pydantic(cls: Type[T], encoded: Any):
 
 
 class RedisStreamsMessageBus(MessageBus):
-    def __init__(self, client: redis.asyncio.Redis):
+    """With `write_last_values`, this process also writes the last true prices to
+    Redis for the API. A single process of the cluster should, the core."""
+
+    def __init__(self, client: redis.asyncio.Redis, write_last_values: bool = False):
         self.redis = client
         self.trades = RedisStreamsQueue(client, SymbolTrade, "symbol_trades")
         self.spreads = RedisStreamsQueue(client, SymbolSpreads, "symbol_spreads")
@@ -78,22 +109,26 @@ class RedisStreamsMessageBus(MessageBus):
             client, SymbolWeightAdjust, "connector_weights"
         )
         self.true_prices = RedisStreamsQueue(
-            client, SymbolTrueMidPrice, "symbol_true_prices"
+            client, SymbolTrueMidPrice, TRUE_PRICES_STREAM_KEY
+        )
+        self.bbo = RedisStreamsQueue(client, SymbolBBO, "symbol_bbo")
+        self.cross_rates = RedisStreamsQueue(
+            client, SymbolCrossRate, "symbol_cross_rates"
         )
 
-        # self.last_true_prices = RedisKVStore(
-        #     client,
-        #     name="true_mid_prices",
-        #     queue_type=SymbolTrueMidPrice,
-        #     queue=self.true_prices,
-        #     key_fn=lambda tp: str(tp.symbol_id),
-        # )
+        self.last_true_prices = (
+            true_prices_kv_store(client, queue=self.true_prices)
+            if write_last_values
+            else None
+        )
 
         self._queues: list[RedisStreamsQueue] = [
             self.trades,
             self.spreads,
             self.weights,
             self.true_prices,
+            self.bbo,
+            self.cross_rates,
         ]
         self._tasks = []
 
@@ -120,7 +155,7 @@ class RedisKVStore(LastValueKVStore[T]):
         client: redis.asyncio.Redis,
         name: str,
         queue_type: Type[T],
-        queue: QueueAdapter[T],
+        queue: Optional[QueueAdapter[T]],
         key_fn: Callable[[T], str],
     ):
         super().__init__(name=name, queue_type=queue_type, queue=queue, key_fn=key_fn)
@@ -129,7 +164,7 @@ class RedisKVStore(LastValueKVStore[T]):
     def _key_name(self, key: str):
         return f"{self.name}__{key}"
 
-    async def get(self, key: str) -> T:
+    async def get(self, key: str) -> Optional[T]:
         redis_key = self._key_name(key)
         value = await self.redis.get(redis_key)
         return value and redis_decode_pydantic(self.queue_type, value)
@@ -137,3 +172,32 @@ class RedisKVStore(LastValueKVStore[T]):
     async def set(self, key: str, value: T):
         redis_key = self._key_name(key)
         await self.redis.set(redis_key, redis_encode_pydantic(value))
+
+    async def get_many(self, keys: list[str]) -> list[Optional[T]]:
+        if not keys:
+            return []
+        values = await self.redis.mget([self._key_name(key) for key in keys])
+        return [
+            redis_decode_pydantic(self.queue_type, value) if value else None
+            for value in values
+        ]
+
+    async def set_many(self, values: dict[str, T]):
+        # One round trip for all the keys.
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(self._key_name(key), redis_encode_pydantic(value))
+            await pipe.execute()
+
+
+def true_prices_kv_store(
+    client: redis.asyncio.Redis,
+    queue: Optional[QueueAdapter[SymbolTrueMidPrice]] = None,
+):
+    return RedisKVStore(
+        client,
+        name=TRUE_PRICES_KV_NAME,
+        queue_type=SymbolTrueMidPrice,
+        queue=queue,
+        key_fn=true_prices_key,
+    )
@@ -7,40 +7,80 @@ import numpy as np
 import pandas as pd
 
 from .base import Worker
+from .checkpoints import CheckpointStore
 from .message_bus import MessageBus
 from .messages import SymbolTrueMidPrice, now_ms
 
+from fireagg.metrics import observe_pipeline_latency
+
 logger = logging.getLogger(__name__)
 
 
 class TrueMidPrice(Worker):
-    def __init__(self, bus: MessageBus):
+    """With checkpoints, the weights and last mid prices of each symbol are saved
+    every `checkpoint_interval_s`, and restored on start when they are recent
+    enough, instead of waiting for the weights and spreads of every connector."""
+
+    def __init__(
+        self,
+        bus: MessageBus,
+        checkpoints: Optional[CheckpointStore] = None,
+        checkpoint_interval_s: float = 5,
+        max_weight_age_s: float = 6 * 3600,
+        max_mid_price_age_s: float = 30,
+    ):
         super().__init__()
         self.bus = bus
         self.symbols: dict[int, SymbolTrueMidPriceProcessor] = {}
 
+        self.checkpoints = checkpoints
+        self.checkpoint_interval_s = checkpoint_interval_s
+        self.max_weight_age_s = max_weight_age_s
+        self.max_mid_price_age_s = max_mid_price_age_s
+
+    async def init(self):
+        # After a crash, the state in memory is more recent.
+        if self.checkpoints and not self.symbols:
+            await self.restore_checkpoint()
+
     async def run(self):
         self.running = True
-        asyncio.create_task(self.run_weights_monitor())
-        with self.bus.spreads.queue() as queue:
-            logger.info(f"{self} is live!")
-            while self.running:
-                spread = await queue.get()
-                symbol = self.symbols.get(spread.symbol_id)
-                if symbol:
-                    mid_price = (spread.best_ask + spread.best_bid) / 2
-                    true_mid_price = symbol.predict_if_changed(
-                        spread.connector, mid_price
-                    )
-                    if true_mid_price:
-                        await self.bus.true_prices.put(
-                            SymbolTrueMidPrice(
+        # Cancelled when run exits, so that a restarted worker doesn't keep the
+        # monitors of its previous runs.
+        tasks = [asyncio.create_task(self.run_weights_monitor())]
+        if self.checkpoints:
+            tasks.append(asyncio.create_task(self.run_checkpoints()))
+        try:
+            with self.bus.spreads.queue() as queue:
+                logger.info(f"{self} is live!")
+                while self.running:
+                    spread = await queue.get()
+                    observe_pipeline_latency("consume", "spreads", [spread], now_ms())
+                    symbol = self.symbols.get(spread.symbol_id)
+                    if symbol:
+                        mid_price = (spread.best_ask + spread.best_bid) / 2
+                        true_mid_price = symbol.predict_if_changed(
+                            spread.connector, mid_price
+                        )
+                        if true_mid_price:
+                            message = SymbolTrueMidPrice(
                                 symbol_id=spread.symbol_id,
                                 timestamp_ms=now_ms(),
                                 true_mid_price=true_mid_price,
                                 triggering_spread_message_id=spread.id,
+                                triggering_connector=spread.connector,
+                                triggering_timestamp_ms=spread.timestamp_ms,
                             )
-                        )
+                            observe_pipeline_latency(
+                                "true_price",
+                                "true_prices",
+                                [message],
+                                message.timestamp_ms,
+                            )
+                            await self.bus.true_prices.put(message)
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def run_weights_monitor(self):
         with self.bus.weights.queue() as queue:
@@ -56,6 +96,51 @@ class TrueMidPrice(Worker):
                     weight.connector, weight.weight
                 )
 
+    async def run_checkpoints(self):
+        assert self.checkpoints is not None
+        while self.running:
+            await asyncio.sleep(self.checkpoint_interval_s)
+            try:
+                await self.checkpoints.save(self.checkpoint())
+            except Exception as e:
+                logger.warning(f"{self} could not save a checkpoint: {str(e)}")
+
+    def checkpoint(self) -> dict:
+        return {
+            "timestamp_ms": now_ms(),
+            "symbols": {
+                str(symbol_id): processor.checkpoint()
+                for symbol_id, processor in self.symbols.items()
+            },
+        }
+
+    async def restore_checkpoint(self):
+        assert self.checkpoints is not None
+        try:
+            checkpoint = await self.checkpoints.load()
+        except Exception as e:
+            logger.warning(f"{self} could not load its checkpoint: {str(e)}")
+            return
+        if not checkpoint:
+            return
+
+        now = now_ms()
+        for symbol_id, symbol_checkpoint in checkpoint["symbols"].items():
+            processor = SymbolTrueMidPriceProcessor.from_checkpoint(
+                int(symbol_id),
+                symbol_checkpoint,
+                min_weight_timestamp_ms=now - self.max_weight_age_s * 1000,
+                min_mid_price_timestamp_ms=now - self.max_mid_price_age_s * 1000,
+            )
+            if processor:
+                self.symbols[processor.symbol_id] = processor
+
+        age_s = (now - checkpoint["timestamp_ms"]) / 1000
+        logger.info(
+            f"{self} restored {len(self.symbols)} symbols from {self.checkpoints}, "
+            f"{age_s:.1f}s old"
+        )
+
 
 class SymbolTrueMidPriceProcessor:
     def __init__(self, symbol_id: int):
@@ -64,33 +149,96 @@ class SymbolTrueMidPriceProcessor:
         self._normalized_weights = pd.Series()
         self.last_mid_prices = pd.Series()
         self.last_true_mid_price: Optional[Decimal] = None
+        # When each weight and mid price was last set, for the checkpoints.
+        self.weights_timestamps_ms: dict[str, float] = {}
+        self.mid_prices_timestamps_ms: dict[str, float] = {}
+
+    def checkpoint(self) -> dict:
+        return {
+            "weights": {
+                connector: [float(self.weights[connector]), timestamp_ms]
+                for connector, timestamp_ms in self.weights_timestamps_ms.items()
+            },
+            "mid_prices": {
+                connector: [float(self.last_mid_prices[connector]), timestamp_ms]
+                for connector, timestamp_ms in self.mid_prices_timestamps_ms.items()
+            },
+        }
+
+    @classmethod
+    def from_checkpoint(
+        cls,
+        symbol_id: int,
+        checkpoint: dict,
+        min_weight_timestamp_ms: float,
+        min_mid_price_timestamp_ms: float,
+    ) -> Optional["SymbolTrueMidPriceProcessor"]:
+        """Without any recent weight, the symbol waits for its weights as on a cold
+        start. Mid prices are only restored for the connectors with a weight."""
+        processor = cls(symbol_id)
+        for connector, (weight, timestamp_ms) in checkpoint["weights"].items():
+            if timestamp_ms >= min_weight_timestamp_ms:
+                processor.set_connector_weight(connector, weight)
+                processor.weights_timestamps_ms[connector] = timestamp_ms
+        if not processor.weights_timestamps_ms:
+            return None
+
+        for connector, (mid_price, timestamp_ms) in checkpoint["mid_prices"].items():
+            if (
+                timestamp_ms >= min_mid_price_timestamp_ms
+                and connector in processor.weights_timestamps_ms
+            ):
+                processor.last_mid_prices[connector] = mid_price
+                processor.mid_prices_timestamps_ms[connector] = timestamp_ms
+        return processor
 
     def set_connector_weight(self, connector: str, weight: float):
         # Store as Decimal for compatibility with the prices
         self.weights[connector] = weight
+        self.weights_timestamps_ms[connector] = now_ms()
         try:
             self.last_mid_prices[connector] = self.last_mid_prices[connector]
         except KeyError:
             self.last_mid_prices[connector] = np.NaN
+            self._sort_connectors()
 
     def predict_if_changed(
         self, connector: str, mid_price: Decimal
     ) -> Optional[Decimal]:
+        is_new = connector not in self.last_mid_prices.index
         self.last_mid_prices[connector] = float(mid_price)
+        self.mid_prices_timestamps_ms[connector] = now_ms()
+        if is_new:
+            self._sort_connectors()
         prices = self.last_mid_prices.dropna()
         missing_connectors = prices.index.difference(self.weights.index)
-        if not missing_connectors.empty:
-            self.weights[missing_connectors] = 0.0
-
-        weights = self.weights[prices.index]
+        for missing_connector in missing_connectors:
+            # Setting a list of new labels raises, they are added one at a time.
+            self.weights[missing_connector] = 0.0
 
-        _normalized_weights = weights / weights.sum()
+        weights = self.weights[prices.index].to_numpy(float)
 
-        if _normalized_weights.empty:
+        if not len(weights):
             true_mid_price = Decimal(np.NaN)
         else:
-            true_mid_price = Decimal(prices.dot(_normalized_weights))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                _normalized_weights = weights / sum_in_order(weights)
+                true_mid_price = Decimal(
+                    sum_in_order(prices.to_numpy(float) * _normalized_weights)
+                )
 
         if true_mid_price != self.last_true_mid_price:
             self.last_true_mid_price = true_mid_price
             return true_mid_price
+
+    def _sort_connectors(self):
+        # Connectors are summed in name order whatever order they came in, as in
+        # `fireagg.backtest`.
+        self.last_mid_prices = self.last_mid_prices.sort_index()
+
+
+def sum_in_order(values: np.ndarray):
+    """Sums the last axis one value at a time. Unlike `np.sum` and `np.dot`, which
+    add in blocks, zeros then leave the sum unchanged wherever they are, so the true
+    prices of the live processor and of `fireagg.backtest` are exactly the same."""
+    return np.add.accumulate(values, axis=-1).take(-1, axis=-1)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from .base import Worker
+from .message_bus import MessageBus
+from .messages import SymbolWeightAdjust
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class RollingVolume:
+    """Traded volume over a sliding window, kept in a ring of fixed-size buckets."""
+
+    def __init__(self, window_s: float, bucket_s: float):
+        self.window_s = window_s
+        self.bucket_s = bucket_s
+        self.buckets = [0.0] * max(1, int(window_s // bucket_s))
+        self.current_bucket: Optional[int] = None
+        self.first_timestamp_s: Optional[float] = None
+
+    def add(self, timestamp_s: float, amount: float):
+        bucket = int(timestamp_s // self.bucket_s)
+        self._advance(bucket)
+        assert self.current_bucket is not None
+        if bucket <= self.current_bucket - len(self.buckets):
+            # Older than the window.
+            return
+
+        if self.first_timestamp_s is None:
+            self.first_timestamp_s = timestamp_s
+        self.buckets[bucket % len(self.buckets)] += amount
+
+    def volume_24h(self, now_s: float, min_elapsed_s: float) -> Optional[float]:
+        """The window volume extrapolated to 24h, so that it stays comparable to
+        the exchange tickers used to bootstrap the weights."""
+        if self.first_timestamp_s is None:
+            return None
+
+        elapsed_s = min(self.window_s, now_s - self.first_timestamp_s)
+        if elapsed_s < min_elapsed_s:
+            return None
+
+        self._advance(int(now_s // self.bucket_s))
+        return sum(self.buckets) * SECONDS_PER_DAY / elapsed_s
+
+    def _advance(self, bucket: int):
+        if self.current_bucket is None:
+            self.current_bucket = bucket
+            return
+
+        if bucket <= self.current_bucket:
+            return
+
+        n_buckets = len(self.buckets)
+        for expired in range(
+            self.current_bucket + 1, min(bucket, self.current_bucket + n_buckets) + 1
+        ):
+            self.buckets[expired % n_buckets] = 0.0
+        self.current_bucket = bucket
+
+
+class RollingVolumeWeights(Worker):
+    """Connector weights derived from the trades stream. Each connector and symbol
+    gets its rolling traded volume published to the weights stream on a schedule,
+    replacing the periodic exchange tickers.
+
+    A zero weight from elsewhere, i.e. a stopped or unwatched producer, drops the
+    rolling volume of its connector and symbol, so that it isn't republished.
+    Trades fetched before it are ignored."""
+
+    def __init__(
+        self,
+        bus: MessageBus,
+        window_s: float = 3600,
+        bucket_s: float = 60,
+        publish_interval_s: float = 30,
+        min_elapsed_s: float = 300,
+    ):
+        super().__init__()
+        self.bus = bus
+        self.window_s = window_s
+        self.bucket_s = bucket_s
+        self.publish_interval_s = publish_interval_s
+        self.min_elapsed_s = min_elapsed_s
+
+        self.volumes: dict[tuple[str, int], RollingVolume] = {}
+        # (connector, symbol id) -> when it was stopped.
+        self.stopped_at_ms: dict[tuple[str, int], float] = {}
+
+    async def run(self):
+        self.running = True
+        publish_task = asyncio.create_task(self.run_publisher())
+        stops_task = asyncio.create_task(self.run_stops_monitor())
+        try:
+            with self.bus.trades.queue() as queue:
+                logger.info(f"{self} is live!")
+                while self.running:
+                    trade = await queue.get()
+                    key = (trade.connector, trade.symbol_id)
+                    stopped_at_ms = self.stopped_at_ms.get(key)
+                    if stopped_at_ms is not None:
+                        if trade.fetch_timestamp_ms <= stopped_at_ms:
+                            continue
+                        # Watched again.
+                        del self.stopped_at_ms[key]
+
+                    volume = self.volumes.get(key)
+                    if volume is None:
+                        volume = self.volumes[key] = RollingVolume(
+                            self.window_s, self.bucket_s
+                        )
+                    volume.add(trade.timestamp_ms / 1000, float(trade.amount))
+        finally:
+            publish_task.cancel()
+            stops_task.cancel()
+
+    async def run_stops_monitor(self):
+        with self.bus.weights.queue() as queue:
+            while self.running:
+                weight = await queue.get()
+                if weight.weight:
+                    continue
+                key = (weight.connector, weight.symbol_id)
+                self.volumes.pop(key, None)
+                self.stopped_at_ms[key] = weight.timestamp_ms
+
+    async def run_publisher(self):
+        while self.running:
+            await asyncio.sleep(self.publish_interval_s)
+            await self.publish()
+
+    async def publish(self):
+        now_s = time.time()
+        weights = []
+        for (connector, symbol_id), volume in list(self.volumes.items()):
+            volume_24h = volume.volume_24h(now_s, min_elapsed_s=self.min_elapsed_s)
+            if volume_24h is None:
+                continue
+
+            weights.append(
+                SymbolWeightAdjust(
+                    connector=connector, symbol_id=symbol_id, weight=volume_24h
+                )
+            )
+            if not volume_24h:
+                # No trades in the window anymore, the zero weight is final.
+                del self.volumes[(connector, symbol_id)]
+
+        if weights:
+            await self.bus.weights.put_many(weights)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from fireagg.database import symbols
+from fireagg.input_streams.base import Connector
+
+from .message_bus import MessageBus
+from .messages import SymbolWeightAdjust
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectorWeightsRefresher:
+    """Market weights of every watched symbol of a connector, fetched in bulk.
+
+    Producers register their symbol mapping. New symbols are bootstrapped together
+    after a short debounce, and with a refresh interval all the symbols are
+    refreshed periodically with a single bulk request. All the resulting weights
+    are published at once.
+    """
+
+    def __init__(
+        self,
+        connector: Connector,
+        bus: MessageBus,
+        refresh_interval: Optional[float] = None,
+        debounce_s: float = 1,
+        max_backoff_s: float = 300,
+    ):
+        self.connector = connector
+        self.bus = bus
+        self.refresh_interval = refresh_interval
+        self.debounce_s = debounce_s
+        self.max_backoff_s = max_backoff_s
+
+        # connector symbol -> (symbol id, number of producers watching it)
+        self.watched: dict[str, tuple[int, int]] = {}
+        self._pending: dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.connector.name=})"
+
+    def watch(self, mapping: symbols.ConnectorSymbolMapping):
+        symbol_id, count = self.watched.get(mapping.connector_symbol, (0, 0))
+        self.watched[mapping.connector_symbol] = (mapping.symbol_id, count + 1)
+        if not count:
+            self._pending[mapping.connector_symbol] = mapping.symbol_id
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def unwatch(self, mapping: symbols.ConnectorSymbolMapping):
+        symbol_id, count = self.watched.get(mapping.connector_symbol, (0, 0))
+        if count > 1:
+            self.watched[mapping.connector_symbol] = (symbol_id, count - 1)
+        else:
+            self.watched.pop(mapping.connector_symbol, None)
+            self._pending.pop(mapping.connector_symbol, None)
+
+    async def run(self):
+        last_refresh = time.monotonic()
+        failures = 0
+        while self.watched:
+            await asyncio.sleep(min(self.debounce_s * 2**failures, self.max_backoff_s))
+
+            if (
+                self.refresh_interval
+                and time.monotonic() - last_refresh >= self.refresh_interval
+            ):
+                to_refresh = {
+                    cs: symbol_id for cs, (symbol_id, _) in self.watched.items()
+                }
+                last_refresh = time.monotonic()
+            else:
+                to_refresh = self._pending
+            self._pending = {}
+
+            if not to_refresh:
+                continue
+
+            try:
+                await self.refresh(to_refresh)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(
+                    f"Unable to refresh {self.connector.name} weights: {str(e)}"
+                )
+                for connector_symbol, symbol_id in to_refresh.items():
+                    if connector_symbol in self.watched:
+                        self._pending[connector_symbol] = symbol_id
+
+    async def refresh(self, to_refresh: dict[str, int]):
+        markets = await self.connector.do_get_markets(list(to_refresh))
+        await self.bus.weights.put_many(
+            [
+                SymbolWeightAdjust(
+                    connector=self.connector.name,
+                    symbol_id=to_refresh[connector_symbol],
+                    weight=float(market.volume_24h),
+                )
+                for connector_symbol, market in markets.items()
+                # Not the ones unwatched during the request, their weight is zero.
+                if connector_symbol in to_refresh and connector_symbol in self.watched
+            ]
+        )
@@ -1,9 +1,11 @@
-from typing import Optional
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from pydantic import (
+    BaseModel,
     PostgresDsn,
     RedisDsn,
+    model_validator,
 )
 
 import logging
@@ -14,17 +16,148 @@ def setup_logging():
     logging.getLogger().setLevel(logging.INFO)
 
 
+class PersistencePolicySettings(BaseModel):
+    """Which records of a database stream are persisted, for all its connectors or
+    one of them: all of them, the last of each interval, or those that moved by
+    at least `bps` basis points since the last persisted one."""
+
+    stream: Literal["spreads", "bbo", "mid_prices", "trades", "weights"]
+    connector: Optional[str] = None
+    policy: Literal["full", "latest_per_interval", "bps_change"]
+    interval_s: float = 1
+    bps: float = 1
+
+    @model_validator(mode="after")
+    def check_policy(self):
+        # Trades and weights have no key to keep the latest record of, or values to
+        # compare.
+        if self.stream in ("trades", "weights") and self.policy != "full":
+            raise ValueError(f"The {self.stream} stream only supports the full policy")
+        return self
+
+
 class FireAggSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
-    database_url: PostgresDsn
-    redis_url: RedisDsn
+    # Only required by the postgres storage, and by the distributed mode and API.
+    database_url: Optional[PostgresDsn] = None
+    redis_url: Optional[RedisDsn] = None
+
+    # "local" stores the symbols and the streams in files under the local storage
+    # dir, for single-node deployments and benchmarks without a Postgres server.
+    # Open segments are sealed into Parquet files every local_segment_s.
+    storage_backend: Literal["postgres", "local"] = "postgres"
+    local_storage_dir: str = "data"
+    local_segment_s: float = 300
 
     cryptowatch_pub_key: Optional[str] = None
     cryptowatch_private_key: Optional[str] = None
 
+    markets_cache_dir: str = ".cache/markets"
+    markets_cache_ttl_s: float = 6 * 3600
+
+    # Order book levels below this notional, in quote currency, are ignored when
+    # computing spreads.
+    spreads_min_notional: Optional[float] = None
+
+    # "trades" derives connector weights from the rolling traded volume, exchange
+    # tickers are then only used to bootstrap. "tickers" refreshes them periodically.
+    weights_source: Literal["trades", "tickers"] = "trades"
+    weights_refresh_interval_s: float = 500
+    rolling_weights_window_s: float = 3600
+    rolling_weights_publish_interval_s: float = 30
+
+    # The true price state is saved every interval to Redis or to a file, and
+    # restored on start. Weights and mid prices older than their max age are not.
+    true_price_checkpoint: Literal["none", "redis", "file"] = "none"
+    true_price_checkpoint_path: str = ".cache/true_price_checkpoint.json"
+    true_price_checkpoint_interval_s: float = 5
+    true_price_checkpoint_max_weight_age_s: float = 6 * 3600
+    true_price_checkpoint_max_mid_price_age_s: float = 30
+
+    # Quotes fetched longer than this before the latest spread of the symbol no
+    # longer count in its consolidated best bid and offer.
+    bbo_max_quote_age_s: Optional[float] = 60
+
+    # Pairs priced by chaining the true prices of other symbols, e.g. ["BTC/EUR"]
+    # from BTC/USDT and USDT/EUR, through up to max hops symbols.
+    cross_rate_targets: list[str] = []
+    cross_rate_max_hops: int = 3
+
+    # Workers init concurrently, with a lower limit per exchange to stay below its
+    # rate limits. Crashed workers restart with an exponential backoff.
+    worker_init_concurrency: int = 16
+    worker_init_per_connector: int = 2
+    worker_restart_backoff_s: float = 1
+    worker_restart_max_backoff_s: float = 60
+
+    # `distributed worker` cluster membership. Pairs are leased for the TTL and
+    # renewed every heartbeat. Pairs stay with their worker unless it is above the
+    # fair share of the cluster message rate by more than the tolerance.
+    cluster_heartbeat_s: float = 5
+    cluster_lease_ttl_s: float = 20
+    cluster_rebalance_tolerance: float = 0.2
+
+    # `distributed symbols` also watches or unwatches pairs at runtime from the
+    # commands of this Redis control channel, see `distributed control`.
+    control_channel: Optional[str] = None
+
     benchmark_trades_per_second_target: Optional[int] = None
 
+    # Recordings played back by the `_replay:<connector>` connectors. A speed of 0
+    # replays as fast as possible.
+    replay_dir: str = "recordings"
+    replay_speed: float = 1
+    replay_loop: bool = False
+
+    # History API responses are queried and streamed a page at a time: a number of
+    # buckets when downsampling, a time window for raw rows.
+    history_page_buckets: int = 5000
+    history_raw_page_s: float = 600
+
+    # The API serves the last true prices cached in Redis, unless older than the
+    # max age, e.g. when the core stopped writing them, then those of the storage.
+    # Without a Redis URL, it always reads the storage and can't stream prices.
+    api_max_last_price_age_s: Optional[float] = 60
+
+    # Closed chunks of the stream tables are archived to Parquet files, read a page
+    # at a time. With an archive dir, the distributed core archives them
+    # periodically, once they are older than the min age.
+    archive_dir: Optional[str] = None
+    archive_interval_s: float = 3600
+    archive_min_age_s: float = 7 * 86400
+    archive_page_s: float = 600
+    archive_drop_chunks: bool = False
+
+    # `fireagg backtest` starts from the last prices of the lookback before the
+    # range, reads the database a page at a time, and computes by blocks of events.
+    backtest_lookback_s: float = 3600
+    backtest_page_s: float = 3600
+    backtest_block_size: int = 250_000
+
+    # Per stream and connector, e.g. [{"stream": "spreads", "policy":
+    # "latest_per_interval", "interval_s": 1}]. The bus still gets every message.
+    persistence_policies: list[PersistencePolicySettings] = []
+
+    # Under overload, i.e. a bus queue deeper than its max or an event loop lagging
+    # more, the persistence of one more stream of the shedding order is degraded
+    # per check, and restored after recover_s below half of them: spreads and BBO
+    # are sampled every sample_s per connector and symbol, trades are conflated per
+    # side. True prices are never shed.
+    overload_shedding_order: list[Literal["spreads", "trades", "bbo"]] = [
+        "spreads",
+        "trades",
+    ]
+    overload_max_queue_depth: int = 10_000
+    overload_max_loop_lag_s: float = 0.5
+    overload_recover_s: float = 30
+    overload_sample_s: float = 1
+
+    # "auto" uses uvloop when it is installed.
+    event_loop: Literal["auto", "asyncio", "uvloop"] = "auto"
+    loop_lag_sample_interval_s: float = 0.25
+    slow_callback_s: float = 0.1
+
     enable_metrics_exporter: bool = False
     metrics_exporter_port: int = 9000
 
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+from typing import Iterable, Optional
+
+from fireagg.metrics import streaming_clients_gauge
+
+from .processing.messages import SymbolTrueMidPrice
+from .processing.queue_adapter import QueueAdapter
+
+logger = logging.getLogger(__name__)
+
+
+def encode_true_price(symbol: str, true_price: SymbolTrueMidPrice) -> str:
+    return json.dumps(
+        {
+            "symbol": symbol,
+            "timestamp_ms": true_price.timestamp_ms,
+            "true_mid_price": str(true_price.true_mid_price),
+        }
+    )
+
+
+class ClientSubscription:
+    """The updates waiting to be sent to one client.
+
+    Only the last update of each symbol is kept, so a slow client gets the latest
+    prices instead of an ever growing backlog.
+    """
+
+    def __init__(self):
+        self.symbol_ids: set[int] = set()
+        self._pending: dict[int, str] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, symbol_id: int, payload: str):
+        self._pending[symbol_id] = payload
+        self._ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> list[str]:
+        """Waits for updates, returns an empty list after `timeout`."""
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._ready.clear()
+        pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+
+class TruePriceBroadcaster:
+    """Fans out the true prices of a queue to the subscribed clients.
+
+    Each update is encoded once, and only handed to the clients of its symbol.
+    Pushing never waits on a client, so one slow client can't hold back others.
+    """
+
+    def __init__(self, queue: QueueAdapter[SymbolTrueMidPrice]):
+        self.queue = queue
+        self.subscriptions: dict[int, set[ClientSubscription]] = {}
+        self.symbols: dict[int, str] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}()"
+
+    async def run(self):
+        with self.queue.queue() as queue:
+            logger.info(f"{self} is live!")
+            while True:
+                true_price = await queue.get()
+                try:
+                    self.broadcast(true_price)
+                except Exception:
+                    # Skip the update rather than stop streaming to every client.
+                    logger.exception(f"{self} could not broadcast {true_price}")
+
+    def broadcast(self, true_price: SymbolTrueMidPrice):
+        clients = self.subscriptions.get(true_price.symbol_id)
+        if not clients:
+            return
+
+        payload = encode_true_price(self.symbols[true_price.symbol_id], true_price)
+        for client in clients:
+            client.push(true_price.symbol_id, payload)
+
+    def connect(self) -> ClientSubscription:
+        streaming_clients_gauge.inc()
+        return ClientSubscription()
+
+    def disconnect(self, client: ClientSubscription):
+        self.unsubscribe(client, list(client.symbol_ids))
+        streaming_clients_gauge.dec()
+
+    def subscribe(
+        self,
+        client: ClientSubscription,
+        symbols: dict[int, str],
+        last_values: Optional[dict[int, SymbolTrueMidPrice]] = None,
+    ):
+        """Subscribes to symbols by id, and sends their last value, if any, right
+        away."""
+        for symbol_id, symbol in symbols.items():
+            self.symbols[symbol_id] = symbol
+            self.subscriptions.setdefault(symbol_id, set()).add(client)
+            client.symbol_ids.add(symbol_id)
+
+            last_value = last_values and last_values.get(symbol_id)
+            if last_value:
+                client.push(symbol_id, encode_true_price(symbol, last_value))
+
+    def unsubscribe(self, client: ClientSubscription, symbol_ids: Iterable[int]):
+        for symbol_id in symbol_ids:
+            client.symbol_ids.discard(symbol_id)
+            clients = self.subscriptions.get(symbol_id)
+            if clients is None:
+                continue
+            clients.discard(client)
+            if not clients:
+                del self.subscriptions[symbol_id]
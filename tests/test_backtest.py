@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from fireagg.backtest import recompute_true_mid_prices
+from fireagg.processing.true_mid_price import SymbolTrueMidPriceProcessor
+
+# More connectors than `np.sum` adds at a time, in no particular order.
+CONNECTORS = [
+    "okx",
+    "binance",
+    "kraken",
+    "coinbase",
+    "bitstamp",
+    "gemini",
+    "bybit",
+    "kucoin",
+    "bitfinex",
+    "huobi",
+]
+
+
+def random_events(n_events: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Few distinct timestamps, so that weights and spreads often tie.
+    timestamps = np.sort(rng.integers(0, n_events // 3, n_events)).astype(float)
+    is_weight = rng.random(n_events) < 0.1
+    connectors = rng.choice(CONNECTORS, n_events)
+    weights = rng.choice([0.0, 1.0, 2.5, 10.0, 1234.5], n_events)
+    # Repeated prices, so that some updates leave the true price unchanged.
+    mid_prices = 100 + rng.integers(-20, 20, n_events) / 4
+
+    spreads = pd.DataFrame(
+        {
+            "timestamp_ms": timestamps[~is_weight],
+            "connector": connectors[~is_weight],
+            "mid_price": mid_prices[~is_weight],
+        }
+    )
+    weights = pd.DataFrame(
+        {
+            "timestamp_ms": timestamps[is_weight],
+            "connector": connectors[is_weight],
+            "weight": weights[is_weight],
+        }
+    )
+    return spreads, weights
+
+
+def replay_online(spreads: pd.DataFrame, weights: pd.DataFrame) -> pd.DataFrame:
+    """The true prices of the live processor, weights first on ties."""
+    events = pd.concat(
+        [weights.assign(kind=0), spreads.assign(kind=1)], ignore_index=True
+    ).sort_values(["timestamp_ms", "kind"], kind="stable")
+
+    processor = None
+    rows = []
+    for event in events.itertuples():
+        if event.kind == 0:
+            if processor is None:
+                processor = SymbolTrueMidPriceProcessor(1)
+            processor.set_connector_weight(event.connector, event.weight)
+        elif processor is not None:
+            true_price = processor.predict_if_changed(event.connector, event.mid_price)
+            if true_price is not None:
+                rows.append((event.timestamp_ms, float(true_price), event.connector))
+    return pd.DataFrame(
+        rows, columns=["timestamp_ms", "true_mid_price", "triggering_connector"]
+    )
+
+
+def test_recompute_matches_the_live_processor():
+    spreads, weights = random_events(3000)
+    expected = replay_online(spreads, weights)
+    # Small blocks, so that the state is carried over between blocks.
+    result = recompute_true_mid_prices(spreads, weights, block_size=128)
+
+    assert len(expected) > 100
+    np.testing.assert_array_equal(result["timestamp_ms"], expected["timestamp_ms"])
+    np.testing.assert_array_equal(result["true_mid_price"], expected["true_mid_price"])
+    np.testing.assert_array_equal(
+        result["triggering_connector"].astype(str), expected["triggering_connector"]
+    )
@@ -0,0 +1,49 @@
+import pytest
+
+from fireagg.input_streams.impl._benchmark import RateProfile
+
+
+def trade_times(profile: RateProfile, until_s: float) -> list[float]:
+    times = []
+    elapsed_s = profile.resume_s(0)
+    while elapsed_s is not None and elapsed_s < until_s:
+        times.append(elapsed_s)
+        elapsed_s = profile.next_trade_s(elapsed_s)
+    return times
+
+
+def test_ramp_from_zero():
+    profile = RateProfile(kind="ramp", base_rate=0, peak_rate=100, ramp_s=10)
+    times = trade_times(profile, 20)
+    assert times[0] > 0
+    # About the area under the ramp, then 100/s.
+    assert 1400 < len(times) < 1510
+
+
+def test_idle_burst_base():
+    profile = RateProfile(
+        kind="burst", base_rate=0, peak_rate=10, burst_every_s=10, burst_s=2
+    )
+    times = trade_times(profile, 30)
+    assert all(t % 10 < 2 for t in times)
+    # 10/s for 2s of every 10s, give or take the rounding of the steps.
+    assert 57 <= len(times) <= 63
+
+
+def test_zero_rate_never_trades():
+    assert trade_times(RateProfile(kind="flat", base_rate=0), 10) == []
+    profile = RateProfile(kind="burst", base_rate=0, peak_rate=0)
+    assert trade_times(profile, 10) == []
+
+
+@pytest.mark.parametrize(
+    "profile",
+    [
+        RateProfile(kind="bursts"),  # type: ignore[arg-type]
+        RateProfile(base_rate=-1),
+        RateProfile(kind="burst", burst_every_s=0),
+    ],
+)
+def test_invalid_profiles(profile: RateProfile):
+    with pytest.raises(ValueError):
+        profile.validate()
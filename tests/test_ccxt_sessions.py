@@ -0,0 +1,68 @@
+import asyncio
+
+from fireagg.input_streams.ccxt_sessions import ExchangeSession
+
+
+class FakeExchange:
+    """Resolves `watch_trades_for_symbols` on the next trades of any of its
+    symbols, as ccxt.pro does."""
+
+    has = {"watchTradesForSymbols": True}
+
+    def __init__(self):
+        self.trades: list[dict] = []
+        self.new_trades = asyncio.Event()
+        self.calls: list[list[str]] = []
+
+    def market(self, symbol: str):
+        return {"symbol": symbol}
+
+    def push(self, symbol: str, price: float):
+        self.trades.append({"symbol": symbol, "price": price})
+        self.new_trades.set()
+
+    async def watch_trades_for_symbols(self, symbols: list[str]):
+        self.calls.append(symbols)
+        while True:
+            trades = [t for t in self.trades if t["symbol"] in symbols]
+            if trades:
+                self.trades = [t for t in self.trades if t not in trades]
+                return trades
+            self.new_trades.clear()
+            await self.new_trades.wait()
+
+    async def close(self):
+        pass
+
+
+def fake_session():
+    session = ExchangeSession("kraken")
+    session.exchange = FakeExchange()  # type: ignore
+    session._markets_loaded = True
+    return session
+
+
+def test_symbols_added_later_dont_stall_behind_quiet_ones():
+    async def run():
+        session = fake_session()
+        exchange = session.exchange
+        quiet = session.watch_trades("QUIET/USD")
+        busy = session.watch_trades("BUSY/USD")
+
+        quiet_task = asyncio.ensure_future(quiet.__anext__())
+        await asyncio.sleep(0)
+        for price in [1, 2, 3]:
+            exchange.push("BUSY/USD", price)
+            trades = await asyncio.wait_for(busy.__anext__(), 1)
+            assert [t["price"] for t in trades] == [price]
+
+        assert not quiet_task.done()
+        exchange.push("QUIET/USD", 10)
+        trades = await asyncio.wait_for(quiet_task, 1)
+        assert [t["price"] for t in trades] == [10]
+        assert exchange.calls[-1] == ["BUSY/USD", "QUIET/USD"]
+
+        await quiet.aclose()
+        await busy.aclose()
+
+    asyncio.run(run())
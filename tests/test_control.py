@@ -0,0 +1,42 @@
+import asyncio
+
+from fireagg.processing.control import ControlChannel, ControlCommand
+from fireagg.processing.core import ProcessingCore
+
+
+def command(action: str, symbol: str = "BTC/USD"):
+    return ControlCommand(action=action, connector="kraken", symbol=symbol)
+
+
+def test_commands_of_one_batch_see_pending_producers():
+    async def run():
+        core = ProcessingCore()
+        channel = ControlChannel(core, client=None, channel="test")  # type: ignore
+
+        await channel.apply(command("watch"))
+        await channel.apply(command("watch"))
+        # The spreads and trades producers, once.
+        assert core.worker_queue.qsize() == 2
+        assert core.is_watching("kraken", "BTC/USD")
+
+        await channel.apply(command("unwatch"))
+        assert not core.is_watching("kraken", "BTC/USD")
+        await channel.apply(command("watch", "ETH/USD"))
+
+        # Only the producers that weren't unwatched start.
+        started = []
+
+        async def supervise(worker):
+            started.append((worker.connector.name, worker.symbol))
+            await asyncio.sleep(3600)
+
+        core._supervise = supervise  # type: ignore
+        task = asyncio.create_task(core.run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+
+        assert started == [("kraken", "ETH/USD"), ("kraken", "ETH/USD")]
+        assert core.is_watching("kraken", "ETH/USD")
+        assert not core.pending_producers
+
+    asyncio.run(run())
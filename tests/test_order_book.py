@@ -0,0 +1,20 @@
+from fireagg.input_streams.order_book import TopOfBookTracker
+
+
+def test_skips_levels_below_min_notional():
+    tracker = TopOfBookTracker(min_notional=100)
+    top = tracker.update([[10.0, 1.0], [9.0, 20.0]], [[11.0, 20.0]])
+    assert top == (9.0, 11.0)
+
+
+def test_falls_back_to_raw_top_without_large_enough_level():
+    tracker = TopOfBookTracker(min_notional=100)
+    # A book with only its top level, below the notional on both sides.
+    assert tracker.update([[10.0, 1.0]], [[11.0, 1.0]]) == (10.0, 11.0)
+    assert tracker.update([[10.0, 2.0]], [[11.0, 2.0]]) is None
+    assert tracker.update([[10.5, 1.0]], [[11.0, 1.0]]) == (10.5, 11.0)
+
+
+def test_empty_side_has_no_top():
+    tracker = TopOfBookTracker(min_notional=100)
+    assert tracker.update([], [[11.0, 20.0]]) is None
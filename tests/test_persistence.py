@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+import pydantic
+import pytest
+
+from fireagg.processing.messages import SymbolSpreads
+from fireagg.processing.persistence import StreamPersistence
+from fireagg.settings import PersistencePolicySettings
+
+
+def spread(timestamp_ms: float, bid: float = 100):
+    return SymbolSpreads(
+        connector="a",
+        symbol_id=1,
+        timestamp_ms=timestamp_ms,
+        fetch_timestamp_ms=timestamp_ms,
+        best_bid=Decimal(bid),
+        best_ask=Decimal(bid + 1),
+    )
+
+
+def latest_per_second():
+    persistence = StreamPersistence.from_settings(
+        "spreads",
+        [PersistencePolicySettings(stream="spreads", policy="latest_per_interval")],
+        key_fn=lambda s: (s.connector, s.symbol_id),
+        values_fn=lambda s: (float(s.best_bid), float(s.best_ask)),
+    )
+    assert persistence is not None
+    return persistence
+
+
+def test_latest_per_interval_keeps_the_last_record_of_each_interval():
+    persistence = latest_per_second()
+    first, last, next_interval = spread(1000), spread(1900), spread(2100)
+
+    assert persistence.apply([first, last]) == []
+    assert persistence.pop_skipped() == 1
+    assert persistence.apply([next_interval]) == [last]
+    # Held until the interval after the next one is over.
+    assert persistence.due(3999) == []
+    assert persistence.due(4000) == [next_interval]
+
+
+def test_drain_returns_the_held_records():
+    persistence = latest_per_second()
+    held = spread(1000)
+
+    assert persistence.apply([held]) == []
+    assert persistence.drain() == [held]
+    assert persistence.drain() == []
+
+
+def test_settings_reject_unsupported_policies():
+    with pytest.raises(pydantic.ValidationError):
+        PersistencePolicySettings(stream="trades", policy="latest_per_interval")
+    PersistencePolicySettings(stream="weights", policy="full")
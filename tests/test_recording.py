@@ -0,0 +1,45 @@
+import asyncio
+import shutil
+from decimal import Decimal
+
+from fireagg.database.symbols import ConnectorSymbolMapping
+from fireagg.input_streams.base import Trade
+from fireagg.input_streams.impl._replay import _replay
+from fireagg.input_streams.recording import TRADES_STREAM, StreamRecorder
+
+MAPPING = ConnectorSymbolMapping(
+    symbol="BTC/USD",
+    base_asset="BTC",
+    quote_asset="USD",
+    symbol_id=1,
+    connector="kraken",
+    connector_symbol="BTC/USD",
+    is_unavailable=False,
+)
+
+
+def trade(timestamp_ms: float):
+    return Trade(
+        timestamp_ms=timestamp_ms, price=Decimal(100), amount=Decimal(2), is_buy=True
+    )
+
+
+def test_killed_recording_replays_up_to_its_last_checkpoint(tmp_path):
+    recorder = StreamRecorder(str(tmp_path / "live"), checkpoint_interval_s=0)
+    stream = recorder.stream(MAPPING, TRADES_STREAM)
+    for i in range(3):
+        stream.write_trade(trade(recorder.start_ms + i))
+    recorder.checkpoint_if_due()
+    # What is on disk when the process is killed, without closing the recorder.
+    shutil.copytree(tmp_path / "live", tmp_path / "killed")
+    stream.close()
+
+    connector = _replay("_replay:kraken", directory=str(tmp_path / "killed"))
+    recorded = connector._get_stream("BTC/USD", TRADES_STREAM)
+    assert recorded["count"] == 3
+    assert recorded["volume"] == "6"
+    assert [fields for _, fields in connector._read(recorded["path"])] == [
+        ["100", "2", "1"]
+    ] * 3
+    market = asyncio.run(connector.do_get_market("BTC/USD"))
+    assert market.volume_24h > 0
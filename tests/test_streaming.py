@@ -0,0 +1,54 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from fireagg.app import parse_command
+from fireagg.processing.messages import SymbolTrueMidPrice
+from fireagg.processing.queue_adapter import AsyncioQueueAdapter
+from fireagg.streaming import TruePriceBroadcaster
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["not json", "[]", '"x"', '{"subscribe": "BTC-USD"}', '{"watch": ["BTC-USD"]}'],
+)
+def test_invalid_commands(text: str):
+    with pytest.raises(ValueError):
+        parse_command(text)
+
+
+def test_command():
+    assert parse_command('{"subscribe": ["BTC-USD"], "unsubscribe": []}') == {
+        "subscribe": ["BTC-USD"],
+        "unsubscribe": [],
+    }
+
+
+def true_price(symbol_id: int):
+    return SymbolTrueMidPrice(
+        symbol_id=symbol_id,
+        timestamp_ms=0,
+        true_mid_price=Decimal(1),
+        triggering_spread_message_id="",
+    )
+
+
+def test_broadcaster_survives_a_failed_update():
+    async def run():
+        queue = AsyncioQueueAdapter[SymbolTrueMidPrice]()
+        broadcaster = TruePriceBroadcaster(queue)
+        client = broadcaster.connect()
+        broadcaster.subscribe(client, {1: "BTC/USD", 2: "ETH/USD"})
+        # Subscribed without a symbol name, encoding its updates fails.
+        broadcaster.subscriptions[3] = {client}
+
+        task = asyncio.create_task(broadcaster.run())
+        await asyncio.sleep(0)
+        await queue.put(true_price(3))
+        await queue.put(true_price(1))
+        payloads = await asyncio.wait_for(client.get(), 1)
+        task.cancel()
+        assert len(payloads) == 1 and "BTC/USD" in payloads[0]
+
+    asyncio.run(run())
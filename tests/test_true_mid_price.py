@@ -0,0 +1,101 @@
+import asyncio
+from decimal import Decimal
+
+from fireagg.processing.checkpoints import CheckpointStore
+from fireagg.processing.message_bus import AsyncioMessageBus
+from fireagg.processing.messages import now_ms
+from fireagg.processing.true_mid_price import TrueMidPrice
+
+HOUR_MS = 3600 * 1000
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self, state):
+        self.state = state
+
+    async def load(self):
+        return self.state
+
+    async def save(self, state):
+        self.state = state
+
+
+def restore(checkpoint: dict):
+    worker = TrueMidPrice(
+        AsyncioMessageBus(),
+        checkpoints=MemoryCheckpointStore(checkpoint),
+        max_weight_age_s=6 * 3600,
+        max_mid_price_age_s=30,
+    )
+    asyncio.run(worker.init())
+    return worker
+
+
+def test_restore_with_mixed_weight_and_mid_price_ages():
+    now = now_ms()
+    worker = restore(
+        {
+            "timestamp_ms": now,
+            "symbols": {
+                "1": {
+                    # b's weight is too old, its mid price is not.
+                    "weights": {"a": [1.0, now], "b": [2.0, now - 7 * HOUR_MS]},
+                    "mid_prices": {"a": [100.0, now], "b": [110.0, now]},
+                },
+                "2": {
+                    # Without any recent weight, the symbol starts cold.
+                    "weights": {"a": [1.0, now - 7 * HOUR_MS]},
+                    "mid_prices": {"a": [100.0, now]},
+                },
+            },
+        }
+    )
+
+    assert list(worker.symbols) == [1]
+    processor = worker.symbols[1]
+    assert processor.weights.to_dict() == {"a": 1.0}
+    assert processor.last_mid_prices.to_dict() == {"a": 100.0}
+
+    # Spreads of either connector still price the symbol, b without weight.
+    assert processor.predict_if_changed("a", Decimal(101)) == Decimal(101)
+    assert processor.predict_if_changed("b", Decimal(111)) is None
+    assert processor.weights["b"] == 0.0
+
+    processor.set_connector_weight("b", 1.0)
+    assert processor.predict_if_changed("b", Decimal(111)) == Decimal(106)
+
+
+def test_restore_drops_stale_mid_prices():
+    now = now_ms()
+    worker = restore(
+        {
+            "timestamp_ms": now,
+            "symbols": {
+                "1": {
+                    "weights": {"a": [1.0, now], "b": [1.0, now]},
+                    "mid_prices": {"a": [100.0, now], "b": [110.0, now - 60_000]},
+                },
+            },
+        }
+    )
+
+    processor = worker.symbols[1]
+    assert processor.last_mid_prices.dropna().to_dict() == {"a": 100.0}
+    assert processor.predict_if_changed("a", Decimal(102)) == Decimal(102)
+
+
+def test_run_cancels_its_monitors_on_exit():
+    async def run():
+        worker = TrueMidPrice(
+            AsyncioMessageBus(), checkpoints=MemoryCheckpointStore(None)
+        )
+        for _ in range(3):
+            # As the supervisor restarting a crashed worker.
+            task = asyncio.create_task(worker.run())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+import asyncio
+from decimal import Decimal
+
+from fireagg.processing.message_bus import AsyncioMessageBus
+from fireagg.processing.messages import SymbolTrade, SymbolWeightAdjust, now_ms
+from fireagg.processing.volume_weights import RollingVolumeWeights
+
+
+def trade(connector: str, fetch_timestamp_ms: float):
+    return SymbolTrade(
+        connector=connector,
+        symbol_id=1,
+        timestamp_ms=fetch_timestamp_ms,
+        fetch_timestamp_ms=fetch_timestamp_ms,
+        price=Decimal(100),
+        amount=Decimal(1),
+        is_buy=True,
+    )
+
+
+def test_zero_weight_stops_the_rolling_weight():
+    async def run():
+        bus = AsyncioMessageBus()
+        worker = RollingVolumeWeights(bus, publish_interval_s=3600, min_elapsed_s=0)
+        task = asyncio.create_task(worker.run())
+        await asyncio.sleep(0)
+
+        started_ms = now_ms() - 60_000
+        await bus.trades.put(trade("a", started_ms))
+        await bus.trades.put(trade("b", started_ms))
+        await asyncio.sleep(0.01)
+        assert set(worker.volumes) == {("a", 1), ("b", 1)}
+
+        # a is unwatched, a trade fetched before still comes after.
+        stopped_ms = now_ms()
+        await bus.weights.put(
+            SymbolWeightAdjust(
+                connector="a", symbol_id=1, weight=0.0, timestamp_ms=stopped_ms
+            )
+        )
+        await asyncio.sleep(0.01)
+        await bus.trades.put(trade("a", stopped_ms - 1))
+        await asyncio.sleep(0.01)
+        assert set(worker.volumes) == {("b", 1)}
+
+        with bus.weights.queue() as weights:
+            await worker.publish()
+            published = weights.get_nowait()
+        assert (published.connector, published.weight > 0) == ("b", True)
+
+        # Watched again.
+        await bus.trades.put(trade("a", stopped_ms + 1))
+        await asyncio.sleep(0.01)
+        assert set(worker.volumes) == {("a", 1), ("b", 1)}
+
+        worker.running = False
+        task.cancel()
+
+    asyncio.run(run())